@@ -1,152 +1,101 @@
-import json
 import os
 from typing import Dict, Any
-from urllib.parse import urlencode, parse_qs
+from urllib.parse import urlencode
 import uuid
-import time
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    '''
-    Обработка OAuth авторизации через Яндекс ID
-    Аргументы: event с httpMethod, queryStringParameters
-    Возвращает: HTTP ответ с редиректом или данными пользователя
-    '''
-    method: str = event.get('httpMethod', 'GET')
+from runtime import App, Request, error_response, json_response
+
+app = App()
+
+def login(request: Request) -> Dict[str, Any]:
+    '''Ссылка на авторизацию в Яндекс ID'''
+    client_id = os.environ.get('YANDEX_CLIENT_ID')
+    redirect_uri = request.params.get('redirect_uri', 'https://your-domain.com/api/auth/callback')
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    if not client_id:
+        return error_response(500, 'OAuth not configured')
     
-    params = event.get('queryStringParameters') or {}
-    action = params.get('action', 'mock')
+    state = str(uuid.uuid4())
+    query_params = urlencode({
+        'response_type': 'code',
+        'client_id': client_id,
+        'redirect_uri': redirect_uri,
+        'state': state
+    })
+    auth_url = f"https://oauth.yandex.ru/authorize?{query_params}"
     
-    if action == 'login':
-        client_id = os.environ.get('YANDEX_CLIENT_ID')
-        redirect_uri = params.get('redirect_uri', 'https://your-domain.com/api/auth/callback')
-        
-        if not client_id:
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'OAuth not configured'}),
-                'isBase64Encoded': False
-            }
-        
-        state = str(uuid.uuid4())
-        query_params = urlencode({
-            'response_type': 'code',
-            'client_id': client_id,
-            'redirect_uri': redirect_uri,
-            'state': state
-        })
-        auth_url = f"https://oauth.yandex.ru/authorize?{query_params}"
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'url': auth_url, 'state': state}),
-            'isBase64Encoded': False
-        }
+    return json_response({'url': auth_url, 'state': state})
+
+def callback(request: Request) -> Dict[str, Any]:
+    '''Обмен кода авторизации на пользователя'''
+    code = request.params.get('code')
+    
+    if not code:
+        return error_response(400, 'No authorization code')
+    
+    mock_user = {
+        'id': str(uuid.uuid4()),
+        'name': 'Пользователь Яндекса',
+        'email': 'user@yandex.ru',
+        'avatar': '👤',
+        'provider': 'yandex'
+    }
     
-    if action == 'callback':
-        code = params.get('code')
-        
-        if not code:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'No authorization code'}),
-                'isBase64Encoded': False
-            }
-        
-        mock_user = {
+    return json_response(mock_user)
+
+def mock(request: Request) -> Dict[str, Any]:
+    '''Тестовый пользователь выбранного провайдера'''
+    provider = request.params.get('provider', 'google')
+    
+    mock_users = {
+        'google': {
+            'id': str(uuid.uuid4()),
+            'name': 'Алексей Иванов',
+            'email': 'alexey@gmail.com',
+            'avatar': '👨🏻',
+            'provider': 'google'
+        },
+        'vk': {
             'id': str(uuid.uuid4()),
-            'name': 'Пользователь Яндекса',
-            'email': 'user@yandex.ru',
-            'avatar': '👤',
+            'name': 'Мария Петрова',
+            'email': 'maria@vk.com',
+            'avatar': '👩🏻',
+            'provider': 'vk'
+        },
+        'yandex': {
+            'id': str(uuid.uuid4()),
+            'name': 'Дмитрий Сидоров',
+            'email': 'dmitry@ya.ru',
+            'avatar': '👨🏼',
             'provider': 'yandex'
+        },
+        'telegram': {
+            'id': str(uuid.uuid4()),
+            'name': 'Анна Смирнова',
+            'email': 'anna@t.me',
+            'avatar': '👩🏼',
+            'provider': 'telegram'
         }
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps(mock_user),
-            'isBase64Encoded': False
-        }
+    }
     
-    if action == 'mock':
-        provider = params.get('provider', 'google')
-        
-        mock_users = {
-            'google': {
-                'id': str(uuid.uuid4()),
-                'name': 'Алексей Иванов',
-                'email': 'alexey@gmail.com',
-                'avatar': '👨🏻',
-                'provider': 'google'
-            },
-            'vk': {
-                'id': str(uuid.uuid4()),
-                'name': 'Мария Петрова',
-                'email': 'maria@vk.com',
-                'avatar': '👩🏻',
-                'provider': 'vk'
-            },
-            'yandex': {
-                'id': str(uuid.uuid4()),
-                'name': 'Дмитрий Сидоров',
-                'email': 'dmitry@ya.ru',
-                'avatar': '👨🏼',
-                'provider': 'yandex'
-            },
-            'telegram': {
-                'id': str(uuid.uuid4()),
-                'name': 'Анна Смирнова',
-                'email': 'anna@t.me',
-                'avatar': '👩🏼',
-                'provider': 'telegram'
-            }
-        }
-        
-        user = mock_users.get(provider, mock_users['google'])
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps(user),
-            'isBase64Encoded': False
-        }
+    user = mock_users.get(provider, mock_users['google'])
     
-    return {
-        'statusCode': 404,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps({'error': 'Not found'}),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+    return json_response(user)
+
+ACTIONS = {'login': login, 'callback': callback, 'mock': mock}
+
+# action приходит в query-строке и для GET, и для POST, поэтому выбор по нему внутри одного маршрута
+@app.route(('GET', 'POST'))
+def auth(request: Request) -> Dict[str, Any]:
+    view = ACTIONS.get(request.params.get('action', 'mock'))
+    if view is None:
+        return error_response(404, 'Not found')
+    return view(request)
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Обработка OAuth авторизации через Яндекс ID
+    Аргументы: event с httpMethod, queryStringParameters
+    Возвращает: HTTP ответ с редиректом или данными пользователя
+    '''
+    return app(event, context)
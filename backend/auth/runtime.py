@@ -0,0 +1,478 @@
+'''
+Общая обвязка функций: декларативные маршруты, CORS/OPTIONS, ответы и быстрый JSON
+Одинаковая копия лежит в каждой функции (auth, profiles, chat, likes, upload-photo), функции деплоятся по отдельности
+JSON через orjson, если он установлен, иначе stdlib с тем же форматом: даты в ISO 8601, Decimal числом, UTF-8 без экранирования
+Каждый вызов пишет в stdout одну JSON-строку с замерами: общее время, подключение к базе, запросы, S3, размер ответа
+Тёплое подключение к базе живёт между вызовами контейнера: get_db/release_db передаются в App как connect/release
+'''
+import base64
+import json
+import os
+import random
+import threading
+from datetime import date, datetime, time
+from decimal import Decimal
+from time import monotonic, perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+# Значение условия маршрута: параметр есть и не пустой
+ANY = object()
+
+# REQUEST_LOG=0 отключает строку лога; запросы дольше SLOW_QUERY_MS попадают в неё текстом,
+# доля SLOW_QUERY_EXPLAIN_RATE из медленных SELECT дополнительно получает EXPLAIN (ANALYZE, BUFFERS)
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_RATE', '0'))
+SLOW_QUERY_TEXT_LIMIT = 2000
+
+DB_MAX_IDLE_SECONDS = float(os.environ.get('DB_MAX_IDLE_SECONDS', '300'))
+DB_PING_AFTER_SECONDS = float(os.environ.get('DB_PING_AFTER_SECONDS', '30'))
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    def dumps(value: Any) -> str:
+        '''Сериализовать в JSON; строки из RealDictCursor кодируются как есть, без копирования в dict'''
+        return orjson.dumps(value, default=_default).decode()
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), check_circular=False, default=_default)
+
+    def dumps(value: Any) -> str:
+        '''Сериализовать в JSON; строки из RealDictCursor кодируются как есть, без копирования в dict'''
+        return _encoder.encode(value)
+
+
+def response(status: int, body: str = '', headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    '''Ответ платформе с CORS-заголовком'''
+    return {
+        'statusCode': status,
+        'headers': {**JSON_HEADERS, **(headers or {})},
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+def json_response(payload: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    '''JSON-ответ; payload может быть уже сериализованной строкой'''
+    return response(status, payload if isinstance(payload, str) else dumps(payload), headers)
+
+
+def error_response(status: int, message: str) -> Dict[str, Any]:
+    return json_response({'error': message}, status)
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    '''Упаковать позицию (created_at, id) в непрозрачный курсор'''
+    raw = json.dumps([created_at.isoformat(), row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    '''Распаковать курсор в позицию (created_at, id), None если курсор повреждён'''
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_limit(value: Optional[str], default: int = 50, maximum: int = 100) -> Optional[int]:
+    '''Размер страницы из параметра limit, None если значение неверное'''
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        return None
+    if limit < 1:
+        return None
+    return min(limit, maximum)
+
+
+class Metrics:
+    '''Замеры одного вызова; S3 может вызываться из пула потоков, поэтому его счётчики под блокировкой'''
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.total_ms: Optional[float] = None
+        self.route: Optional[str] = None
+        self.error: Optional[str] = None
+        self.db_connect_ms = 0.0
+        self.queries = 0
+        self.query_ms = 0.0
+        self.query_rows = 0
+        self.slow_queries: List[Dict[str, Any]] = []
+        self.explain: List[Tuple[Dict[str, Any], bytes]] = []
+        self.s3_calls = 0
+        self.s3_ms = 0.0
+        self._lock = threading.Lock()
+
+    def finish(self) -> None:
+        if self.total_ms is None:
+            self.total_ms = (perf_counter() - self.started) * 1000
+
+    def add_query(self, cursor: Any, statement: Any, elapsed: float) -> None:
+        '''statement — текст запроса без параметров: в лог не попадают email, переписка и прочие значения'''
+        ms = elapsed * 1000
+        rows = max(cursor.rowcount, 0)
+        self.queries += 1
+        self.query_ms += ms
+        self.query_rows += rows
+        if ms < SLOW_QUERY_MS:
+            return
+        text = statement.decode(errors='replace') if isinstance(statement, bytes) else str(statement)
+        slow = {'ms': round(ms, 1), 'rows': rows, 'sql': ' '.join(text.split())[:SLOW_QUERY_TEXT_LIMIT]}
+        # EXPLAIN ANALYZE выполняет запрос ещё раз, поэтому только для чтения
+        if slow['sql'].upper().startswith('SELECT') and cursor.query and random.random() < SLOW_QUERY_EXPLAIN_RATE:
+            self.explain.append((slow, cursor.query))
+        self.slow_queries.append(slow)
+
+    def add_s3(self, elapsed: float) -> None:
+        with self._lock:
+            self.s3_calls += 1
+            self.s3_ms += elapsed * 1000
+
+    def log_line(self, event: Dict[str, Any], context: Any, result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        body = (result or {}).get('body') or ''
+        line = {
+            'type': 'request',
+            'function': getattr(context, 'function_name', None),
+            'request_id': getattr(context, 'request_id', None),
+            'method': event.get('httpMethod', 'GET'),
+            'route': self.route,
+            'status': result['statusCode'] if result else 500,
+            'total_ms': round(self.total_ms, 2),
+            'db_connect_ms': round(self.db_connect_ms, 2),
+            'queries': self.queries,
+            'query_ms': round(self.query_ms, 2),
+            'query_rows': self.query_rows,
+            's3_calls': self.s3_calls,
+            's3_ms': round(self.s3_ms, 2),
+            'response_bytes': len(body.encode()) if isinstance(body, str) else len(body)
+        }
+        if self.slow_queries:
+            line['slow_queries'] = self.slow_queries
+        if self.error:
+            line['error'] = self.error
+        return line
+
+
+# Замеры текущего вызова; контейнер функции обрабатывает один вызов за раз
+_metrics: Optional[Metrics] = None
+
+_cursor_classes: Dict[type, type] = {}
+
+
+def instrumented_cursor(base: Optional[type]) -> type:
+    '''Подкласс курсора psycopg2, засекающий execute/executemany; psycopg2 к этому моменту уже загружен подключением'''
+    if base is None:
+        from psycopg2.extensions import cursor as base
+    cls = _cursor_classes.get(base)
+    if cls is None:
+        class InstrumentedCursor(base):
+            def execute(self, query, vars=None):
+                started = perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    if _metrics is not None:
+                        _metrics.add_query(self, query, perf_counter() - started)
+
+            def executemany(self, query, vars_list):
+                started = perf_counter()
+                try:
+                    return super().executemany(query, vars_list)
+                finally:
+                    if _metrics is not None:
+                        _metrics.add_query(self, query, perf_counter() - started)
+
+        cls = _cursor_classes[base] = InstrumentedCursor
+    return cls
+
+
+def _s3_call_started(context: Dict[str, Any], **kwargs: Any) -> None:
+    context['runtime_started'] = perf_counter()
+
+
+def _s3_call_finished(context: Dict[str, Any], **kwargs: Any) -> None:
+    started = context.pop('runtime_started', None)
+    metrics = _metrics
+    if started is not None and metrics is not None:
+        metrics.add_s3(perf_counter() - started)
+
+
+def instrument_s3(client: Any) -> Any:
+    '''Учитывать вызовы S3-клиента botocore в замерах текущего вызова'''
+    events = client.meta.events
+    events.register('before-call.s3', _s3_call_started)
+    events.register('after-call.s3', _s3_call_finished)
+    events.register('after-call-error.s3', _s3_call_finished)
+    return client
+
+
+_conn = None
+_conn_last_used = 0.0
+_direct_conn = None
+
+
+def get_db():
+    '''Получить подключение к базе данных, переиспользуя тёплое подключение контейнера'''
+    global _conn, _conn_last_used
+    # psycopg2 грузится первым обращением к базе: OPTIONS, 405 и ошибки валидации без него
+    import psycopg2
+    now = monotonic()
+    if _conn is not None:
+        idle = now - _conn_last_used
+        if _conn.closed or idle > DB_MAX_IDLE_SECONDS:
+            close_db()
+        elif idle > DB_PING_AFTER_SECONDS:
+            try:
+                with _conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                _conn.rollback()
+            except psycopg2.Error:
+                close_db()
+    if _conn is None:
+        _conn = psycopg2.connect(os.environ.get('DATABASE_POOLER_URL') or os.environ['DATABASE_URL'])
+    _conn_last_used = now
+    return _conn
+
+
+def release_db(conn) -> None:
+    '''Вернуть подключение после запроса: откатить незавершённую транзакцию, сломанное закрыть'''
+    global _conn_last_used
+    import psycopg2
+    try:
+        conn.rollback()
+    except psycopg2.Error:
+        close_db()
+        return
+    if conn.closed:
+        close_db()
+        return
+    _conn_last_used = monotonic()
+
+
+def close_db() -> None:
+    '''Закрыть подключения контейнера, следующий get_db() откроет новое'''
+    global _conn
+    import psycopg2
+    if _conn is not None:
+        try:
+            _conn.close()
+        except psycopg2.Error:
+            pass
+    _conn = None
+    close_direct_db()
+
+
+def get_direct_db():
+    '''
+    Отдельное прямое подключение (DATABASE_URL) в autocommit для состояния сессии, например LISTEN
+    Пулер в режиме транзакций (DATABASE_POOLER_URL) после коммита отдаёт серверное подключение другому клиенту,
+    и состояние сессии вместе с уведомлениями уходит туда же
+    '''
+    global _direct_conn
+    import psycopg2
+    if _direct_conn is None or _direct_conn.closed:
+        _direct_conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        _direct_conn.autocommit = True
+    return _direct_conn
+
+
+def close_direct_db() -> None:
+    '''Закрыть прямое подключение, следующий get_direct_db() откроет новое'''
+    global _direct_conn
+    import psycopg2
+    if _direct_conn is not None:
+        try:
+            _direct_conn.close()
+        except psycopg2.Error:
+            pass
+    _direct_conn = None
+
+
+class Request:
+    '''Разобранное событие платформы; подключение к базе открывается при первом обращении к conn'''
+
+    def __init__(self, app: 'App', event: Dict[str, Any], metrics: Metrics):
+        self.app = app
+        self.event = event
+        self.metrics = metrics
+        self.method: str = event.get('httpMethod', 'GET')
+        self.params: Dict[str, str] = event.get('queryStringParameters') or {}
+        self._body: Optional[Dict[str, Any]] = None
+        self._conn = None
+        self._cursors: List[Any] = []
+
+    @property
+    def body(self) -> Dict[str, Any]:
+        if self._body is None:
+            self._body = json.loads(self.event.get('body') or '{}')
+        return self._body
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            started = perf_counter()
+            self._conn = self.app.connect()
+            self.metrics.db_connect_ms += (perf_counter() - started) * 1000
+        return self._conn
+
+    def cursor(self, dict_rows: bool = False, **kwargs):
+        '''Курсор текущего подключения с замером запросов, закрывается после ответа; dict_rows — строки словарями'''
+        factory = kwargs.get('cursor_factory') or self.conn.cursor_factory
+        if dict_rows:
+            from psycopg2.extras import RealDictCursor as factory
+        kwargs['cursor_factory'] = instrumented_cursor(factory)
+        cur = self.conn.cursor(**kwargs)
+        self._cursors.append(cur)
+        return cur
+
+    def explain_slow_queries(self) -> None:
+        '''Планы отобранных медленных запросов; транзакция ответа к этому времени уже завершена или не нужна'''
+        for slow, query in self.metrics.explain:
+            try:
+                self._conn.rollback()
+                with self._conn.cursor() as cur:
+                    cur.execute(b'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query)
+                    slow['plan'] = cur.fetchone()[0][0]
+                self._conn.rollback()
+            except Exception as e:
+                slow['explain_error'] = str(e)
+
+    def close(self) -> None:
+        self.metrics.finish()
+        for cur in self._cursors:
+            cur.close()
+        if self._conn is not None:
+            if self.metrics.explain:
+                self.explain_slow_queries()
+            self.app.release(self._conn)
+
+
+class Route:
+    def __init__(self, methods: Tuple[str, ...], view: Callable[[Request], Dict[str, Any]], match: Dict[str, Any]):
+        self.methods = methods
+        self.view = view
+        self.match = match
+
+    def matches(self, request: Request) -> bool:
+        # GET выбирается по query-параметрам, остальные методы — по полям JSON-тела
+        source = request.params if request.method == 'GET' else request.body
+        for key, expected in self.match.items():
+            value = source.get(key)
+            if expected is ANY:
+                if not value:
+                    return False
+            elif isinstance(expected, tuple):
+                if value not in expected:
+                    return False
+            elif value != expected:
+                return False
+        return True
+
+
+class App:
+    '''
+    Маршрутизатор функции: маршруты проверяются в порядке объявления, первый подходящий отвечает
+    connect/release — get_db/release_db функции, если ей нужна база
+    '''
+
+    def __init__(self, connect: Optional[Callable[[], Any]] = None, release: Optional[Callable[[Any], None]] = None,
+                 allow_headers: str = 'Content-Type', expose_errors: bool = False):
+        self.connect = connect
+        self.release = release
+        self.allow_headers = allow_headers
+        self.expose_errors = expose_errors
+        self.routes: List[Route] = []
+
+    def route(self, methods: Tuple[str, ...], **match: Any) -> Callable:
+        def register(view: Callable[[Request], Dict[str, Any]]) -> Callable[[Request], Dict[str, Any]]:
+            self.routes.append(Route(methods, view, match))
+            return view
+        return register
+
+    def get(self, **match: Any) -> Callable:
+        return self.route(('GET',), **match)
+
+    def post(self, **match: Any) -> Callable:
+        return self.route(('POST',), **match)
+
+    def allowed_methods(self) -> List[str]:
+        methods = []
+        for route in self.routes:
+            methods.extend(method for method in route.methods if method not in methods)
+        return methods + ['OPTIONS']
+
+    def __call__(self, event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        global _metrics
+        metrics = _metrics = Metrics()
+        result = None
+        try:
+            result = self.dispatch(event, metrics)
+            return result
+        except Exception as e:
+            metrics.error = type(e).__name__
+            raise
+        finally:
+            _metrics = None
+            metrics.finish()
+            if REQUEST_LOG:
+                print(dumps(metrics.log_line(event, context, result)), flush=True)
+
+    def dispatch(self, event: Dict[str, Any], metrics: Metrics) -> Dict[str, Any]:
+        method = event.get('httpMethod', 'GET')
+        if method == 'OPTIONS':
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': ', '.join(self.allowed_methods()),
+                    'Access-Control-Allow-Headers': self.allow_headers,
+                    'Access-Control-Max-Age': '86400'
+                },
+                'body': '',
+                'isBase64Encoded': False
+            }
+
+        routes = [route for route in self.routes if method in route.methods]
+        if not routes:
+            return error_response(405, 'Method not allowed')
+
+        request = Request(self, event, metrics)
+        try:
+            if method != 'GET':
+                try:
+                    valid = isinstance(request.body, dict)
+                except ValueError:
+                    valid = False
+                if not valid:
+                    return error_response(400, 'Invalid JSON body')
+            for route in routes:
+                if route.matches(request):
+                    metrics.route = route.view.__name__
+                    return route.view(request)
+            return error_response(404, 'Not found')
+        except Exception as e:
+            if not self.expose_errors:
+                raise
+            metrics.error = type(e).__name__
+            return error_response(500, str(e))
+        finally:
+            request.close()
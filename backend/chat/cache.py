@@ -0,0 +1,242 @@
+'''
+Кэш ответов GET с ETag и инвалидацией по тегам; одинаковая копия лежит в profiles, likes и chat
+Внутренний уровень — TTL/LRU в памяти контейнера; внешний включается через CACHE_URL:
+redis://... (пакет redis нужно добавить в requirements.txt функции) или file:///path — локальная замена для тестов
+Ключ записи содержит токены её тегов, поэтому запись неизменяема, а invalidate() просто меняет токен тега
+'''
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', '300'))
+CACHE_LOCAL_TTL_SECONDS = float(os.environ.get('CACHE_LOCAL_TTL_SECONDS', '5'))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '2048'))
+TAG_TTL_SECONDS = 7 * 24 * 3600
+
+
+class LocalStore:
+    '''Словарь в памяти контейнера с TTL и вытеснением давно не читанных записей'''
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # ключ -> (момент истечения по time.monotonic(), значение)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        now = time.monotonic()
+        values = []
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None or entry[0] < now:
+                    self.entries.pop(key, None)
+                    values.append(None)
+                else:
+                    self.entries.move_to_end(key)
+                    values.append(entry[1])
+        return values
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def add(self, key: str, value: str, ttl: float) -> str:
+        '''Записать, только если ключа нет; вернуть значение, которое в итоге лежит под ключом'''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                return entry[1]
+        self.set(key, value, ttl)
+        return value
+
+
+class FileStore:
+    '''Внешний уровень на файлах: общий для процессов и экземпляров модуля, заменяет Redis в тестах'''
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.blake2b(key.encode(), digest_size=16).hexdigest())
+
+    def _read(self, key: str) -> Optional[str]:
+        try:
+            with open(self._file(key), encoding='utf-8') as f:
+                expires_at, _, value = f.read().partition('\n')
+        except FileNotFoundError:
+            return None
+        return value if float(expires_at) >= time.time() else None
+
+    def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        return [self._read(key) for key in keys]
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        tmp = f'{self._file(key)}.{os.urandom(16).hex()}'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(f'{time.time() + ttl}\n{value}')
+        os.replace(tmp, self._file(key))
+
+    def add(self, key: str, value: str, ttl: float) -> str:
+        current = self._read(key)
+        if current is not None:
+            return current
+        self.set(key, value, ttl)
+        return value
+
+
+class RedisStore:
+    '''Внешний уровень в Redis; недоступный Redis означает промах кэша, а не ошибку запроса'''
+
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self.errors = redis.RedisError
+
+    def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        try:
+            return [value.decode() if value is not None else None for value in self.client.mget(keys)]
+        except self.errors:
+            return [None] * len(keys)
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        try:
+            self.client.set(key, value, ex=max(1, int(ttl)))
+        except self.errors:
+            pass
+
+    def add(self, key: str, value: str, ttl: float) -> str:
+        try:
+            if self.client.set(key, value, ex=max(1, int(ttl)), nx=True):
+                return value
+            return (self.client.get(key) or value.encode()).decode()
+        except self.errors:
+            return value
+
+
+def request_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    '''Заголовок запроса без учёта регистра имени'''
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    '''Совпадает ли If-None-Match с ETag (слабое сравнение, как требует RFC 9110)'''
+    header = request_header(event, 'If-None-Match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in header.split(','))
+
+
+class CacheEntry:
+    '''Запись кэша для одного GET: ключ зафиксирован с токенами тегов на момент чтения, до запроса к базе'''
+
+    def __init__(self, cache: 'ResponseCache', key: str):
+        self.cache = cache
+        self.key = key
+
+    def cached(self, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        '''Готовый ответ из кэша (200 или 304) или None, если записи нет'''
+        value = self.cache.get(self.key)
+        if value is None:
+            return None
+        headers_json, _, body = value.partition('\n')
+        return self.cache.respond(event, json.loads(headers_json), body)
+
+    def respond(self, event: Dict[str, Any], headers: Dict[str, str], body: str, cache_control: str) -> Dict[str, Any]:
+        '''Сохранить свежий ответ 200 и отдать его, или 304, если у клиента та же версия'''
+        headers = {
+            **headers,
+            'ETag': '"' + hashlib.blake2b(body.encode(), digest_size=12).hexdigest() + '"',
+            'Cache-Control': cache_control
+        }
+        expose = [name for name in headers.get('Access-Control-Expose-Headers', '').split(', ') if name]
+        headers['Access-Control-Expose-Headers'] = ', '.join(expose + ['ETag'])
+        self.cache.set(self.key, json.dumps(headers) + '\n' + body)
+        return self.cache.respond(event, headers, body)
+
+
+class ResponseCache:
+    '''Двухуровневый кэш ответов: память контейнера, затем внешний уровень, если он настроен'''
+
+    def __init__(self, external=None):
+        self.local = LocalStore()
+        self.external = external
+        # Без внешнего уровня инвалидация не доходит до других контейнеров, поэтому записи живут недолго
+        self.ttl = CACHE_TTL_SECONDS if external else CACHE_LOCAL_TTL_SECONDS
+
+    def _tag_tokens(self, tags: Iterable[str]) -> List[str]:
+        keys = [f'tag:{tag}' for tag in tags]
+        store = self.external or self.local
+        tokens = store.get_many(keys)
+        return [
+            token if token is not None else store.add(key, os.urandom(6).hex(), TAG_TTL_SECONDS)
+            for key, token in zip(keys, tokens)
+        ]
+
+    def entry(self, key: str, tags: Iterable[str]) -> CacheEntry:
+        '''Запись для ключа, привязанная к текущим версиям тегов'''
+        return CacheEntry(self, f"resp:{key}:{'.'.join(self._tag_tokens(tags))}")
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.local.get_many([key])[0]
+        if value is None and self.external:
+            value = self.external.get_many([key])[0]
+            if value is not None:
+                self.local.set(key, value, self.ttl)
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self.local.set(key, value, self.ttl)
+        if self.external:
+            self.external.set(key, value, self.ttl)
+
+    def invalidate(self, *tags: str) -> None:
+        '''Сменить токены тегов: все записи с этими тегами перестают находиться'''
+        for tag in tags:
+            token = os.urandom(6).hex()
+            self.local.set(f'tag:{tag}', token, TAG_TTL_SECONDS)
+            if self.external:
+                self.external.set(f'tag:{tag}', token, TAG_TTL_SECONDS)
+
+    @staticmethod
+    def respond(event: Dict[str, Any], headers: Dict[str, str], body: str) -> Dict[str, Any]:
+        if etag_matches(event, headers['ETag']):
+            return {
+                'statusCode': 304,
+                'headers': {name: value for name, value in headers.items() if name != 'Content-Type'},
+                'body': '',
+                'isBase64Encoded': False
+            }
+        return {'statusCode': 200, 'headers': headers, 'body': body, 'isBase64Encoded': False}
+
+
+_cache: Optional[ResponseCache] = None
+
+
+def get_cache() -> ResponseCache:
+    '''Кэш контейнера; внешний уровень выбирается по CACHE_URL при первом вызове'''
+    global _cache
+    if _cache is None:
+        url = os.environ.get('CACHE_URL', '')
+        if url.startswith('redis://') or url.startswith('rediss://'):
+            external = RedisStore(url)
+        elif url.startswith('file://'):
+            external = FileStore(url[len('file://'):])
+        else:
+            external = None
+        _cache = ResponseCache(external)
+    return _cache
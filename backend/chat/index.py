@@ -1,162 +1,409 @@
 import json
 import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import gzip
+import select
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime
 
-def get_db():
-    '''Получить подключение к базе данных'''
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+from cache import get_cache
+from runtime import (
+    ANY, App, JSON_HEADERS, Request, close_db, close_direct_db, decode_cursor, dumps, encode_cursor,
+    error_response, get_db, get_direct_db, instrument_s3, json_response, parse_limit, release_db
+)
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+
+MAX_WAIT_SECONDS = 25
+# Окно повторной выдачи до сообщения since_id: дольше этого транзакция отправки не держит полученный id
+SYNC_OVERLAP = '1 minute'
+# Сколько последних сообщений окна отдаётся повторно: поздний коммит отстаёт от since_id на единицы id
+SYNC_OVERLAP_LIMIT = 20
+
+def fetch_new_messages(cur, chat_id: str, since_id: Optional[int], since: Optional[datetime], limit: int) -> List[Dict[str, Any]]:
     '''
-    API для работы с чатами и сообщениями
-    GET /chat?user_id=X - получить все чаты пользователя
-    GET /chat?chat_id=X - получить сообщения чата
-    POST /chat - отправить сообщение или создать чат
+    Сообщения чата новее since_id (или since), в порядке id
+    id выдаётся при вставке, а виден после коммита, поэтому сообщение с меньшим id может появиться уже после
+    того, как клиент получил since_id: сообщения с id меньше since_id из окна SYNC_OVERLAP до него отдаются
+    повторно, клиент убирает дубли по id. limit ограничивает сообщения новее since_id, повтор окна — не больше
+    SYNC_OVERLAP_LIMIT последних сообщений перед since_id.
+    Нижняя граница created_at от сообщения since_id отсекает старые месячные секции messages при выполнении;
+    запас в час покрывает сообщения, получившие id позже, но с более ранним created_at начала транзакции
+    '''
+    if since_id is not None:
+        cur.execute('''
+            SELECT m.*, u.name as sender_name, u.avatar_url as sender_avatar
+            FROM (
+                (
+                    SELECT * FROM messages
+                    WHERE chat_id = %(chat_id)s AND id > %(since_id)s
+                        AND created_at >= COALESCE((
+                            SELECT created_at - INTERVAL '1 hour' FROM messages
+                            WHERE chat_id = %(chat_id)s AND id = %(since_id)s
+                        ), '-infinity')
+                    ORDER BY id ASC
+                    LIMIT %(limit)s
+                )
+                UNION ALL
+                (
+                    SELECT * FROM messages
+                    WHERE chat_id = %(chat_id)s AND id < %(since_id)s
+                        AND created_at >= (
+                            SELECT created_at - %(overlap)s::INTERVAL FROM messages
+                            WHERE chat_id = %(chat_id)s AND id = %(since_id)s
+                        )
+                    ORDER BY id DESC
+                    LIMIT %(overlap_limit)s
+                )
+            ) m
+            JOIN users u ON m.sender_id = u.id
+            ORDER BY m.id ASC
+        ''', {'chat_id': chat_id, 'since_id': since_id, 'limit': limit, 'overlap': SYNC_OVERLAP,
+              'overlap_limit': SYNC_OVERLAP_LIMIT})
+    else:
+        cur.execute('''
+            SELECT m.*, u.name as sender_name, u.avatar_url as sender_avatar
+            FROM messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE m.chat_id = %s AND m.created_at > %s
+            ORDER BY m.created_at ASC, m.id ASC
+            LIMIT %s
+        ''', (chat_id, since, limit))
+    return cur.fetchall()
+
+ARCHIVE_BUCKET = 'files'
+
+_s3 = None
+
+def get_s3():
+    '''Клиент S3 для чтения архива сообщений; boto3 импортируется только при первом обращении к архиву'''
+    global _s3
+    if _s3 is None:
+        import boto3
+        _s3 = instrument_s3(boto3.client('s3',
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev'),
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+        ))
+    return _s3
+
+def archived_messages(cur, chat_id: str, before: Optional[Tuple[datetime, int]], count: int) -> List[Dict[str, Any]]:
     '''
-    method: str = event.get('httpMethod', 'GET')
+    Продолжение истории чата из выгруженных в S3 месяцев (scripts/archive_messages.py): до count сообщений
+    старше before, новые первыми; каждый месяц чата читается Range-запросом своего gzip-члена
+    '''
+    cur.execute('''
+        SELECT s3_key, byte_offset, byte_length
+        FROM message_archive_chunks
+        WHERE chat_id = %s AND first_created_at <= COALESCE(%s, 'infinity')
+        ORDER BY period DESC
+    ''', (chat_id, before[0] if before else None))
+    chunks = cur.fetchall()
+
+    messages: List[Dict[str, Any]] = []
+    for chunk in chunks:
+        if len(messages) >= count:
+            break
+        body = get_s3().get_object(
+            Bucket=ARCHIVE_BUCKET, Key=chunk['s3_key'],
+            Range=f"bytes={chunk['byte_offset']}-{chunk['byte_offset'] + chunk['byte_length'] - 1}"
+        )['Body'].read()
+        rows = []
+        for line in gzip.decompress(body).splitlines():
+            row = json.loads(line)
+            row['created_at'] = datetime.fromisoformat(row['created_at'])
+            if before is None or (row['created_at'], row['id']) < before:
+                rows.append(row)
+        rows.sort(key=lambda row: (row['created_at'], row['id']), reverse=True)
+        messages.extend(rows[:count - len(messages)])
+
+    if messages:
+        cur.execute('''
+            SELECT id, name, avatar_url FROM users WHERE id = ANY(%s)
+        ''', (list({row['sender_id'] for row in messages}),))
+        senders = {row['id']: row for row in cur.fetchall()}
+        for row in messages:
+            sender = senders.get(row['sender_id']) or {}
+            row['sender_name'] = sender.get('name')
+            row['sender_avatar'] = sender.get('avatar_url')
+    return messages
+
+def wait_for_notify(conn, timeout: float) -> None:
+    '''Ждать NOTIFY на подписанных каналах не дольше timeout секунд'''
+    deadline = time.monotonic() + timeout
+    while not conn.notifies:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if select.select([conn], [], [], remaining) != ([], [], []):
+            conn.poll()
+    conn.notifies.clear()
+
+app = App(connect=get_db, release=release_db, allow_headers='Content-Type, If-None-Match')
+
+@app.get(chat_id=ANY, since_id=ANY)
+@app.get(chat_id=ANY, since=ANY)
+def new_messages(request: Request) -> Dict[str, Any]:
+    '''Новые сообщения после since_id/since, с ожиданием до wait секунд через LISTEN/NOTIFY'''
+    params = request.params
+    chat_id = params['chat_id']
+    limit = parse_limit(params.get('limit'))
+    if limit is None:
+        return error_response(400, 'Invalid limit')
+
+    try:
+        since_id = int(params['since_id']) if params.get('since_id') else None
+        since = datetime.fromisoformat(params['since']) if since_id is None else None
+        wait = min(float(params.get('wait', 0)), MAX_WAIT_SECONDS)
+        channel = f'chat_{int(chat_id)}'
+    except ValueError:
+        return error_response(400, 'Invalid chat_id, since_id, since or wait')
+
+    conn = request.conn
+    cur = request.cursor(dict_rows=True)
+    # Повторно отданные сообщения окна SYNC_OVERLAP новыми не считаются, иначе long-poll не ждал бы никогда
+    has_new = lambda messages: any(since_id is None or message['id'] > since_id for message in messages)
+    messages = fetch_new_messages(cur, chat_id, since_id, since, limit)
+
+    if not has_new(messages) and wait > 0:
+        import psycopg2
+        listen = get_direct_db()
+        try:
+            with listen.cursor() as listen_cur:
+                listen_cur.execute(f'LISTEN {channel}')
+            listen.notifies.clear()
+            try:
+                conn.rollback()
+                messages = fetch_new_messages(cur, chat_id, since_id, since, limit)
+                conn.rollback()
+                if not has_new(messages):
+                    wait_for_notify(listen, wait)
+                    messages = fetch_new_messages(cur, chat_id, since_id, since, limit)
+            finally:
+                with listen.cursor() as listen_cur:
+                    listen_cur.execute('UNLISTEN *')
+        except psycopg2.Error:
+            close_direct_db()
+            raise
+
+    return json_response(messages)
+
+@app.get(chat_id=ANY)
+def chat_history(request: Request) -> Dict[str, Any]:
+    '''Последние сообщения чата, более ранние по курсору'''
+    params = request.params
+    chat_id = params['chat_id']
+    limit = parse_limit(params.get('limit'))
+    if limit is None:
+        return error_response(400, 'Invalid limit')
+
+    position = None
+    if params.get('cursor'):
+        position = decode_cursor(params['cursor'])
+        if position is None:
+            return error_response(400, 'Invalid cursor')
+
+    entry = get_cache().entry(f"chat:{chat_id}:{limit}:{params.get('cursor') or ''}", (f'chat:{chat_id}',))
+    cached = entry.cached(request.event)
+    if cached:
+        return cached
+
+    # Отдельное условие по created_at нужно для отсечения секций: сравнение кортежей их не отсекает
+    cursor_filter = 'AND m.created_at <= %s AND (m.created_at, m.id) < (%s, %s)' if position else ''
+    cur = request.cursor(dict_rows=True)
+    cur.execute(f'''
+        SELECT m.*, u.name as sender_name, u.avatar_url as sender_avatar
+        FROM messages m
+        JOIN users u ON m.sender_id = u.id
+        WHERE m.chat_id = %s {cursor_filter}
+        ORDER BY m.created_at DESC, m.id DESC
+        LIMIT %s
+    ''', (chat_id, *((position[0], *position) if position else ()), limit + 1))
+    messages = cur.fetchall()
+
+    if len(messages) <= limit:
+        before = (messages[-1]['created_at'], messages[-1]['id']) if messages else position
+        messages += archived_messages(cur, chat_id, before, limit + 1 - len(messages))
+
+    headers = {**JSON_HEADERS, 'Access-Control-Expose-Headers': 'X-Next-Cursor'}
+    if len(messages) > limit:
+        messages = messages[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(messages[-1]['created_at'], messages[-1]['id'])
+    messages.reverse()
+
+    return entry.respond(request.event, headers, dumps(messages), 'private, no-cache')
+
+@app.get(user_id=ANY)
+def inbox(request: Request) -> Dict[str, Any]:
+    '''Все чаты пользователя, свежие первыми'''
+    user_id = request.params['user_id']
+    entry = get_cache().entry(f'inbox:{user_id}', (f'inbox:{user_id}',))
+    cached = entry.cached(request.event)
+    if cached:
+        return cached
+
+    cur = request.cursor(dict_rows=True)
+    cur.execute('''
+        SELECT 
+            s.chat_id,
+            LEAST(s.user_id, s.partner_id) as user1_id,
+            GREATEST(s.user_id, s.partner_id) as user2_id,
+            u.name as partner_name,
+            u.avatar_url as partner_avatar,
+            s.last_message_content as last_message,
+            s.last_message_sender_id as last_message_sender_id,
+            s.last_message_at as last_message_time,
+            s.unread_count
+        FROM chat_summaries s
+        JOIN users u ON s.partner_id = u.id
+        WHERE s.user_id = %s
+        ORDER BY s.last_message_at DESC NULLS LAST
+    ''', (user_id,))
+
+    return entry.respond(request.event, JSON_HEADERS, dumps(cur.fetchall()), 'private, no-cache')
+
+@app.get()
+def missing_chat(request: Request) -> Dict[str, Any]:
+    return error_response(400, 'Missing user_id or chat_id')
+
+@app.post(action='mark_read')
+def mark_read(request: Request) -> Dict[str, Any]:
+    '''Отметить прочитанными сообщения чата до message_id включительно'''
+    chat_id = request.body.get('chat_id')
+    user_id = request.body.get('user_id')
+    message_id = request.body.get('message_id')
+
+    if not chat_id or not user_id or not message_id:
+        return error_response(400, 'Missing chat_id, user_id or message_id')
+    try:
+        chat_id, user_id, message_id = int(chat_id), int(user_id), int(message_id)
+    except (TypeError, ValueError):
+        return error_response(400, 'Invalid chat_id, user_id or message_id')
+
+    cur = request.cursor(dict_rows=True)
+    cur.execute('''
+        WITH marked AS (
+            UPDATE messages
+            SET is_read = true
+            WHERE chat_id IN (SELECT chat_id FROM chat_summaries WHERE chat_id = %s AND user_id = %s)
+                AND sender_id <> %s
+                AND is_read = false
+                AND id <= %s
+            RETURNING id
+        )
+        UPDATE chat_summaries
+        SET unread_count = GREATEST(unread_count - (SELECT COUNT(*) FROM marked), 0)
+        WHERE chat_id = %s AND user_id = %s
+        RETURNING unread_count, (SELECT COUNT(*) FROM marked) AS marked_count
+    ''', (chat_id, user_id, user_id, message_id, chat_id, user_id))
+    summary = cur.fetchone()
+
+    if not summary:
+        return error_response(404, 'Chat not found')
+
+    request.conn.commit()
+    get_cache().invalidate(f'inbox:{user_id}', f'chat:{chat_id}')
+
+    return json_response({
+        'success': True,
+        'chat_id': chat_id,
+        'marked': summary['marked_count'],
+        'unread_count': summary['unread_count']
+    })
+
+@app.post()
+def send_message(request: Request) -> Dict[str, Any]:
+    '''Отправить сообщение, при необходимости создав чат'''
+    sender_id = request.body.get('sender_id')
+    recipient_id = request.body.get('recipient_id')
+    content = request.body.get('content')
+    chat_id = request.body.get('chat_id')
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    if not sender_id or not content:
+        return error_response(400, 'Missing sender_id or content')
+
+    if not chat_id and not recipient_id:
+        return error_response(400, 'Missing recipient_id for new chat')
+
+    cur = request.cursor(dict_rows=True)
+    if not chat_id:
+        user1 = min(int(sender_id), int(recipient_id))
+        user2 = max(int(sender_id), int(recipient_id))
+        
+        cur.execute('''
+            INSERT INTO chats (user1_id, user2_id)
+            VALUES (%s, %s)
+            ON CONFLICT (user1_id, user2_id) DO UPDATE SET user1_id = EXCLUDED.user1_id
+            RETURNING id
+        ''', (user1, user2))
+        chat_id = cur.fetchone()['id']
     
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute('''
+        INSERT INTO messages (chat_id, sender_id, content)
+        VALUES (%s, %s, %s)
+        RETURNING id, created_at
+    ''', (chat_id, sender_id, content))
     
-    try:
-        if method == 'GET':
-            params = event.get('queryStringParameters') or {}
-            user_id = params.get('user_id')
-            chat_id = params.get('chat_id')
-            
-            if chat_id:
-                cur.execute('''
-                    SELECT m.*, u.name as sender_name, u.avatar_url as sender_avatar
-                    FROM messages m
-                    JOIN users u ON m.sender_id = u.id
-                    WHERE m.chat_id = %s
-                    ORDER BY m.created_at ASC
-                ''', (chat_id,))
-                messages = cur.fetchall()
-                
-                result = [dict(msg) for msg in messages]
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps(result, default=str),
-                    'isBase64Encoded': False
-                }
-            
-            elif user_id:
-                cur.execute('''
-                    SELECT 
-                        c.id as chat_id,
-                        c.user1_id,
-                        c.user2_id,
-                        u.name as partner_name,
-                        u.avatar_url as partner_avatar,
-                        (SELECT content FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message,
-                        (SELECT created_at FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message_time,
-                        (SELECT COUNT(*) FROM messages WHERE chat_id = c.id AND sender_id != %s AND is_read = false) as unread_count
-                    FROM chats c
-                    JOIN users u ON (CASE WHEN c.user1_id = %s THEN c.user2_id ELSE c.user1_id END) = u.id
-                    WHERE c.user1_id = %s OR c.user2_id = %s
-                    ORDER BY last_message_time DESC NULLS LAST
-                ''', (user_id, user_id, user_id, user_id))
-                chats = cur.fetchall()
-                
-                result = [dict(chat) for chat in chats]
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps(result, default=str),
-                    'isBase64Encoded': False
-                }
-            
-            else:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing user_id or chat_id'}),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            sender_id = body.get('sender_id')
-            recipient_id = body.get('recipient_id')
-            content = body.get('content')
-            chat_id = body.get('chat_id')
-            
-            if not sender_id or not content:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing sender_id or content'}),
-                    'isBase64Encoded': False
-                }
-            
-            if not chat_id:
-                if not recipient_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Missing recipient_id for new chat'}),
-                        'isBase64Encoded': False
-                    }
-                
-                user1 = min(int(sender_id), int(recipient_id))
-                user2 = max(int(sender_id), int(recipient_id))
-                
-                cur.execute('''
-                    INSERT INTO chats (user1_id, user2_id)
-                    VALUES (%s, %s)
-                    ON CONFLICT (user1_id, user2_id) DO UPDATE SET user1_id = EXCLUDED.user1_id
-                    RETURNING id
-                ''', (user1, user2))
-                chat_id = cur.fetchone()['id']
-            
-            cur.execute('''
-                INSERT INTO messages (chat_id, sender_id, content)
-                VALUES (%s, %s, %s)
-                RETURNING id, created_at
-            ''', (chat_id, sender_id, content))
-            
-            message = cur.fetchone()
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'success': True,
-                    'chat_id': chat_id,
-                    'message_id': message['id'],
-                    'created_at': message['created_at'].isoformat()
-                }),
-                'isBase64Encoded': False
-            }
-        
-        else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Method not allowed'}),
-                'isBase64Encoded': False
-            }
+    message = cur.fetchone()
+
+    # Превью хранится в сводке, чтобы список чатов не зависел от секции messages, которую может выгрузить архивация
+    cur.execute('''
+        INSERT INTO chat_summaries (
+            chat_id, user_id, partner_id, last_message_id, last_message_at,
+            last_message_content, last_message_sender_id, unread_count
+        )
+        SELECT DISTINCT
+            c.id,
+            v.user_id,
+            v.partner_id,
+            %(message_id)s,
+            %(created_at)s,
+            %(content)s,
+            %(sender_id)s::INTEGER,
+            CASE WHEN v.user_id = %(sender_id)s::INTEGER THEN 0 ELSE 1 END
+        FROM chats c
+        CROSS JOIN LATERAL (VALUES (c.user1_id, c.user2_id), (c.user2_id, c.user1_id)) AS v(user_id, partner_id)
+        WHERE c.id = %(chat_id)s
+        ON CONFLICT (chat_id, user_id) DO UPDATE SET
+            last_message_id = CASE WHEN EXCLUDED.last_message_id > COALESCE(chat_summaries.last_message_id, 0)
+                THEN EXCLUDED.last_message_id ELSE chat_summaries.last_message_id END,
+            last_message_at = CASE WHEN EXCLUDED.last_message_id > COALESCE(chat_summaries.last_message_id, 0)
+                THEN EXCLUDED.last_message_at ELSE chat_summaries.last_message_at END,
+            last_message_content = CASE WHEN EXCLUDED.last_message_id > COALESCE(chat_summaries.last_message_id, 0)
+                THEN EXCLUDED.last_message_content ELSE chat_summaries.last_message_content END,
+            last_message_sender_id = CASE WHEN EXCLUDED.last_message_id > COALESCE(chat_summaries.last_message_id, 0)
+                THEN EXCLUDED.last_message_sender_id ELSE chat_summaries.last_message_sender_id END,
+            unread_count = chat_summaries.unread_count + EXCLUDED.unread_count
+        RETURNING user_id
+    ''', {
+        'message_id': message['id'],
+        'created_at': message['created_at'],
+        'content': content,
+        'sender_id': sender_id,
+        'chat_id': chat_id
+    })
+    participants = [row['user_id'] for row in cur.fetchall()]
+    cur.execute('SELECT pg_notify(%s, %s)', (f'chat_{int(chat_id)}', str(message['id'])))
+    request.conn.commit()
+    get_cache().invalidate(f'chat:{chat_id}', *(f'inbox:{participant}' for participant in participants))
     
-    finally:
-        cur.close()
-        conn.close()
+    return json_response({
+        'success': True,
+        'chat_id': chat_id,
+        'message_id': message['id'],
+        'created_at': message['created_at']
+    })
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    API для работы с чатами и сообщениями
+    GET /chat?user_id=X - получить все чаты пользователя
+    GET /chat?chat_id=X&limit=N&cursor=C - последние сообщения чата, более ранние по курсору из X-Next-Cursor
+        За концом живой истории страницы продолжаются из архива в S3 (message_archive_chunks)
+    Список чатов и страницы сообщений кэшируются (cache.py) и отдают ETag, If-None-Match с тем же ETag даёт 304
+    GET /chat?chat_id=X&since_id=N&wait=S - новые сообщения после N, с ожиданием до S секунд (LISTEN/NOTIFY)
+        Вместе с новыми повторно приходят сообщения с id меньше N за минуту до него, клиент убирает дубли по id
+        Ожидание держит прямое подключение DATABASE_URL: LISTEN через пулер в режиме транзакций не работает
+    POST /chat - отправить сообщение или создать чат
+    POST /chat {action: mark_read} - отметить прочитанными сообщения чата до message_id включительно
+    '''
+    return app(event, context)
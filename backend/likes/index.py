@@ -1,145 +1,271 @@
-import json
 import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, List, Tuple
 
-def get_db():
-    '''Получить подключение к базе данных'''
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+from cache import get_cache
+from runtime import (
+    ANY, App, JSON_HEADERS, Request, close_db, decode_cursor, dumps,
+    encode_cursor, error_response, get_db, json_response, parse_limit, release_db
+)
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+
+MAX_BATCH_LIKES = 100
+
+def upsert_likes(cur, from_user_id: int, items: List[Tuple[int, bool]]) -> Dict[int, Dict[str, Any]]:
     '''
-    API для работы с лайками и избранным
-    GET /likes?user_id=X - получить лайки пользователя
-    POST /likes - поставить/убрать лайк или добавить в избранное
+    Вставить или обновить лайки одним запросом и сразу определить взаимные
+    В той же транзакции фиксирует новые мэтчи и пишет уведомления like/match
+    Пары пользователей блокируются до конца транзакции: встречный лайк, вставленный параллельно, иначе не виден
+    ни одной из сторон, и мэтч теряется. Блокировки берутся в порядке пар, чтобы пачки не ждали друг друга по кругу
     '''
-    method: str = event.get('httpMethod', 'GET')
+    pairs = sorted({(min(from_user_id, to_user_id), max(from_user_id, to_user_id)) for to_user_id, _ in items})
+    cur.execute('''
+        SELECT pg_advisory_xact_lock(low, high) FROM unnest(%s::int[], %s::int[]) AS t(low, high)
+    ''', ([low for low, _ in pairs], [high for _, high in pairs]))
+    # Запрос ниже берёт новый снимок уже после блокировки и видит закоммиченный встречный лайк
+    cur.execute('''
+        WITH input AS (
+            SELECT * FROM unnest(%(to_user_ids)s::int[], %(favorites)s::bool[]) AS t(to_user_id, is_favorite)
+        ),
+        upserted AS (
+            INSERT INTO likes (from_user_id, to_user_id, is_favorite)
+            SELECT %(from_user_id)s, to_user_id, is_favorite FROM input
+            ON CONFLICT (from_user_id, to_user_id)
+            DO UPDATE SET is_favorite = EXCLUDED.is_favorite
+            RETURNING id, to_user_id, (xmax = 0) AS inserted
+        ),
+        result AS (
+            SELECT u.id AS like_id, u.to_user_id, u.inserted, r.id IS NOT NULL AS is_match
+            FROM upserted u
+            LEFT JOIN likes r ON r.from_user_id = u.to_user_id AND r.to_user_id = %(from_user_id)s
+                AND r.from_user_id <> %(from_user_id)s
+        ),
+        new_matches AS (
+            INSERT INTO matches (user_id, matched_user_id)
+            SELECT %(from_user_id)s, to_user_id FROM result WHERE is_match
+            UNION ALL
+            SELECT to_user_id, %(from_user_id)s FROM result WHERE is_match
+            ON CONFLICT (user_id, matched_user_id) DO NOTHING
+            RETURNING user_id, matched_user_id
+        ),
+        notified AS (
+            INSERT INTO notifications (user_id, type, from_user_id, message)
+            SELECT to_user_id, 'like', %(from_user_id)s, 'Вам поставили лайк' FROM result WHERE inserted
+            UNION ALL
+            SELECT user_id, 'match', matched_user_id, 'У вас взаимная симпатия' FROM new_matches
+            RETURNING id
+        )
+        SELECT like_id, to_user_id, is_match FROM result
+    ''', {
+        'to_user_ids': [to_user_id for to_user_id, _ in items],
+        'favorites': [is_favorite for _, is_favorite in items],
+        'from_user_id': from_user_id
+    })
+    return {row['to_user_id']: row for row in cur.fetchall()}
+
+app = App(connect=get_db, release=release_db, allow_headers='Content-Type, If-None-Match')
+
+@app.get()
+def likes_page(request: Request) -> Dict[str, Any]:
+    '''Страница лайков, мэтчей или непрочитанных уведомлений пользователя'''
+    params = request.params
+    user_id = params.get('user_id')
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    if not user_id:
+        return error_response(400, 'Missing user_id')
     
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    limit = parse_limit(params.get('limit'))
+    if limit is None:
+        return error_response(400, 'Invalid limit')
+
+    position = None
+    if params.get('cursor'):
+        position = decode_cursor(params['cursor'])
+        if position is None:
+            return error_response(400, 'Invalid cursor')
+
+    view = params.get('view', 'likes')
+
+    entry = get_cache().entry(f"likes:{user_id}:{view}:{limit}:{params.get('cursor') or ''}", (f'likes:{user_id}',))
+    cached = entry.cached(request.event)
+    if cached:
+        return cached
+
+    cur = request.cursor(dict_rows=True)
+    if view == 'matches':
+        cursor_key = 'matched_user_id'
+        cursor_filter = 'AND (m.created_at, m.matched_user_id) < (%s, %s)' if position else ''
+        cur.execute(f'''
+            SELECT
+                m.matched_user_id,
+                m.created_at,
+                u.name,
+                u.avatar_url,
+                p.life_path,
+                p.destiny
+            FROM matches m
+            JOIN users u ON m.matched_user_id = u.id
+            LEFT JOIN profiles p ON p.user_id = u.id
+            WHERE m.user_id = %s {cursor_filter}
+            ORDER BY m.created_at DESC, m.matched_user_id DESC
+            LIMIT %s
+        ''', (user_id, *(position or ()), limit + 1))
+
+    elif view == 'notifications':
+        cursor_key = 'id'
+        cursor_filter = 'AND (n.created_at, n.id) < (%s, %s)' if position else ''
+        cur.execute(f'''
+            SELECT
+                n.id,
+                n.type,
+                n.from_user_id,
+                n.message,
+                n.created_at,
+                u.name as from_name,
+                u.avatar_url as from_avatar
+            FROM notifications n
+            LEFT JOIN users u ON n.from_user_id = u.id
+            WHERE n.user_id = %s AND n.is_read = false {cursor_filter}
+            ORDER BY n.created_at DESC, n.id DESC
+            LIMIT %s
+        ''', (user_id, *(position or ()), limit + 1))
+
+    else:
+        cursor_key = 'id'
+        cursor_filter = 'AND (l.created_at, l.id) < (%s, %s)' if position else ''
+        cur.execute(f'''
+            SELECT 
+                l.id,
+                l.to_user_id,
+                l.is_favorite,
+                l.created_at,
+                u.name,
+                u.avatar_url,
+                p.life_path,
+                p.destiny
+            FROM likes l
+            JOIN users u ON l.to_user_id = u.id
+            LEFT JOIN profiles p ON p.user_id = u.id
+            WHERE l.from_user_id = %s {cursor_filter}
+            ORDER BY l.created_at DESC, l.id DESC
+            LIMIT %s
+        ''', (user_id, *(position or ()), limit + 1))
+    likes = cur.fetchall()
+
+    headers = {**JSON_HEADERS, 'Access-Control-Expose-Headers': 'X-Next-Cursor'}
+    if len(likes) > limit:
+        likes = likes[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(likes[-1]['created_at'], likes[-1][cursor_key])
     
+    return entry.respond(request.event, headers, dumps(likes), 'private, no-cache')
+
+@app.post(action='read_notifications')
+def read_notifications(request: Request) -> Dict[str, Any]:
+    '''Отметить уведомления прочитанными, все или до notification_id'''
+    user_id = request.body.get('user_id')
+    notification_id = request.body.get('notification_id')
+
+    if not user_id:
+        return error_response(400, 'Missing user_id')
     try:
-        if method == 'GET':
-            params = event.get('queryStringParameters') or {}
-            user_id = params.get('user_id')
-            
-            if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing user_id'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute('''
-                SELECT 
-                    l.to_user_id,
-                    l.is_favorite,
-                    l.created_at,
-                    u.name,
-                    u.avatar_url,
-                    p.life_path,
-                    p.destiny
-                FROM likes l
-                JOIN users u ON l.to_user_id = u.id
-                LEFT JOIN profiles p ON p.user_id = u.id
-                WHERE l.from_user_id = %s
-                ORDER BY l.created_at DESC
-            ''', (user_id,))
-            likes = cur.fetchall()
-            
-            result = [dict(like) for like in likes]
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps(result, default=str),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            from_user_id = body.get('from_user_id')
-            to_user_id = body.get('to_user_id')
-            is_favorite = body.get('is_favorite', False)
-            action = body.get('action', 'add')
-            
-            if not from_user_id or not to_user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Missing from_user_id or to_user_id'}),
-                    'isBase64Encoded': False
-                }
-            
-            if action == 'remove':
-                cur.execute('''
-                    UPDATE likes 
-                    SET is_favorite = false
-                    WHERE from_user_id = %s AND to_user_id = %s
-                ''', (from_user_id, to_user_id))
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'action': 'removed'}),
-                    'isBase64Encoded': False
-                }
-            
-            else:
-                cur.execute('''
-                    INSERT INTO likes (from_user_id, to_user_id, is_favorite)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT (from_user_id, to_user_id)
-                    DO UPDATE SET is_favorite = EXCLUDED.is_favorite
-                    RETURNING id
-                ''', (from_user_id, to_user_id, is_favorite))
-                
-                like_id = cur.fetchone()['id']
-                conn.commit()
-                
-                cur.execute('''
-                    SELECT COUNT(*) as count FROM likes 
-                    WHERE from_user_id = %s AND to_user_id = %s
-                    AND to_user_id IN (SELECT from_user_id FROM likes WHERE to_user_id = %s)
-                ''', (from_user_id, to_user_id, from_user_id))
-                
-                is_match = cur.fetchone()['count'] > 0
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'like_id': like_id,
-                        'is_match': is_match
-                    }),
-                    'isBase64Encoded': False
-                }
-        
-        else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Method not allowed'}),
-                'isBase64Encoded': False
-            }
+        user_id = int(user_id)
+        notification_id = int(notification_id) if notification_id else None
+    except (TypeError, ValueError):
+        return error_response(400, 'Invalid user_id or notification_id')
+
+    up_to_filter = 'AND id <= %s' if notification_id else ''
+    cur = request.cursor()
+    cur.execute(f'''
+        UPDATE notifications
+        SET is_read = true
+        WHERE user_id = %s AND is_read = false {up_to_filter}
+    ''', (user_id, *([notification_id] if up_to_filter else [])))
+    marked = cur.rowcount
+    request.conn.commit()
+    get_cache().invalidate(f'likes:{user_id}')
+
+    return json_response({'success': True, 'marked': marked})
+
+@app.post(likes=ANY)
+def batch_likes(request: Request) -> Dict[str, Any]:
+    '''Пачка лайков с флагом взаимности для каждого'''
+    try:
+        items = {int(item['to_user_id']): bool(item.get('is_favorite', False)) for item in request.body['likes']}
+        from_user_id = int(request.body.get('from_user_id'))
+    except (KeyError, TypeError, ValueError):
+        items = None
+
+    if not items or len(items) > MAX_BATCH_LIKES:
+        return error_response(400, f'Expected from_user_id and 1-{MAX_BATCH_LIKES} likes with to_user_id')
+    if from_user_id in items:
+        return error_response(400, 'Cannot like yourself')
+
+    upserted = upsert_likes(request.cursor(dict_rows=True), from_user_id, list(items.items()))
+    request.conn.commit()
+    get_cache().invalidate(f'likes:{from_user_id}', *(f'likes:{to_user_id}' for to_user_id in items))
+
+    results = [
+        {
+            'to_user_id': to_user_id,
+            'like_id': upserted[to_user_id]['like_id'],
+            'is_match': upserted[to_user_id]['is_match']
+        }
+        for to_user_id in items
+    ]
+
+    return json_response({
+        'success': True,
+        'likes': results,
+        'matches': [r['to_user_id'] for r in results if r['is_match']]
+    })
+
+@app.post()
+def like(request: Request) -> Dict[str, Any]:
+    '''Поставить или убрать лайк, добавить в избранное'''
+    from_user_id = request.body.get('from_user_id')
+    to_user_id = request.body.get('to_user_id')
+    is_favorite = request.body.get('is_favorite', False)
+    action = request.body.get('action', 'add')
     
-    finally:
-        cur.close()
-        conn.close()
+    if not from_user_id or not to_user_id:
+        return error_response(400, 'Missing from_user_id or to_user_id')
+    try:
+        from_user_id, to_user_id = int(from_user_id), int(to_user_id)
+    except (TypeError, ValueError):
+        return error_response(400, 'Invalid from_user_id or to_user_id')
+    if from_user_id == to_user_id:
+        return error_response(400, 'Cannot like yourself')
+
+    cur = request.cursor(dict_rows=True)
+    if action == 'remove':
+        cur.execute('''
+            UPDATE likes 
+            SET is_favorite = false
+            WHERE from_user_id = %s AND to_user_id = %s
+        ''', (from_user_id, to_user_id))
+        request.conn.commit()
+        get_cache().invalidate(f'likes:{from_user_id}')
+        
+        return json_response({'success': True, 'action': 'removed'})
+
+    like = upsert_likes(cur, from_user_id, [(to_user_id, bool(is_favorite))])[to_user_id]
+    request.conn.commit()
+    get_cache().invalidate(f'likes:{from_user_id}', f'likes:{to_user_id}')
+
+    return json_response({
+        'success': True,
+        'like_id': like['like_id'],
+        'is_match': like['is_match']
+    })
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    API для работы с лайками и избранным
+    GET /likes?user_id=X&limit=N&cursor=C - страница лайков пользователя, курсор следующей в X-Next-Cursor
+    GET /likes?user_id=X&view=matches - взаимные симпатии пользователя
+    GET /likes?user_id=X&view=notifications - непрочитанные уведомления
+    Все GET кэшируются (cache.py) и отдают ETag, If-None-Match с тем же ETag даёт 304
+    POST /likes - поставить/убрать лайк или добавить в избранное
+    POST /likes {from_user_id, likes: [{to_user_id, is_favorite}]} - пачка лайков с флагом взаимности для каждого
+    POST /likes {action: read_notifications, user_id, notification_id?} - отметить уведомления прочитанными
+    '''
+    return app(event, context)
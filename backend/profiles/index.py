@@ -1,223 +1,534 @@
-import json
 import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime, date
-
-def get_db():
-    '''Получить подключение к базе данных'''
-    return psycopg2.connect(os.environ['DATABASE_URL'])
-
-def calculate_life_path(birth_date: str) -> int:
-    '''Рассчитать число жизненного пути из даты рождения'''
-    digits = birth_date.replace('-', '')
-    total = sum(int(d) for d in digits)
-    while total > 9 and total not in [11, 22, 33]:
-        total = sum(int(d) for d in str(total))
-    return total
-
-def calculate_destiny(name: str) -> int:
-    '''Рассчитать число судьбы из имени'''
-    values = {
-        'а': 1, 'б': 2, 'в': 3, 'г': 4, 'д': 5, 'е': 6, 'ё': 6, 'ж': 7, 'з': 8, 'и': 9,
-        'й': 1, 'к': 2, 'л': 3, 'м': 4, 'н': 5, 'о': 6, 'п': 7, 'р': 8, 'с': 9,
-        'т': 1, 'у': 2, 'ф': 3, 'х': 4, 'ц': 5, 'ч': 6, 'ш': 7, 'щ': 8, 'ы': 9,
-        'э': 1, 'ю': 2, 'я': 3,
-        'a': 1, 'b': 2, 'c': 3, 'd': 4, 'e': 5, 'f': 6, 'g': 7, 'h': 8, 'i': 9,
-        'j': 1, 'k': 2, 'l': 3, 'm': 4, 'n': 5, 'o': 6, 'p': 7, 'q': 8, 'r': 9,
-        's': 1, 't': 2, 'u': 3, 'v': 4, 'w': 5, 'x': 6, 'y': 7, 'z': 8
-    }
-    total = sum(values.get(char.lower(), 0) for char in name)
-    while total > 9 and total not in [11, 22, 33]:
-        total = sum(int(d) for d in str(total))
-    return total
+import math
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import date
+
+from cache import get_cache
+from runtime import (
+    ANY, App, JSON_HEADERS, Request, close_db, decode_cursor, dumps,
+    encode_cursor, error_response, get_db, json_response, parse_limit, release_db
+)
+from numerology import calculate_life_path, calculate_destiny
+
+
+CARD_COLUMNS = ('id', 'user_id', 'name', 'age', 'life_path', 'destiny', 'city', 'photo')
+CARD_SELECT = '''
+    p.id,
+    p.user_id,
+    u.name,
+    EXTRACT(YEAR FROM AGE(p.birth_date))::INTEGER AS age,
+    p.life_path,
+    p.destiny,
+    p.city,
+    COALESCE(p.photo_variants->0->>'card', p.photo_urls[1]) AS photo
+'''
+
+def serialize_cards(rows: List[Tuple], columns: Tuple[str, ...] = CARD_COLUMNS) -> str:
+    '''Сериализовать строки-кортежи карточек; лишние хвостовые колонки (ключ курсора) отбрасываются'''
+    return dumps([dict(zip(columns, row)) for row in rows])
+
+GEO_CELLS_PER_DEGREE = 10
+GEO_COLUMNS = 360 * GEO_CELLS_PER_DEGREE
+KM_PER_DEGREE = 111.32
+MAX_RADIUS_KM = 500
+
+MAX_SEARCH_INTERESTS = 20
+MAX_SEARCH_QUERY_LENGTH = 200
+# Запрос ищется сразу в русской и английской конфигурации, как построен profiles.search_vector
+SEARCH_TSQUERY = "(websearch_to_tsquery('russian', %(q)s) || websearch_to_tsquery('english', %(q)s))"
+
+# После стольких показов фильтр просмотренных начинается заново: ложные срабатывания растут с заполнением
+FEED_SEEN_CAPACITY = 1000
+
+def geo_cell_ranges(lat: float, lon: float, radius_km: float) -> Tuple[List[int], List[int]]:
+    '''Диапазоны geo_cell, покрывающие круг radius_km вокруг точки (с запасом в одну ячейку)'''
+    lat_delta = radius_km / KM_PER_DEGREE
+    lat_from = max(lat - lat_delta, -90.0)
+    lat_to = min(lat + lat_delta, 90.0)
+    widest = max(abs(lat_from), abs(lat_to))
+    lon_delta = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(widest)), 1e-6))
+
+    row_from = max(math.floor((lat_from + 90) * GEO_CELLS_PER_DEGREE) - 1, 0)
+    row_to = min(math.floor((lat_to + 90) * GEO_CELLS_PER_DEGREE) + 1, 180 * GEO_CELLS_PER_DEGREE)
+    col_from = math.floor((lon - lon_delta + 180) * GEO_CELLS_PER_DEGREE) - 1
+    col_to = math.floor((lon + lon_delta + 180) * GEO_CELLS_PER_DEGREE) + 1
+
+    if col_to - col_from >= GEO_COLUMNS - 1:
+        spans = [(0, GEO_COLUMNS - 1)]
+    elif col_from < 0:
+        spans = [(0, col_to), (col_from + GEO_COLUMNS, GEO_COLUMNS - 1)]
+    elif col_to >= GEO_COLUMNS:
+        spans = [(col_from, GEO_COLUMNS - 1), (0, col_to - GEO_COLUMNS)]
+    else:
+        spans = [(col_from, col_to)]
+
+    lows, highs = [], []
+    for row in range(row_from, row_to + 1):
+        for first, last in spans:
+            lows.append(row * GEO_COLUMNS + first)
+            highs.append(row * GEO_COLUMNS + last)
+    return lows, highs
+
+def photo_key(url: str) -> Optional[str]:
+    '''Ключ объекта S3 из CDN URL фото, None для внешних ссылок'''
+    _, marker, key = url.partition('/bucket/')
+    return key if marker and key.startswith('profiles/') else None
+
+def sync_photo_refs(cur, old_urls: List[str], new_urls: List[str]) -> None:
+    '''Обновить счётчики ссылок photo_refs по разнице между старым и новым набором фото'''
+    old_keys = {key for key in map(photo_key, old_urls) if key}
+    new_keys = {key for key in map(photo_key, new_urls) if key}
+    deltas = {key: 1 for key in new_keys - old_keys}
+    deltas.update({key: -1 for key in old_keys - new_keys})
+    if not deltas:
+        return
+    cur.execute('''
+        UPDATE photo_refs r
+        SET ref_count = r.ref_count + d.delta, updated_at = CURRENT_TIMESTAMP
+        FROM unnest(%s::TEXT[], %s::INTEGER[]) AS d(s3_key, delta)
+        WHERE r.s3_key = d.s3_key
+    ''', (list(deltas), list(deltas.values())))
+
+app = App(connect=get_db, release=release_db, allow_headers='Content-Type, If-None-Match')
+
+@app.get(action='feed')
+def feed(request: Request) -> Dict[str, Any]:
+    '''Лента по совместимости без себя, уже лайкнутых и уже показанных'''
+    params = request.params
+    user_id = params.get('user_id')
+
+    if not user_id:
+        return error_response(400, 'Missing user_id')
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return error_response(400, 'Invalid user_id')
+
+    try:
+        min_score = int(params.get('min_score', 0))
+    except ValueError:
+        return error_response(400, 'Invalid min_score')
+
+    limit = parse_limit(params.get('limit'))
+    if limit is None:
+        return error_response(400, 'Invalid limit')
+
+    cur = request.cursor(dict_rows=True)
+    if params.get('reset_seen') == '1':
+        cur.execute('DELETE FROM feed_seen WHERE user_id = %s', (user_id,))
+
+    # Обычно лента — одно чтение готового списка candidates по первичному ключу
+    query_params = {'user_id': user_id, 'min_score': min_score, 'limit': limit}
+    card_cur = request.cursor()
+    card_cur.execute(f'''
+        SELECT
+            {CARD_SELECT},
+            c.score AS compatibility,
+            c.destiny_score AS destiny_compatibility
+        FROM candidates cl
+        CROSS JOIN LATERAL unnest(cl.candidate_ids, cl.scores, cl.destiny_scores)
+            WITH ORDINALITY AS c(user_id, score, destiny_score, position)
+        JOIN profiles p ON p.user_id = c.user_id AND p.is_visible = true
+        JOIN users u ON p.user_id = u.id
+        LEFT JOIN feed_seen fs ON fs.user_id = cl.user_id
+        WHERE cl.user_id = %(user_id)s AND c.score >= %(min_score)s
+            AND NOT EXISTS (
+                SELECT 1 FROM likes l WHERE l.from_user_id = %(user_id)s AND l.to_user_id = p.user_id
+            )
+            AND NOT COALESCE(feed_seen_contains(fs.bloom, p.user_id), false)
+        ORDER BY c.position
+        LIMIT %(limit)s
+    ''', query_params)
+    profiles = card_cur.fetchall()
+
+    # Списка ещё нет (новый или неактивный пользователь) или полный список кончился — ранжируем на лету
+    if len(profiles) < limit:
+        cur.execute('''
+            SELECT cutoff_score IS NOT NULL AS full FROM candidates WHERE user_id = %s
+        ''', (user_id,))
+        stored = cur.fetchone()
+        if stored is None or stored['full']:
+            cur.execute('''
+                SELECT life_path, destiny FROM profiles WHERE user_id = %s
+            ''', (user_id,))
+            me = cur.fetchone()
+
+            if not me or me['life_path'] is None:
+                return error_response(404, 'Profile not found')
+
+            # Корзины (life_path, destiny) перебираются по убыванию оценок (OFFSET 0 не даёт планировщику развернуть
+            # подзапрос и потерять порядок), из корзины берётся не больше limit новых профилей по idx_profiles_feed_bucket.
+            # Incremental Sort досортировывает по created_at только корзины с равными оценками и останавливается на limit
+            card_cur.execute(f'''
+                SELECT
+                    {CARD_SELECT},
+                    b.score AS compatibility,
+                    b.destiny_score AS destiny_compatibility
+                FROM (
+                    SELECT cs.life_path_b AS life_path, d.destiny, cs.score, ds.score AS destiny_score
+                    FROM compatibility_scores cs
+                    CROSS JOIN (SELECT DISTINCT life_path_b FROM compatibility_scores UNION ALL SELECT 0) AS d(destiny)
+                    LEFT JOIN compatibility_scores ds ON ds.life_path_a = %(destiny)s AND ds.life_path_b = d.destiny
+                    WHERE cs.life_path_a = %(life_path)s AND cs.score >= %(min_score)s
+                    ORDER BY cs.score DESC, ds.score DESC NULLS LAST
+                    OFFSET 0
+                ) b
+                LEFT JOIN feed_seen fs ON fs.user_id = %(user_id)s
+                CROSS JOIN LATERAL (
+                    SELECT p.id, p.created_at
+                    FROM profiles p
+                    WHERE p.is_visible = true AND p.life_path = b.life_path AND COALESCE(p.destiny, 0) = b.destiny
+                        AND p.user_id <> %(user_id)s
+                        AND NOT EXISTS (
+                            SELECT 1 FROM likes l WHERE l.from_user_id = %(user_id)s AND l.to_user_id = p.user_id
+                        )
+                        AND NOT COALESCE(feed_seen_contains(fs.bloom, p.user_id), false)
+                    ORDER BY p.created_at DESC
+                    LIMIT %(limit)s
+                ) top
+                JOIN profiles p ON p.id = top.id
+                JOIN users u ON p.user_id = u.id
+                ORDER BY b.score DESC, b.destiny_score DESC NULLS LAST, top.created_at DESC
+                LIMIT %(limit)s
+            ''', {**query_params, 'destiny': me['destiny'], 'life_path': me['life_path']})
+            profiles = card_cur.fetchall()
+
+    if profiles:
+        cur.execute('''
+            INSERT INTO feed_seen (user_id, bloom, items)
+            VALUES (%(user_id)s, feed_seen_mask(%(shown)s::INTEGER[]), %(count)s)
+            ON CONFLICT (user_id) DO UPDATE SET
+                bloom = CASE WHEN feed_seen.items >= %(capacity)s THEN EXCLUDED.bloom
+                    ELSE feed_seen.bloom | EXCLUDED.bloom END,
+                items = CASE WHEN feed_seen.items >= %(capacity)s THEN EXCLUDED.items
+                    ELSE feed_seen.items + EXCLUDED.items END,
+                updated_at = CURRENT_TIMESTAMP
+        ''', {'user_id': user_id, 'shown': [row[1] for row in profiles], 'count': len(profiles),
+              'capacity': FEED_SEEN_CAPACITY})
+    request.conn.commit()
+
+    return json_response(serialize_cards(profiles, CARD_COLUMNS + ('compatibility', 'destiny_compatibility')))
+
+@app.get(near=ANY)
+def near(request: Request) -> Dict[str, Any]:
+    '''Профили в радиусе radius_km, по расстоянию'''
+    params = request.params
+    try:
+        lat, lon = (float(v) for v in params['near'].split(','))
+        radius_km = float(params.get('radius_km', 25))
+        min_score = int(params.get('min_score', 0))
+        valid = -90 <= lat <= 90 and -180 <= lon <= 180 and 0 < radius_km <= MAX_RADIUS_KM
+    except ValueError:
+        valid = False
+    if not valid:
+        return error_response(400, f'Expected near=lat,lon and radius_km up to {MAX_RADIUS_KM}')
+
+    limit = parse_limit(params.get('limit'))
+    if limit is None:
+        return error_response(400, 'Invalid limit')
+
+    user_id = params.get('user_id')
+    if user_id:
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            return error_response(400, 'Invalid user_id')
+    compatibility_join = ''
+    query_params = {'lat': lat, 'lon': lon, 'radius_km': radius_km, 'limit': limit, 'user_id': user_id}
+    if user_id:
+        cur = request.cursor(dict_rows=True)
+        cur.execute('''
+            SELECT life_path FROM profiles WHERE user_id = %s
+        ''', (user_id,))
+        me = cur.fetchone()
+
+        if not me or me['life_path'] is None:
+            return error_response(404, 'Profile not found')
+
+        compatibility_join = '''
+            JOIN compatibility_scores cs
+                ON cs.life_path_a = %(life_path)s AND cs.life_path_b = p.life_path AND cs.score >= %(min_score)s
+        '''
+        query_params.update(life_path=me['life_path'], min_score=min_score)
+
+    query_params['lows'], query_params['highs'] = geo_cell_ranges(lat, lon, radius_km)
+    card_cur = request.cursor()
+    card_cur.execute(f'''
+        SELECT {', '.join(CARD_COLUMNS)}, compatibility, ROUND(distance_km::NUMERIC, 1)::FLOAT
+        FROM (
+            SELECT
+                {CARD_SELECT},
+                {'cs.score' if user_id else 'NULL::INTEGER'} AS compatibility,
+                2 * 6371 * ASIN(SQRT(
+                    POWER(SIN(RADIANS(p.latitude - %(lat)s) / 2), 2)
+                    + COS(RADIANS(%(lat)s)) * COS(RADIANS(p.latitude))
+                    * POWER(SIN(RADIANS(p.longitude - %(lon)s) / 2), 2)
+                )) AS distance_km
+            FROM unnest(%(lows)s::BIGINT[], %(highs)s::BIGINT[]) AS cells(low, high)
+            JOIN profiles p ON p.is_visible = true AND p.geo_cell BETWEEN cells.low AND cells.high
+            JOIN users u ON p.user_id = u.id
+            {compatibility_join}
+            WHERE p.user_id IS DISTINCT FROM %(user_id)s::INTEGER
+        ) nearby
+        WHERE distance_km <= %(radius_km)s
+        ORDER BY distance_km
+        LIMIT %(limit)s
+    ''', query_params)
+
+    return json_response(serialize_cards(card_cur.fetchall(), CARD_COLUMNS + ('compatibility', 'distance_km')))
+
+@app.get(id=ANY)
+def profile(request: Request) -> Dict[str, Any]:
+    '''Полный профиль по ID'''
+    profile_id = request.params['id']
+    entry = get_cache().entry(f'profile:{profile_id}', (f'profile:{profile_id}',))
+    cached = entry.cached(request.event)
+    if cached:
+        return cached
+
+    cur = request.cursor(dict_rows=True)
+    cur.execute('''
+        SELECT 
+            p.*, 
+            u.name, 
+            u.email, 
+            u.avatar_url,
+            EXTRACT(YEAR FROM AGE(p.birth_date))::INTEGER AS age
+        FROM profiles p
+        JOIN users u ON p.user_id = u.id
+        WHERE p.id = %s AND p.is_visible = true
+    ''', (profile_id,))
+    result = cur.fetchone()
+    
+    if not result:
+        return error_response(404, 'Profile not found')
+    result.pop('search_vector', None)
+
+    return entry.respond(request.event, JSON_HEADERS, dumps(result), 'private, no-cache')
+
+@app.get(q=ANY)
+@app.get(interests=ANY)
+def search(request: Request) -> Dict[str, Any]:
+    '''Поиск по интересам и тексту описания, с user_id ранжируется вместе с совместимостью'''
+    params = request.params
+    q = params.get('q', '').strip()
+    interests = [value.strip() for value in params.get('interests', '').split(',') if value.strip()]
+    match_all = params.get('interests_match') == 'all'
+
+    if len(q) > MAX_SEARCH_QUERY_LENGTH or len(interests) > MAX_SEARCH_INTERESTS or not (q or interests):
+        return error_response(
+            400, f'Expected q up to {MAX_SEARCH_QUERY_LENGTH} characters or up to {MAX_SEARCH_INTERESTS} interests'
+        )
+
+    try:
+        min_score = int(params.get('min_score', 0))
+    except ValueError:
+        return error_response(400, 'Invalid min_score')
+
+    limit = parse_limit(params.get('limit'))
+    if limit is None:
+        return error_response(400, 'Invalid limit')
+
+    user_id = params.get('user_id')
+    if user_id:
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            return error_response(400, 'Invalid user_id')
+    compatibility_join = ''
+    query_params = {'q': q, 'interests': interests, 'user_id': user_id, 'limit': limit}
+    if user_id:
+        cur = request.cursor(dict_rows=True)
+        cur.execute('''
+            SELECT life_path FROM profiles WHERE user_id = %s
+        ''', (user_id,))
+        me = cur.fetchone()
+
+        if not me or me['life_path'] is None:
+            return error_response(404, 'Profile not found')
+
+        compatibility_join = '''
+            JOIN compatibility_scores cs
+                ON cs.life_path_a = %(life_path)s AND cs.life_path_b = p.life_path AND cs.score >= %(min_score)s
+        '''
+        query_params.update(life_path=me['life_path'], min_score=min_score)
+
+    # Оба условия проверяются GIN-индексами по видимым профилям, ранжируются только найденные строки
+    filters = []
+    text_rank = interest_rank = '0'
+    if q:
+        filters.append(f'p.search_vector @@ {SEARCH_TSQUERY}')
+        text_rank = f'ts_rank_cd(p.search_vector, {SEARCH_TSQUERY}, 32)'
+    if interests:
+        filters.append(f"p.interests {'@>' if match_all else '&&'} %(interests)s::TEXT[]")
+        interest_rank = '''
+            cardinality(ARRAY(SELECT unnest(p.interests) INTERSECT SELECT unnest(%(interests)s::TEXT[])))::FLOAT
+                / cardinality(%(interests)s::TEXT[])
+        '''
+
+    # Карточки (с join users) собираются только для строк, прошедших LIMIT
+    card_cur = request.cursor()
+    card_cur.execute(f'''
+        SELECT {CARD_SELECT}, found.compatibility, ROUND(found.relevance::NUMERIC, 3)::FLOAT
+        FROM (
+            SELECT id, compatibility, relevance
+            FROM (
+                SELECT
+                    p.id,
+                    {'cs.score' if user_id else 'NULL::INTEGER'} AS compatibility,
+                    {text_rank} + {interest_rank} AS relevance
+                FROM profiles p
+                {compatibility_join}
+                WHERE p.is_visible = true AND {' AND '.join(filters)}
+                    AND p.user_id IS DISTINCT FROM %(user_id)s::INTEGER
+            ) matched
+            ORDER BY relevance + COALESCE(compatibility, 0) / 100.0 DESC, id DESC
+            LIMIT %(limit)s
+        ) found
+        JOIN profiles p ON p.id = found.id
+        JOIN users u ON p.user_id = u.id
+        ORDER BY found.relevance + COALESCE(found.compatibility, 0) / 100.0 DESC, p.id DESC
+    ''', query_params)
+
+    return json_response(serialize_cards(card_cur.fetchall(), CARD_COLUMNS + ('compatibility', 'relevance')))
+
+@app.get()
+def profile_list(request: Request) -> Dict[str, Any]:
+    '''Страница карточек видимых профилей, новые первыми'''
+    params = request.params
+    limit = parse_limit(params.get('limit'))
+    if limit is None:
+        return error_response(400, 'Invalid limit')
+
+    position = None
+    if params.get('cursor'):
+        position = decode_cursor(params['cursor'])
+        if position is None:
+            return error_response(400, 'Invalid cursor')
+
+    entry = get_cache().entry(f"profiles:list:{limit}:{params.get('cursor') or ''}", ('profiles',))
+    cached = entry.cached(request.event)
+    if cached:
+        return cached
+
+    cursor_filter = 'AND (p.created_at, p.id) < (%s, %s)' if position else ''
+    card_cur = request.cursor()
+    card_cur.execute(f'''
+        SELECT {CARD_SELECT}, p.created_at
+        FROM profiles p
+        JOIN users u ON p.user_id = u.id
+        WHERE p.is_visible = true {cursor_filter}
+        ORDER BY p.created_at DESC, p.id DESC
+        LIMIT %s
+    ''', (*(position or ()), limit + 1))
+    profiles = card_cur.fetchall()
+
+    headers = {**JSON_HEADERS, 'Access-Control-Expose-Headers': 'X-Next-Cursor'}
+    if len(profiles) > limit:
+        profiles = profiles[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(profiles[-1][-1], profiles[-1][0])
+
+    return entry.respond(request.event, headers, serialize_cards(profiles), 'public, no-cache')
+
+@app.post()
+def save_profile(request: Request) -> Dict[str, Any]:
+    '''Создать или обновить пользователя и профиль'''
+    from psycopg2.extras import Json
+    user_data = request.body.get('user', {})
+    profile_data = request.body.get('profile', {})
+    conn = request.conn
+    cur = request.cursor(dict_rows=True)
+    
+    cur.execute('''
+        INSERT INTO users (email, name, provider, avatar_url)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (email) 
+        DO UPDATE SET name = EXCLUDED.name, avatar_url = EXCLUDED.avatar_url, last_active = CURRENT_TIMESTAMP
+        RETURNING id
+    ''', (
+        user_data.get('email'),
+        user_data.get('name'),
+        user_data.get('provider', 'guest'),
+        user_data.get('avatar_url')
+    ))
+    user_id = cur.fetchone()['id']
+    
+    birth_date = profile_data.get('birth_date')
+    if not birth_date:
+        cur.execute('SELECT id FROM profiles WHERE user_id = %s', (user_id,))
+        profile = cur.fetchone()
+        conn.commit()
+        get_cache().invalidate('profiles', *([f"profile:{profile['id']}"] if profile else []))
+        return json_response({'success': True, 'user_id': user_id})
+
+    life_path = calculate_life_path(birth_date)
+    destiny = calculate_destiny(user_data.get('name', ''))
+    photo_urls = profile_data.get('photo_urls', [])
+
+    cur.execute('SELECT photo_urls FROM profiles WHERE user_id = %s FOR UPDATE', (user_id,))
+    previous = cur.fetchone()
+    sync_photo_refs(cur, (previous and previous['photo_urls']) or [], photo_urls)
+    
+    cur.execute('''
+        INSERT INTO profiles (
+            user_id, birth_date, gender, city, bio, interests, 
+            life_path, destiny, latitude, longitude, photo_urls, photo_variants
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (user_id)
+        DO UPDATE SET 
+            birth_date = EXCLUDED.birth_date,
+            gender = EXCLUDED.gender,
+            city = EXCLUDED.city,
+            bio = EXCLUDED.bio,
+            interests = EXCLUDED.interests,
+            life_path = EXCLUDED.life_path,
+            destiny = EXCLUDED.destiny,
+            latitude = EXCLUDED.latitude,
+            longitude = EXCLUDED.longitude,
+            photo_urls = EXCLUDED.photo_urls,
+            photo_variants = EXCLUDED.photo_variants,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING id
+    ''', (
+        user_id,
+        birth_date,
+        profile_data.get('gender'),
+        profile_data.get('city'),
+        profile_data.get('bio'),
+        profile_data.get('interests', []),
+        life_path,
+        destiny,
+        profile_data.get('latitude'),
+        profile_data.get('longitude'),
+        photo_urls,
+        Json(profile_data.get('photo_variants', []))
+    ))
+    
+    profile_id = cur.fetchone()['id']
+    conn.commit()
+    get_cache().invalidate('profiles', f'profile:{profile_id}')
+    
+    return json_response({
+        'success': True,
+        'user_id': user_id,
+        'profile_id': profile_id,
+        'life_path': life_path,
+        'destiny': destiny
+    })
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     API для работы с профилями пользователей
-    GET /profiles - список всех видимых профилей
-    GET /profiles/{id} - получить профиль по ID
+    GET /profiles?limit=N&cursor=C - страница карточек видимых профилей, курсор следующей страницы в X-Next-Cursor
+    GET /profiles?id=X - полный профиль по ID
+    Список и профиль по ID кэшируются (cache.py) и отдают ETag, If-None-Match с тем же ETag даёт 304
+    GET /profiles?action=feed&user_id=X&min_score=85 - лента, ранжированная по совместимости
+        без себя, уже лайкнутых и уже показанных (фильтр Блума feed_seen); reset_seen=1 начинает показ заново
+        Читается из candidates (scripts/refresh_candidates.py), без готового списка ранжируется на лету
+    GET /profiles?near=lat,lon&radius_km=R[&user_id=X&min_score=N] - профили рядом, по расстоянию
+    GET /profiles?q=текст&interests=музыка,спорт[&interests_match=all&user_id=X&min_score=N] - поиск по описанию
+        и интересам (любой из или все), по релевантности плюс совместимость/100, если передан user_id
     POST /profiles - создать/обновить профиль
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    try:
-        if method == 'GET':
-            params = event.get('queryStringParameters') or {}
-            profile_id = params.get('id')
-            
-            if profile_id:
-                cur.execute('''
-                    SELECT 
-                        p.*, 
-                        u.name, 
-                        u.email, 
-                        u.avatar_url,
-                        EXTRACT(YEAR FROM AGE(p.birth_date)) AS age
-                    FROM profiles p
-                    JOIN users u ON p.user_id = u.id
-                    WHERE p.id = %s AND p.is_visible = true
-                ''', (profile_id,))
-                profile = cur.fetchone()
-                
-                if not profile:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Profile not found'}),
-                        'isBase64Encoded': False
-                    }
-                
-                result = dict(profile)
-                if result.get('birth_date'):
-                    result['birth_date'] = result['birth_date'].isoformat()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps(result, default=str),
-                    'isBase64Encoded': False
-                }
-            
-            else:
-                cur.execute('''
-                    SELECT 
-                        p.*, 
-                        u.name, 
-                        u.email, 
-                        u.avatar_url,
-                        EXTRACT(YEAR FROM AGE(p.birth_date)) AS age
-                    FROM profiles p
-                    JOIN users u ON p.user_id = u.id
-                    WHERE p.is_visible = true
-                    ORDER BY p.created_at DESC
-                    LIMIT 50
-                ''')
-                profiles = cur.fetchall()
-                
-                result = []
-                for profile in profiles:
-                    p = dict(profile)
-                    if p.get('birth_date'):
-                        p['birth_date'] = p['birth_date'].isoformat()
-                    result.append(p)
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps(result, default=str),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            
-            user_data = body.get('user', {})
-            profile_data = body.get('profile', {})
-            
-            cur.execute('''
-                INSERT INTO users (email, name, provider, avatar_url)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (email) 
-                DO UPDATE SET name = EXCLUDED.name, avatar_url = EXCLUDED.avatar_url, last_active = CURRENT_TIMESTAMP
-                RETURNING id
-            ''', (
-                user_data.get('email'),
-                user_data.get('name'),
-                user_data.get('provider', 'guest'),
-                user_data.get('avatar_url')
-            ))
-            user_id = cur.fetchone()['id']
-            
-            birth_date = profile_data.get('birth_date')
-            if birth_date:
-                life_path = calculate_life_path(birth_date)
-                destiny = calculate_destiny(user_data.get('name', ''))
-                
-                cur.execute('''
-                    INSERT INTO profiles (
-                        user_id, birth_date, gender, city, bio, interests, 
-                        life_path, destiny, latitude, longitude, photo_urls
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (user_id)
-                    DO UPDATE SET 
-                        birth_date = EXCLUDED.birth_date,
-                        gender = EXCLUDED.gender,
-                        city = EXCLUDED.city,
-                        bio = EXCLUDED.bio,
-                        interests = EXCLUDED.interests,
-                        life_path = EXCLUDED.life_path,
-                        destiny = EXCLUDED.destiny,
-                        latitude = EXCLUDED.latitude,
-                        longitude = EXCLUDED.longitude,
-                        photo_urls = EXCLUDED.photo_urls,
-                        updated_at = CURRENT_TIMESTAMP
-                    RETURNING id
-                ''', (
-                    user_id,
-                    birth_date,
-                    profile_data.get('gender'),
-                    profile_data.get('city'),
-                    profile_data.get('bio'),
-                    profile_data.get('interests', []),
-                    life_path,
-                    destiny,
-                    profile_data.get('latitude'),
-                    profile_data.get('longitude'),
-                    profile_data.get('photo_urls', [])
-                ))
-                
-                profile_id = cur.fetchone()['id']
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'user_id': user_id,
-                        'profile_id': profile_id,
-                        'life_path': life_path,
-                        'destiny': destiny
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            else:
-                conn.commit()
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'user_id': user_id}),
-                    'isBase64Encoded': False
-                }
-        
-        else:
-            return {
-                'statusCode': 405,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Method not allowed'}),
-                'isBase64Encoded': False
-            }
-    
-    finally:
-        cur.close()
-        conn.close()
+    return app(event, context)
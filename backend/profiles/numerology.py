@@ -0,0 +1,114 @@
+'''
+Нумерология профилей: число жизненного пути, число судьбы и совместимость
+Скалярные функции для handler и пакетные на NumPy для пересчёта больших выборок (numpy нужен только пакетным)
+'''
+from datetime import date
+from typing import Iterable, Union
+
+MASTER_NUMBERS = (11, 22, 33)
+
+LETTER_VALUES = {
+    'а': 1, 'б': 2, 'в': 3, 'г': 4, 'д': 5, 'е': 6, 'ё': 6, 'ж': 7, 'з': 8, 'и': 9,
+    'й': 1, 'к': 2, 'л': 3, 'м': 4, 'н': 5, 'о': 6, 'п': 7, 'р': 8, 'с': 9,
+    'т': 1, 'у': 2, 'ф': 3, 'х': 4, 'ц': 5, 'ч': 6, 'ш': 7, 'щ': 8, 'ы': 9,
+    'э': 1, 'ю': 2, 'я': 3,
+    'a': 1, 'b': 2, 'c': 3, 'd': 4, 'e': 5, 'f': 6, 'g': 7, 'h': 8, 'i': 9,
+    'j': 1, 'k': 2, 'l': 3, 'm': 4, 'n': 5, 'o': 6, 'p': 7, 'q': 8, 'r': 9,
+    's': 1, 't': 2, 'u': 3, 'v': 4, 'w': 5, 'x': 6, 'y': 7, 'z': 8
+}
+
+# Все символы, у которых lower() попадает в LETTER_VALUES, лежат ниже U+3000 (последний — знак Кельвина U+212A)
+LETTER_CODEPOINTS = 0x3000
+
+# Та же шкала, что compatibility_scores (V0002) и calculateCompatibility на клиенте, индекс — |a - b|
+COMPATIBILITY_BY_DIFF = (100, 85, 85, 70, 70, 55, 55) + (40,) * 27
+
+
+def _reduce_slow(total: int) -> int:
+    while total > 9 and total not in MASTER_NUMBERS:
+        total = sum(int(d) for d in str(total))
+    return total
+
+
+def _reduced_table(size: int) -> tuple:
+    # Сумма цифр числа меньше самого числа, поэтому таблица строится по уже посчитанным значениям, без str()
+    digit_sums = list(range(10)) + [0] * (size - 10)
+    reduced = list(range(10)) + [0] * (size - 10)
+    for total in range(10, size):
+        digit_sums[total] = digit_sums[total // 10] + total % 10
+        reduced[total] = total if total in MASTER_NUMBERS else reduced[digit_sums[total]]
+    return tuple(reduced)
+
+
+# Свёртка суммы цифр до 1–9 или мастер-числа; длиннее таблицы суммы бывают только у очень длинных имён
+REDUCED = _reduced_table(4096)
+
+_letter_table = None
+
+
+def reduce_number(total: int) -> int:
+    '''Свернуть сумму до однозначного числа, сохраняя мастер-числа 11, 22, 33'''
+    return REDUCED[total] if total < len(REDUCED) else _reduce_slow(total)
+
+
+def calculate_life_path(birth_date: str) -> int:
+    '''Рассчитать число жизненного пути из даты рождения'''
+    return reduce_number(sum(int(d) for d in birth_date.replace('-', '')))
+
+
+def calculate_destiny(name: str) -> int:
+    '''Рассчитать число судьбы из имени'''
+    return reduce_number(sum(LETTER_VALUES.get(char.lower(), 0) for char in name))
+
+
+def compatibility(life_path_a: int, life_path_b: int) -> int:
+    '''Совместимость двух чисел по шкале compatibility_scores'''
+    return COMPATIBILITY_BY_DIFF[min(abs(life_path_a - life_path_b), len(COMPATIBILITY_BY_DIFF) - 1)]
+
+
+def _np():
+    import numpy
+    return numpy
+
+
+def _reduce_batch(totals):
+    np = _np()
+    if totals.size and totals.max() >= len(REDUCED):
+        return np.array([reduce_number(int(total)) for total in totals], dtype=np.int16)
+    return np.asarray(REDUCED, dtype=np.int16)[totals]
+
+
+def life_path_batch(birth_dates: Iterable[Union[str, date]]):
+    '''Числа жизненного пути для массива дат (строки YYYY-MM-DD или date), int16 ndarray'''
+    np = _np()
+    raw = np.array([str(value) for value in birth_dates], dtype=np.bytes_)
+    if raw.size == 0:
+        return np.zeros(0, dtype=np.int16)
+    digits = raw.view(np.uint8).reshape(raw.size, -1).astype(np.int16) - ord('0')
+    totals = np.where((digits >= 0) & (digits <= 9), digits, 0).sum(axis=1)
+    return _reduce_batch(totals)
+
+
+def destiny_batch(names: Iterable[str]):
+    '''Числа судьбы для массива имён, int16 ndarray'''
+    global _letter_table
+    np = _np()
+    if _letter_table is None:
+        _letter_table = np.array(
+            [LETTER_VALUES.get(chr(code).lower(), 0) for code in range(LETTER_CODEPOINTS)], dtype=np.int16
+        )
+    raw = np.array([name or '' for name in names], dtype=np.str_)
+    if raw.size == 0:
+        return np.zeros(0, dtype=np.int16)
+    codes = raw.view(np.uint32).reshape(raw.size, -1)
+    values = np.where(codes < LETTER_CODEPOINTS, _letter_table[np.minimum(codes, LETTER_CODEPOINTS - 1)], 0)
+    return _reduce_batch(values.sum(axis=1))
+
+
+def compatibility_batch(life_paths_a, life_paths_b):
+    '''Поэлементная совместимость двух массивов чисел (или массива и числа), int16 ndarray'''
+    np = _np()
+    diff = np.abs(np.asarray(life_paths_a, dtype=np.int16) - np.asarray(life_paths_b, dtype=np.int16))
+    table = np.asarray(COMPATIBILITY_BY_DIFF, dtype=np.int16)
+    return table[np.minimum(diff, len(table) - 1)]
+
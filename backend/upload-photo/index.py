@@ -1,98 +1,351 @@
-import json
 import os
+import io
 import base64
-import boto3
-from typing import Dict, Any
+import hashlib
+from typing import Dict, Any, List, Optional, Tuple
 import uuid
 from datetime import datetime
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+from runtime import ANY, App, Request, close_db, error_response, get_db, instrument_s3, json_response, release_db
+
+BUCKET = 'files'
+PRESIGN_EXPIRES_SECONDS = 600
+MAX_PHOTO_BYTES = 15 * 1024 * 1024
+CONTENT_TYPE_EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp'
+}
+PHOTO_VARIANTS = {'full': 1080, 'card': 480, 'avatar': 96}
+# Оригинал перекодируется в свой же формат, чтобы убрать метаданные; качество выше, чем у копий
+ORIGINAL_FORMATS = {'image/jpeg': 'JPEG', 'image/png': 'PNG', 'image/gif': 'GIF', 'image/webp': 'WEBP'}
+ORIGINAL_QUALITY = 92
+
+_variant_format = None
+
+def variant_format() -> Tuple[str, str, str]:
+    '''Формат копий (формат Pillow, Content-Type, расширение): WebP, если Pillow собран с ним, иначе JPEG'''
+    global _variant_format
+    if _variant_format is None:
+        from PIL import features
+        _variant_format = ('WEBP', 'image/webp', 'webp') if features.check('webp') else ('JPEG', 'image/jpeg', 'jpg')
+    return _variant_format
+
+MAX_BATCH_IMAGES = 10
+UPLOAD_WORKERS = 6
+
+_s3 = None
+
+def get_s3():
+    '''Клиент S3-совместимого хранилища, один на контейнер функции; boto3 загружается при первом обращении к S3'''
+    global _s3
+    if _s3 is None:
+        import boto3
+        from botocore.config import Config
+        _s3 = instrument_s3(boto3.client('s3',
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev'),
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+            config=Config(
+                signature_version='s3v4',
+                max_pool_connections=UPLOAD_WORKERS * 4,
+                tcp_keepalive=True,
+                retries={'max_attempts': 3, 'mode': 'standard'}
+            )
+        ))
+    return _s3
+
+def detect_image_type(data: bytes) -> Optional[str]:
+    '''Тип изображения по сигнатуре файла'''
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def strip_jpeg_metadata(data: bytes) -> bytes:
+    '''Убрать из JPEG сегменты APP1–APP15 (EXIF, XMP, GPS) и комментарии, не декодируя изображение'''
+    out = bytearray(data[:2])
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == 0xDA:
+            break
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+        if not (0xE1 <= marker <= 0xEF or marker == 0xFE):
+            out += data[pos:end]
+        pos = end
+    # Сжатые данные начинаются с SOS; обрезанный до него файл сохраняется без хвоста
+    if data[pos:pos + 2] == b'\xff\xda':
+        out += data[pos:]
+    return bytes(out)
+
+def clean_original(image_bytes: bytes, content_type: str) -> bytes:
     '''
-    API для загрузки фото профиля в S3
-    POST /upload-photo - загрузить фото (base64 в JSON body)
+    Оригинал без EXIF/XMP/GPS и комментариев: перекодированный в свой формат с учётом ориентации, ICC-профиль сохраняется
+    Если Pillow не может декодировать файл, JPEG чистится по сегментам, остальные форматы отдаются как есть
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
-    
+    from PIL import Image, ImageOps
+
+    image_format = ORIGINAL_FORMATS[content_type]
     try:
-        body = json.loads(event.get('body', '{}'))
-        image_data = body.get('image')
-        user_id = body.get('user_id')
-        
-        if not image_data or not user_id:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Missing image or user_id'}),
-                'isBase64Encoded': False
-            }
-        
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        image_bytes = base64.b64decode(image_data)
-        
-        file_ext = 'jpg'
-        if image_data.startswith('/9j/'):
-            file_ext = 'jpg'
-        elif image_data.startswith('iVBOR'):
-            file_ext = 'png'
-        elif image_data.startswith('R0lGOD'):
-            file_ext = 'gif'
-        
-        filename = f"profiles/{user_id}/{uuid.uuid4()}.{file_ext}"
-        
-        s3 = boto3.client('s3',
-            endpoint_url='https://bucket.poehali.dev',
-            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+        with Image.open(io.BytesIO(image_bytes)) as source:
+            icc_profile = source.info.get('icc_profile')
+            out = io.BytesIO()
+            if getattr(source, 'n_frames', 1) > 1:
+                # Анимация сохраняется целиком; у GIF/WebP с кадрами не бывает поворота из EXIF
+                source.info = {key: value for key, value in source.info.items() if key in ('duration', 'loop')}
+                source.save(out, format=image_format, save_all=True)
+            else:
+                image = ImageOps.exif_transpose(source)
+                image.info = {}
+                options = {'icc_profile': icc_profile} if icc_profile else {}
+                if image_format in ('JPEG', 'WEBP'):
+                    options['quality'] = ORIGINAL_QUALITY
+                if image_format == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+                    image = image.convert('RGB')
+                image.save(out, format=image_format, **options)
+            return out.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return strip_jpeg_metadata(image_bytes) if content_type == 'image/jpeg' else image_bytes
+
+def decodes(image_bytes: bytes) -> bool:
+    '''Декодирует ли Pillow изображение; JPEG через draft декодируется в уменьшенном масштабе, это дёшево'''
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as source:
+            source.draft('RGB', (PHOTO_VARIANTS['avatar'], PHOTO_VARIANTS['avatar']))
+            source.load()
+        return True
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return False
+
+def render_variants(image_bytes: bytes) -> Dict[str, bytes]:
+    '''
+    Уменьшенные копии фото (full, card, avatar) с учётом ориентации и без EXIF
+    Возвращает пустой словарь, если изображение не удаётся декодировать
+    '''
+    from PIL import Image, ImageOps
+
+    image_format = variant_format()[0]
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as source:
+            image = ImageOps.exif_transpose(source)
+            has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha and image_format == 'WEBP' else 'RGB')
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return {}
+
+    variants = {}
+    for name, size in sorted(PHOTO_VARIANTS.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format=image_format, quality=80)
+        variants[name] = out.getvalue()
+    return variants
+
+def variant_key(key: str, name: str) -> str:
+    '''Ключ уменьшенной копии рядом с оригиналом'''
+    return f"{key.rsplit('.', 1)[0]}_{name}.{variant_format()[2]}"
+
+def store_variants(s3, key: str, image_bytes: bytes) -> Dict[str, str]:
+    '''Сохранить уменьшенные копии рядом с оригиналом и вернуть их URL'''
+    urls = {}
+    for name, data in render_variants(image_bytes).items():
+        s3.put_object(
+            Bucket=BUCKET,
+            Key=variant_key(key, name),
+            Body=data,
+            ContentType=variant_format()[1],
+            CacheControl='public, max-age=31536000, immutable'
         )
-        
-        content_type = f'image/{file_ext}'
+        urls[name] = cdn_url(variant_key(key, name))
+    return urls
+
+def decode_image(image_data: str) -> bytes:
+    '''Байты изображения из base64 или data URL'''
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    return base64.b64decode(image_data)
+
+def photo_key(user_id: str, image_bytes: bytes, content_type: str) -> str:
+    '''Ключ объекта по хэшу содержимого: одинаковые фото пользователя ложатся в один объект'''
+    digest = hashlib.blake2b(image_bytes, digest_size=20).hexdigest()
+    return f"profiles/{user_id}/{digest}.{CONTENT_TYPE_EXTENSIONS[content_type]}"
+
+def head_object(s3, key: str) -> Optional[Dict[str, Any]]:
+    '''Метаданные объекта или None, если его нет'''
+    try:
+        return s3.head_object(Bucket=BUCKET, Key=key)
+    except s3.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+            raise
+        return None
+
+def register_photos(request: Request, user_id: str, keys: List[str]) -> None:
+    '''Учесть объекты в photo_refs до записи в S3, чтобы сборщик мусора не удалил их во время загрузки'''
+    request.cursor().execute('''
+        INSERT INTO photo_refs (s3_key, user_id)
+        SELECT DISTINCT key, %s::INTEGER FROM unnest(%s::TEXT[]) AS key
+        ON CONFLICT (s3_key) DO UPDATE SET updated_at = CURRENT_TIMESTAMP
+    ''', (user_id, keys))
+    request.conn.commit()
+
+def store_photo(s3, key: str, image_bytes: bytes, content_type: str) -> Dict[str, Any]:
+    '''
+    Сохранить оригинал без метаданных и уменьшенные копии, если такого содержимого ещё нет
+    Ключ считается по присланным байтам, поэтому повторная загрузка того же файла находит готовый объект
+    Копии пишутся раньше оригинала, поэтому существующий оригинал означает готовые копии
+    '''
+    head = head_object(s3, key)
+    if head is not None:
+        names = [name for name in head.get('Metadata', {}).get('variants', '').split(',') if name]
+        variants = {name: cdn_url(variant_key(key, name)) for name in names}
+    else:
+        variants = store_variants(s3, key, image_bytes)
         s3.put_object(
-            Bucket='files',
-            Key=filename,
-            Body=image_bytes,
-            ContentType=content_type
+            Bucket=BUCKET,
+            Key=key,
+            Body=clean_original(image_bytes, content_type),
+            ContentType=content_type,
+            Metadata={'variants': ','.join(variants)}
         )
-        
-        cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{filename}"
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'success': True,
-                'url': cdn_url,
-                'filename': filename
-            }),
-            'isBase64Encoded': False
-        }
+    return {
+        'url': cdn_url(key),
+        'filename': key,
+        'variants': variants,
+        'deduplicated': head is not None
+    }
+
+def cdn_url(key: str) -> str:
+    '''Публичный URL объекта на CDN'''
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+
+app = App(connect=get_db, release=release_db, expose_errors=True)
+
+@app.post(action='presign')
+def presign(request: Request) -> Dict[str, Any]:
+    '''Presigned PUT URL для загрузки напрямую в S3'''
+    user_id = request.body.get('user_id')
+    content_type = request.body.get('content_type', 'image/jpeg')
+
+    if not user_id or content_type not in CONTENT_TYPE_EXTENSIONS:
+        return error_response(400, 'Missing user_id or unsupported content_type')
+
+    key = f"profiles/{user_id}/incoming/{uuid.uuid4()}.{CONTENT_TYPE_EXTENSIONS[content_type]}"
+    upload_url = get_s3().generate_presigned_url(
+        'put_object',
+        Params={'Bucket': BUCKET, 'Key': key, 'ContentType': content_type},
+        ExpiresIn=PRESIGN_EXPIRES_SECONDS
+    )
+
+    return json_response({
+        'success': True,
+        'upload_url': upload_url,
+        'method': 'PUT',
+        'headers': {'Content-Type': content_type},
+        'key': key,
+        'expires_in': PRESIGN_EXPIRES_SECONDS
+    })
+
+@app.post(action='finalize')
+def finalize(request: Request) -> Dict[str, Any]:
+    '''Проверить загрузку по presigned URL, сделать копии и вернуть URL'''
+    user_id = request.body.get('user_id')
+    key = request.body.get('key') or ''
+
+    if not user_id or not key.startswith(f'profiles/{user_id}/incoming/') or '..' in key:
+        return error_response(400, 'Missing user_id or key outside the user upload folder')
+
+    s3 = get_s3()
+    head = head_object(s3, key)
+
+    if head is None:
+        return error_response(404, 'Photo was not uploaded')
+
+    if head['ContentLength'] > MAX_PHOTO_BYTES:
+        s3.delete_object(Bucket=BUCKET, Key=key)
+        return error_response(400, 'Photo is too large')
+
+    # Content-Type задаёт клиент при PUT, поэтому тип определяется по самим байтам, а не по заголовку
+    image_bytes = s3.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+    content_type = detect_image_type(image_bytes)
+    if content_type is None or not decodes(image_bytes):
+        s3.delete_object(Bucket=BUCKET, Key=key)
+        return error_response(400, 'Uploaded file is not a readable image')
+
+    content_key = photo_key(user_id, image_bytes, content_type)
+    register_photos(request, user_id, [content_key])
+    photo = store_photo(s3, content_key, image_bytes, content_type)
+    s3.delete_object(Bucket=BUCKET, Key=key)
+
+    return json_response({'success': True, 'size': head['ContentLength'], **photo})
+
+@app.post(images=ANY)
+def upload_batch(request: Request) -> Dict[str, Any]:
+    '''Несколько фото одним запросом, S3 пишется параллельно'''
+    user_id = request.body.get('user_id')
+    images = request.body.get('images')
+
+    if not user_id or not isinstance(images, list) or not 0 < len(images) <= MAX_BATCH_IMAGES:
+        return error_response(400, f'Expected user_id and 1-{MAX_BATCH_IMAGES} images')
+
+    decoded: List[bytes] = [decode_image(image) for image in images]
+    content_types = [detect_image_type(image_bytes) for image_bytes in decoded]
+
+    if None in content_types:
+        return error_response(400, f'Unsupported image format at index {content_types.index(None)}')
+
+    keys = [photo_key(user_id, image_bytes, ct) for image_bytes, ct in zip(decoded, content_types)]
+    register_photos(request, user_id, keys)
+
+    unique = dict(zip(keys, zip(decoded, content_types)))
+    s3 = get_s3()
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=min(len(unique), UPLOAD_WORKERS)) as pool:
+        stored = dict(zip(unique, pool.map(
+            lambda key: store_photo(s3, key, *unique[key]),
+            unique
+        )))
+    photos = [stored[key] for key in keys]
+
+    return json_response({'success': True, 'photos': photos})
+
+@app.post()
+def upload(request: Request) -> Dict[str, Any]:
+    '''Одно фото в base64'''
+    image_data = request.body.get('image')
+    user_id = request.body.get('user_id')
+    
+    if not image_data or not user_id:
+        return error_response(400, 'Missing image or user_id')
     
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+    image_bytes = decode_image(image_data)
+    content_type = detect_image_type(image_bytes)
+    
+    if not content_type:
+        return error_response(400, 'Unsupported image format')
+    
+    key = photo_key(user_id, image_bytes, content_type)
+    register_photos(request, user_id, [key])
+    photo = store_photo(get_s3(), key, image_bytes, content_type)
+    
+    return json_response({'success': True, **photo})
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    API для загрузки фото профиля в S3
+    POST /upload-photo - загрузить фото (base64 в JSON body), вернуть URL оригинала и копий full/card/avatar
+    Ключ объекта — хэш содержимого, повторная загрузка того же фото не пишет в S3 (deduplicated: true)
+    POST /upload-photo {user_id, images: [...]} - загрузить несколько фото параллельно одним запросом
+    POST /upload-photo {action: presign, user_id, content_type} - presigned PUT URL для загрузки напрямую в S3
+    POST /upload-photo {action: finalize, user_id, key} - проверить загрузку, сделать копии и вернуть URL
+    '''
+    return app(event, context)
@@ -0,0 +1,25 @@
+-- Матрица совместимости чисел жизненного пути (1–9 и мастер-числа 11, 22, 33)
+CREATE TABLE compatibility_scores (
+    life_path_a INTEGER NOT NULL,
+    life_path_b INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    PRIMARY KEY (life_path_a, life_path_b)
+);
+
+-- Та же шкала, что и calculateCompatibility на клиенте
+INSERT INTO compatibility_scores (life_path_a, life_path_b, score)
+SELECT
+    a.value,
+    b.value,
+    CASE
+        WHEN ABS(a.value - b.value) = 0 THEN 100
+        WHEN ABS(a.value - b.value) <= 2 THEN 85
+        WHEN ABS(a.value - b.value) <= 4 THEN 70
+        WHEN ABS(a.value - b.value) <= 6 THEN 55
+        ELSE 40
+    END
+FROM unnest(ARRAY[1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 22, 33]) AS a(value)
+CROSS JOIN unnest(ARRAY[1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 22, 33]) AS b(value);
+
+-- Индекс для выборки только совместимых корзин жизненного пути
+CREATE INDEX idx_profiles_visible_life_path ON profiles(is_visible, life_path);
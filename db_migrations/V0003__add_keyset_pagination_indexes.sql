@@ -0,0 +1,8 @@
+-- Составные индексы под keyset-пагинацию по (created_at, id)
+CREATE INDEX idx_profiles_visible_created ON profiles(created_at DESC, id DESC) WHERE is_visible = true;
+CREATE INDEX idx_messages_chat_created ON messages(chat_id, created_at, id);
+CREATE INDEX idx_likes_from_user_created ON likes(from_user_id, created_at, id);
+
+-- Покрываются новыми индексами по префиксу
+DROP INDEX idx_messages_chat;
+DROP INDEX idx_likes_from_user;
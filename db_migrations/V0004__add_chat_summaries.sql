@@ -0,0 +1,36 @@
+-- Сводка по чату для каждого участника: последнее сообщение и непрочитанные
+CREATE TABLE chat_summaries (
+    chat_id INTEGER REFERENCES chats(id),
+    user_id INTEGER REFERENCES users(id),
+    partner_id INTEGER REFERENCES users(id),
+    last_message_id INTEGER,
+    last_message_at TIMESTAMP,
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chat_id, user_id)
+);
+
+-- Список чатов пользователя одним диапазоном по индексу
+CREATE INDEX idx_chat_summaries_inbox ON chat_summaries(user_id, last_message_at DESC NULLS LAST);
+
+-- Заполнение из существующих сообщений
+INSERT INTO chat_summaries (chat_id, user_id, partner_id, last_message_id, last_message_at, unread_count)
+SELECT DISTINCT
+    c.id,
+    v.user_id,
+    v.partner_id,
+    lm.id,
+    lm.created_at,
+    (
+        SELECT COUNT(*)
+        FROM messages m
+        WHERE m.chat_id = c.id AND m.sender_id <> v.user_id AND m.is_read = false
+    )
+FROM chats c
+CROSS JOIN LATERAL (VALUES (c.user1_id, c.user2_id), (c.user2_id, c.user1_id)) AS v(user_id, partner_id)
+LEFT JOIN LATERAL (
+    SELECT id, created_at
+    FROM messages
+    WHERE chat_id = c.id
+    ORDER BY created_at DESC, id DESC
+    LIMIT 1
+) lm ON true;
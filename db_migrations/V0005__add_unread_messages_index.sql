@@ -0,0 +1,2 @@
+-- Частичный индекс только по непрочитанным сообщениям для отметки о прочтении
+CREATE INDEX idx_messages_unread ON messages(chat_id, id) WHERE is_read = false;
@@ -0,0 +1,2 @@
+-- Инкрементальная синхронизация чата: сообщения новее since_id
+CREATE INDEX idx_messages_chat_id ON messages(chat_id, id);
@@ -0,0 +1,21 @@
+-- Взаимные симпатии: по строке на каждого участника
+CREATE TABLE matches (
+    user_id INTEGER REFERENCES users(id),
+    matched_user_id INTEGER REFERENCES users(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, matched_user_id)
+);
+
+CREATE INDEX idx_matches_user_created ON matches(user_id, created_at DESC, matched_user_id DESC);
+
+-- Заполнение из уже существующих взаимных лайков
+INSERT INTO matches (user_id, matched_user_id, created_at)
+SELECT a.from_user_id, a.to_user_id, GREATEST(a.created_at, b.created_at)
+FROM likes a
+JOIN likes b ON b.from_user_id = a.to_user_id AND b.to_user_id = a.from_user_id
+WHERE a.from_user_id <> a.to_user_id;
+
+-- Непрочитанные уведомления пользователя одним диапазоном вместо двух одиночных индексов
+CREATE INDEX idx_notifications_user_unread ON notifications(user_id, is_read, created_at DESC, id DESC);
+DROP INDEX idx_notifications_user;
+DROP INDEX idx_notifications_read;
@@ -0,0 +1,7 @@
+-- Ячейка сетки 0.1° x 0.1° для поиска рядом: номер строки широты * 3600 + номер столбца долготы
+ALTER TABLE profiles ADD COLUMN geo_cell BIGINT GENERATED ALWAYS AS (
+    FLOOR((latitude + 90) * 10)::BIGINT * 3600 + LEAST(FLOOR((longitude + 180) * 10)::BIGINT, 3599)
+) STORED;
+
+-- Соседние по долготе ячейки одной строки идут подряд, поиск сводится к нескольким диапазонам B-tree
+CREATE INDEX idx_profiles_visible_geo_cell ON profiles(geo_cell) WHERE is_visible = true;
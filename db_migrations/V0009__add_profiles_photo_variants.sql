@@ -0,0 +1,2 @@
+-- Уменьшенные копии фото, по объекту {avatar, card, full} на каждый элемент photo_urls
+ALTER TABLE profiles ADD COLUMN photo_variants JSONB DEFAULT '[]'::JSONB;
@@ -0,0 +1,11 @@
+-- Учёт объектов фото в S3: ключ по хэшу содержимого, число профилей, ссылающихся на объект
+CREATE TABLE IF NOT EXISTS photo_refs (
+    s3_key TEXT PRIMARY KEY,
+    user_id INTEGER,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Кандидаты на удаление сборщиком мусора: объекты без ссылок
+CREATE INDEX IF NOT EXISTS idx_photo_refs_orphaned ON photo_refs(updated_at) WHERE ref_count <= 0;
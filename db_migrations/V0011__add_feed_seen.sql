@@ -0,0 +1,25 @@
+-- Уже показанные в ленте профили: фильтр Блума на пользователя, 8192 бита и 4 хэша
+-- Проверка стоит константу на кандидата, сколько бы профилей пользователь ни пролистал
+CREATE TABLE feed_seen (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    bloom BIT(8192) NOT NULL,
+    items INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Маска с битами для набора профилей, объединяется с фильтром через |
+CREATE FUNCTION feed_seen_mask(ids INTEGER[]) RETURNS BIT(8192) LANGUAGE SQL IMMUTABLE AS $$
+    SELECT COALESCE(
+        bit_or(B'1'::BIT(8192) >> ((hashint8extended(id, seed) & 9223372036854775807) % 8192)::INTEGER),
+        REPEAT('0', 8192)::BIT(8192)
+    )
+    FROM unnest(ids) AS id, generate_series(0, 3) AS seed
+$$;
+
+-- Одно выражение без подзапросов, чтобы планировщик встраивал функцию в запрос ленты
+CREATE FUNCTION feed_seen_contains(bloom BIT(8192), id INTEGER) RETURNS BOOLEAN LANGUAGE SQL IMMUTABLE AS $$
+    SELECT get_bit(bloom, ((hashint8extended(id, 0) & 9223372036854775807) % 8192)::INTEGER) = 1
+        AND get_bit(bloom, ((hashint8extended(id, 1) & 9223372036854775807) % 8192)::INTEGER) = 1
+        AND get_bit(bloom, ((hashint8extended(id, 2) & 9223372036854775807) % 8192)::INTEGER) = 1
+        AND get_bit(bloom, ((hashint8extended(id, 3) & 9223372036854775807) % 8192)::INTEGER) = 1
+$$;
@@ -0,0 +1,17 @@
+-- Документ для полнотекстового поиска: интересы с весом A, описание с весом B, в русской и английской конфигурации
+-- array_to_string помечена STABLE только из-за вывода произвольных типов, для TEXT[] результат неизменен
+CREATE FUNCTION profiles_search_document(bio TEXT, interests TEXT[]) RETURNS TSVECTOR LANGUAGE SQL IMMUTABLE PARALLEL SAFE AS $$
+    SELECT setweight(to_tsvector('russian', COALESCE(array_to_string(interests, ' '), '')), 'A')
+        || setweight(to_tsvector('english', COALESCE(array_to_string(interests, ' '), '')), 'A')
+        || setweight(to_tsvector('russian', COALESCE(bio, '')), 'B')
+        || setweight(to_tsvector('english', COALESCE(bio, '')), 'B')
+$$;
+
+-- Поддерживается самой базой при каждом INSERT/UPDATE bio или interests
+ALTER TABLE profiles ADD COLUMN search_vector TSVECTOR GENERATED ALWAYS AS (
+    profiles_search_document(bio, interests)
+) STORED;
+
+-- Поиск идёт только по видимым профилям, как и остальные выборки карточек
+CREATE INDEX idx_profiles_visible_search ON profiles USING GIN (search_vector) WHERE is_visible = true;
+CREATE INDEX idx_profiles_visible_interests ON profiles USING GIN (interests) WHERE is_visible = true;
@@ -0,0 +1,16 @@
+-- Готовые списки кандидатов для ленты: top-K профилей на пользователя в порядке ленты, одна строка на пользователя
+-- Пересчитывает scripts/refresh_candidates.py; лайки и показы после пересчёта отсеиваются при чтении
+CREATE TABLE candidates (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    candidate_ids INTEGER[] NOT NULL,
+    scores SMALLINT[] NOT NULL,
+    destiny_scores SMALLINT[] NOT NULL,
+    -- Оценки последнего кандидата полного списка: изменённый профиль не ниже них может попасть в список
+    -- NULL — список неполный, в него попадёт любой новый профиль
+    cutoff_score SMALLINT,
+    cutoff_destiny_score SMALLINT,
+    computed_at TIMESTAMP NOT NULL
+);
+
+-- Изменённые с прошлого пересчёта профили ищутся по updated_at
+CREATE INDEX idx_profiles_updated_at ON profiles(updated_at);
@@ -0,0 +1,69 @@
+-- Месячные секции для messages: vacuum, индексы и кэш работают с активными месяцами, а не со всей историей
+-- Секции создаются заранее (scripts/archive_messages.py ежедневно держит запас на months_ahead месяцев вперёд),
+-- секции по умолчанию нет, чтобы выборки по created_at шли по секциям по порядку и останавливались на LIMIT
+CREATE FUNCTION messages_ensure_partitions(from_month DATE, months_ahead INTEGER) RETURNS INTEGER LANGUAGE plpgsql AS $$
+DECLARE
+    month DATE := date_trunc('month', from_month)::DATE;
+    last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month <= last_month LOOP
+        partition_name := 'messages_' || to_char(month, '"y"YYYY"m"MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month, (month + INTERVAL '1 month')::DATE
+            );
+            created := created + 1;
+        END IF;
+        month := (month + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN created;
+END
+$$;
+
+ALTER TABLE messages RENAME TO messages_unpartitioned;
+ALTER TABLE messages_unpartitioned RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey;
+
+-- Ключ секционирования обязан входить в первичный ключ; id по-прежнему из messages_id_seq
+CREATE TABLE messages (
+    id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+    chat_id INTEGER REFERENCES chats(id),
+    sender_id INTEGER REFERENCES users(id),
+    content TEXT NOT NULL,
+    is_read BOOLEAN DEFAULT false,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+SELECT messages_ensure_partitions(
+    (SELECT COALESCE(MIN(created_at), CURRENT_TIMESTAMP) FROM messages_unpartitioned)::DATE, 3
+);
+
+INSERT INTO messages (id, chat_id, sender_id, content, is_read, created_at)
+SELECT id, chat_id, sender_id, content, is_read, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM messages_unpartitioned;
+
+ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+DROP TABLE messages_unpartitioned;
+
+-- Те же индексы, что были у messages (V0003, V0005, V0006), создаются в каждой секции;
+-- отдельный индекс по created_at больше не нужен — его заменяют границы секций
+CREATE INDEX idx_messages_chat_created ON messages(chat_id, created_at, id);
+CREATE INDEX idx_messages_chat_id ON messages(chat_id, id);
+CREATE INDEX idx_messages_unread ON messages(chat_id, id) WHERE is_read = false;
+
+-- Выгруженные в S3 секции: один gzip-файл на месяц, в нём подряд отдельные gzip-члены на каждый чат,
+-- поэтому историю одного чата можно прочитать Range-запросом, не скачивая месяц целиком
+CREATE TABLE message_archive_chunks (
+    chat_id INTEGER NOT NULL,
+    period DATE NOT NULL,
+    s3_key TEXT NOT NULL,
+    byte_offset BIGINT NOT NULL,
+    byte_length INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    first_created_at TIMESTAMP NOT NULL,
+    last_created_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (chat_id, period)
+);
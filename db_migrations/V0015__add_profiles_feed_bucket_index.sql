@@ -0,0 +1,8 @@
+-- Корзина ленты — пара (число жизненного пути, число судьбы), внутри корзины профили идут от новых к старым
+-- Ленту на лету собирают из первых строк каждой совместимой корзины, без сортировки корзин целиком
+-- Число судьбы без пары в compatibility_scores (NULL, 0 у пустого имени) — одна корзина 0, как в refresh_candidates
+CREATE INDEX idx_profiles_feed_bucket ON profiles(life_path, (COALESCE(destiny, 0)), created_at DESC)
+    WHERE is_visible = true;
+
+-- Выборку видимых профилей по числу жизненного пути покрывает новый индекс
+DROP INDEX idx_profiles_visible_life_path;
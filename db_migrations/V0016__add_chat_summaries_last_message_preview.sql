@@ -0,0 +1,11 @@
+-- Превью последнего сообщения хранится в сводке: архивация месяца (scripts/archive_messages.py) удаляет его
+-- секцию messages, а список чатов должен показывать последнее сообщение и после этого
+ALTER TABLE chat_summaries
+    ADD COLUMN last_message_content TEXT,
+    ADD COLUMN last_message_sender_id INTEGER REFERENCES users(id);
+
+-- Заполнение из ещё не выгруженных сообщений; условие по created_at отсекает лишние секции
+UPDATE chat_summaries s
+SET last_message_content = m.content, last_message_sender_id = m.sender_id
+FROM messages m
+WHERE m.id = s.last_message_id AND m.created_at = s.last_message_at AND m.chat_id = s.chat_id;
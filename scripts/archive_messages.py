@@ -0,0 +1,133 @@
+'''
+Обслуживание месячных секций messages: создать секции наперёд и выгрузить старые месяцы в S3
+Месяц выгружается одним gzip-файлом archive/messages/YYYY-MM.jsonl.gz, где у каждого чата свой gzip-член;
+смещения членов пишутся в message_archive_chunks, после чего секция отсоединяется и удаляется
+Запуск (ежедневно): DATABASE_URL=... AWS_ACCESS_KEY_ID=... AWS_SECRET_ACCESS_KEY=... python scripts/archive_messages.py
+    [--months-ahead 3] [--keep-months 12] [--dry-run]
+'''
+import argparse
+import gzip
+import json
+import os
+import re
+import tempfile
+from datetime import date
+from typing import List, Tuple
+
+import boto3
+import psycopg2
+from psycopg2.extras import execute_values
+
+BUCKET = 'files'
+ARCHIVE_PREFIX = 'archive/messages'
+PARTITION_NAME = re.compile(r'^messages_y(\d{4})m(\d{2})$')
+
+
+def partitions(cur) -> List[Tuple[str, date]]:
+    '''Секции messages и первый день их месяца, старые первыми'''
+    cur.execute('''
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+    ''')
+    found = []
+    for (name,) in cur.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            found.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(found, key=lambda item: item[1])
+
+
+def export_partition(conn, name: str, path: str) -> List[Tuple]:
+    '''Записать секцию в файл по чатам, вернуть строки для message_archive_chunks без ключа и месяца'''
+    chunks = []
+
+    def flush(out, chat_id: int, rows: List[dict]) -> None:
+        member = gzip.compress(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode())
+        chunks.append((chat_id, out.tell(), len(member), len(rows), rows[0]['created_at'], rows[-1]['created_at']))
+        out.write(member)
+
+    with conn.cursor(name=f'export_{name}') as source, open(path, 'wb') as out:
+        source.itersize = 10000
+        source.execute(f'''
+            SELECT id, chat_id, sender_id, content, is_read, created_at
+            FROM {name}
+            ORDER BY chat_id, created_at, id
+        ''')
+        chat_id, rows = None, []
+        for row_id, row_chat_id, sender_id, content, is_read, created_at in source:
+            if row_chat_id != chat_id and rows:
+                flush(out, chat_id, rows)
+                rows = []
+            chat_id = row_chat_id
+            rows.append({
+                'id': row_id, 'chat_id': row_chat_id, 'sender_id': sender_id, 'content': content,
+                'is_read': is_read, 'created_at': created_at.isoformat()
+            })
+        if rows:
+            flush(out, chat_id, rows)
+    conn.commit()
+    return chunks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--months-ahead', type=int, default=3, help='сколько будущих месяцев держать готовыми')
+    parser.add_argument('--keep-months', type=int, default=12, help='сколько последних месяцев оставить в базе')
+    parser.add_argument('--dry-run', action='store_true', help='только показать, какие секции будут выгружены')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT messages_ensure_partitions(CURRENT_DATE, %s)', (args.months_ahead,))
+            print(f'created {cur.fetchone()[0]} future partitions')
+            cur.execute('''
+                SELECT (date_trunc('month', CURRENT_DATE) - make_interval(months => %s))::DATE
+            ''', (args.keep_months,))
+            cutoff = cur.fetchone()[0]
+            old = [(name, month) for name, month in partitions(cur) if month < cutoff]
+        conn.commit()
+
+        if args.dry_run:
+            for name, month in old:
+                print(f'would archive {name} ({month:%Y-%m})')
+            return
+
+        s3 = boto3.client(
+            's3',
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev'),
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+        )
+        for name, month in old:
+            key = f'{ARCHIVE_PREFIX}/{month:%Y-%m}.jsonl.gz'
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'archive.jsonl.gz')
+                chunks = export_partition(conn, name, path)
+                size = os.path.getsize(path)
+                if chunks:
+                    s3.upload_file(path, BUCKET, key, ExtraArgs={'ContentType': 'application/gzip'})
+                    # Секция удаляется только после того, как архив целиком лежит в S3
+                    if s3.head_object(Bucket=BUCKET, Key=key)['ContentLength'] != size:
+                        raise RuntimeError(f'{key}: uploaded size differs from {size} bytes')
+
+            with conn.cursor() as cur:
+                cur.execute('DELETE FROM message_archive_chunks WHERE period = %s', (month,))
+                execute_values(cur, '''
+                    INSERT INTO message_archive_chunks (
+                        chat_id, period, s3_key, byte_offset, byte_length, message_count, first_created_at, last_created_at
+                    )
+                    VALUES %s
+                ''', [(chat_id, month, key, *rest) for chat_id, *rest in chunks], page_size=1000)
+                cur.execute(f'ALTER TABLE messages DETACH PARTITION {name}')
+                cur.execute(f'DROP TABLE {name}')
+            conn.commit()
+            print(f'archived {name}: {sum(chunk[3] for chunk in chunks)} messages in {len(chunks)} chats, '
+                  f'{size / 1024 / 1024:.1f} MiB -> s3://{BUCKET}/{key}', flush=True)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''
+Пересчёт profiles.life_path и profiles.destiny по текущему алгоритму numerology.py
+Читает профили страницами по id, каждая в своей короткой транзакции, считает пачками на NumPy и пишет только изменившиеся строки
+Строка обновляется, только если имя и дата рождения не изменились с момента чтения: правки пользователей во время
+прогона не перетираются значениями, посчитанными по старым данным
+Запуск: DATABASE_URL=... python scripts/backfill_numerology.py [--chunk-size 5000] [--checkpoint backfill.json] [--dry-run]
+'''
+import argparse
+import json
+import os
+import time
+from typing import Optional
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from loader import load_module
+
+UPDATE_SQL = '''
+    UPDATE profiles p
+    SET life_path = v.life_path, destiny = v.destiny, updated_at = CURRENT_TIMESTAMP
+    FROM (VALUES %s) AS v(id, birth_date, name, life_path, destiny), users u
+    WHERE p.id = v.id AND u.id = p.user_id
+      AND p.birth_date = v.birth_date AND u.name IS NOT DISTINCT FROM v.name
+      AND (p.life_path, p.destiny) IS DISTINCT FROM (v.life_path, v.destiny)
+'''
+UPDATE_TEMPLATE = '(%s, %s::DATE, %s::TEXT, %s, %s)'
+
+SELECT_SQL = '''
+    SELECT p.id, p.birth_date, u.name, p.life_path, p.destiny
+    FROM profiles p
+    JOIN users u ON u.id = p.user_id
+    WHERE p.id > %s AND p.birth_date IS NOT NULL
+    ORDER BY p.id
+    LIMIT %s
+'''
+
+
+def read_checkpoint(path: Optional[str]) -> int:
+    '''Последний обработанный id из файла контрольной точки, 0 если её нет'''
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return int(json.load(f)['last_id'])
+
+
+def write_checkpoint(path: Optional[str], last_id: int) -> None:
+    '''Атомарно записать контрольную точку после коммита пачки'''
+    if not path:
+        return
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'last_id': last_id}, f)
+    os.replace(path + '.tmp', path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--checkpoint', help='файл с последним обработанным id, повторный запуск продолжит с него')
+    parser.add_argument('--start-id', type=int, help='начать после этого id, игнорируя контрольную точку')
+    parser.add_argument('--lock-timeout-ms', type=int, default=2000)
+    parser.add_argument('--dry-run', action='store_true', help='посчитать расхождения без записи')
+    args = parser.parse_args()
+
+    numerology = load_module('profiles', 'numerology')
+    last_id = args.start_id if args.start_id is not None else read_checkpoint(args.checkpoint)
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    with conn.cursor() as cur:
+        cur.execute('SET lock_timeout = %s', (args.lock_timeout_ms,))
+    conn.commit()
+
+    scanned = changed = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            # Своя транзакция на страницу: снимок живёт доли секунды и не держит горизонт vacuum весь прогон
+            with conn.cursor() as cur:
+                cur.execute(SELECT_SQL, (last_id, args.chunk_size))
+                rows = cur.fetchall()
+            if not rows:
+                conn.rollback()
+                break
+            ids, birth_dates, names, old_life_paths, old_destinies = zip(*rows)
+            life_paths = numerology.life_path_batch(birth_dates).tolist()
+            destinies = numerology.destiny_batch(names).tolist()
+            updates = [
+                (row_id, birth_date, name, life_path, destiny)
+                for row_id, birth_date, name, life_path, destiny, old_life_path, old_destiny
+                in zip(ids, birth_dates, names, life_paths, destinies, old_life_paths, old_destinies)
+                if (life_path, destiny) != (old_life_path, old_destiny)
+            ]
+
+            if args.dry_run or not updates:
+                conn.rollback()
+            else:
+                with conn.cursor() as cur:
+                    execute_values(cur, UPDATE_SQL, updates, template=UPDATE_TEMPLATE, page_size=len(updates))
+                conn.commit()
+            if not args.dry_run:
+                write_checkpoint(args.checkpoint, ids[-1])
+
+            last_id = ids[-1]
+            scanned += len(rows)
+            changed += len(updates)
+            elapsed = time.perf_counter() - started
+            print(f'id<={last_id} scanned={scanned} changed={changed} rows/s={scanned / elapsed:,.0f}', flush=True)
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"{'would update' if args.dry_run else 'updated'} {changed} of {scanned} profiles "
+          f'in {elapsed:.1f}s ({scanned / elapsed if elapsed else 0:,.0f} rows/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''
+Бенчмарк подключения к базе: новое подключение на запрос против тёплого переиспользуемого
+Запуск: DATABASE_URL=... [DATABASE_POOLER_URL=...] python scripts/bench_db_connect.py --iterations 200
+'''
+import argparse
+import os
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import psycopg2
+
+
+def percentile(samples: List[float], q: float) -> float:
+    '''Перцентиль q (0..100) по отсортированной выборке'''
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(run: Callable[[], None], iterations: int) -> Dict[str, float]:
+    '''Прогнать run() iterations раз и вернуть задержки в миллисекундах'''
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+        'mean_ms': round(statistics.mean(samples), 3)
+    }
+
+
+def connect_per_request(dsn: str) -> Callable[[], None]:
+    '''Поведение до пула: connect, запрос, close на каждый вызов'''
+    def run() -> None:
+        conn = psycopg2.connect(dsn)
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+            cur.fetchone()
+        conn.close()
+    return run
+
+
+def reused_connection(dsn: str) -> Callable[[], None]:
+    '''Тёплое подключение, которое get_db() держит между вызовами'''
+    conn = psycopg2.connect(dsn)
+
+    def run() -> None:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+            cur.fetchone()
+        conn.rollback()
+    return run
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    targets = {'direct': os.environ['DATABASE_URL']}
+    if os.environ.get('DATABASE_POOLER_URL'):
+        targets['pooler'] = os.environ['DATABASE_POOLER_URL']
+
+    for name, dsn in targets.items():
+        for mode, factory in (('connect_per_request', connect_per_request), ('reused', reused_connection)):
+            stats = measure(factory(dsn), args.iterations)
+            print(f"{name:<8} {mode:<20} " + '  '.join(f'{k}={v}' for k, v in stats.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+'''
+Нагрузочный бенчмарк функций по фикстурам backend/*/tests.json
+Каждый запрос из tests.json вызывается напрямую через handler(event, context) на одноразовом Postgres с засеянными
+данными (по умолчанию 100k пользователей, 2M лайков, 2M сообщений) и локальном S3 (moto server)
+Для каждого запроса: p50/p95/p99, запросов к базе и строк в ответах базы на вызов, строк, прочитанных планом (EXPLAIN ANALYZE)
+Запуск: python scripts/bench_handlers.py [--users 100000 --likes 2000000 --messages 2000000]
+        [--iterations 200] [--only chat] [--output bench.json] [--baseline bench-prev.json]
+Нужны moto[server] и TEST_DATABASE_URL или initdb/pg_ctl (см. harness.py); BENCH_DATABASE_URL — уже засеянная база
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+import boto3
+import psycopg2
+import psycopg2.extensions
+from moto.server import ThreadedMotoServer
+
+from harness import BACKEND_DIR, REPO_ROOT, load_function, throwaway_postgres
+
+S3_PORT = 5066
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+SEED_SQL = [
+    ('users', '''
+        INSERT INTO users (email, name, provider, created_at, last_active)
+        SELECT
+            'user' || i || '@bench.local',
+            (ARRAY['Алиса', 'Борис', 'Вера', 'Глеб', 'Дарья', 'Егор', 'Жанна', 'Иван', 'Ксения', 'Лев'])[1 + i %% 10]
+                || ' ' || (ARRAY['Иванова', 'Петров', 'Смирнова', 'Кузнецов', 'Попова', 'Соколов', 'Lee', 'Smith'])[1 + (i / 10) %% 8],
+            (ARRAY['google', 'vk', 'yandex', 'telegram'])[1 + i %% 4],
+            now() - random() * interval '365 days',
+            now() - random() * interval '30 days'
+        FROM generate_series(1, %(users)s) i
+    '''),
+    ('profiles', '''
+        INSERT INTO profiles (user_id, birth_date, gender, city, bio, interests, life_path, destiny,
+                              latitude, longitude, photo_urls, is_visible, created_at, updated_at)
+        SELECT
+            u.id,
+            date '1965-01-01' + (random() * 14000)::INTEGER,
+            CASE WHEN u.id %% 2 = 0 THEN 'female' ELSE 'male' END,
+            c.name,
+            'Анкета для нагрузочного теста №' || u.id,
+            ARRAY[
+                (ARRAY['музыка', 'кино', 'путешествия', 'спорт', 'книги', 'йога', 'кулинария', 'фотография', 'театр', 'hiking'])[1 + (random() * 9)::INTEGER],
+                (ARRAY['астрология', 'нумерология', 'танцы', 'игры', 'живопись', 'бег', 'coffee', 'языки', 'музеи', 'horses'])[1 + (random() * 9)::INTEGER]
+            ],
+            (ARRAY[1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 22, 33])[1 + (random() * 11)::INTEGER],
+            (ARRAY[1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 22, 33])[1 + (random() * 11)::INTEGER],
+            c.latitude + (random() - 0.5) * 0.6,
+            c.longitude + (random() - 0.5) * 0.9,
+            ARRAY['https://cdn.poehali.dev/bench/profiles/' || u.id || '.jpg'],
+            u.id %% 20 <> 0,
+            u.created_at,
+            u.created_at
+        FROM users u
+        JOIN (VALUES
+            (0, 'Москва', 55.7558, 37.6173), (1, 'Санкт-Петербург', 59.9343, 30.3351),
+            (2, 'Казань', 55.7961, 49.1064), (3, 'Новосибирск', 55.0084, 82.9357)
+        ) AS c(slot, name, latitude, longitude) ON c.slot = u.id %% 4
+    '''),
+    ('likes', '''
+        INSERT INTO likes (from_user_id, to_user_id, is_favorite, created_at)
+        SELECT from_user_id, to_user_id, random() < 0.1, now() - random() * interval '180 days'
+        FROM (
+            SELECT 1 + (random() * (%(users)s - 1))::INTEGER AS from_user_id,
+                   1 + (random() * (%(users)s - 1))::INTEGER AS to_user_id
+            FROM generate_series(1, %(likes)s * 9 / 10)
+        ) s
+        WHERE from_user_id <> to_user_id
+        ON CONFLICT (from_user_id, to_user_id) DO NOTHING
+    '''),
+    ('mutual likes', '''
+        INSERT INTO likes (from_user_id, to_user_id, created_at)
+        SELECT to_user_id, from_user_id, created_at + interval '1 hour'
+        FROM likes
+        WHERE id %% 9 = 0
+        ON CONFLICT (from_user_id, to_user_id) DO NOTHING
+    '''),
+    ('matches', '''
+        INSERT INTO matches (user_id, matched_user_id, created_at)
+        SELECT a.from_user_id, a.to_user_id, GREATEST(a.created_at, b.created_at)
+        FROM likes a
+        JOIN likes b ON b.from_user_id = a.to_user_id AND b.to_user_id = a.from_user_id
+    '''),
+    ('notifications', '''
+        INSERT INTO notifications (user_id, type, from_user_id, message, is_read, created_at)
+        SELECT to_user_id, 'like', from_user_id, 'Вам поставили лайк', id %% 3 <> 0, created_at
+        FROM likes
+        WHERE id %% 4 = 0
+        UNION ALL
+        SELECT user_id, 'match', matched_user_id, 'У вас взаимная симпатия', false, created_at
+        FROM matches
+    '''),
+    ('chats', '''
+        INSERT INTO chats (user1_id, user2_id, created_at)
+        SELECT LEAST(a, b), GREATEST(a, b), now() - random() * interval '365 days'
+        FROM (
+            SELECT 1 + (i - 1) %% %(users)s AS a, 1 + (random() * (%(users)s - 1))::INTEGER AS b
+            FROM generate_series(1, %(messages)s / %(messages_per_chat)s) i
+        ) s
+        WHERE a <> b
+        ON CONFLICT (user1_id, user2_id) DO NOTHING
+    '''),
+    ('message partitions', '''
+        SELECT messages_ensure_partitions((now() - interval '400 days')::DATE, 3)
+    '''),
+    ('messages', '''
+        INSERT INTO messages (chat_id, sender_id, content, is_read, created_at)
+        SELECT
+            c.id,
+            CASE WHEN k %% 2 = 0 THEN c.user1_id ELSE c.user2_id END,
+            'Сообщение ' || k || ' в чате ' || c.id,
+            k < %(messages_per_chat)s - 3,
+            c.created_at + k * interval '7 minutes'
+        FROM chats c
+        CROSS JOIN generate_series(0, %(messages_per_chat)s - 1) k
+        ORDER BY c.id, k
+    '''),
+    ('chat summaries', '''
+        INSERT INTO chat_summaries (
+            chat_id, user_id, partner_id, last_message_id, last_message_at,
+            last_message_content, last_message_sender_id, unread_count
+        )
+        SELECT c.id, v.user_id, v.partner_id, lm.id, lm.created_at, lm.content, lm.sender_id, (
+            SELECT COUNT(*) FROM messages m
+            WHERE m.chat_id = c.id AND m.sender_id <> v.user_id AND m.is_read = false
+        )
+        FROM chats c
+        CROSS JOIN LATERAL (VALUES (c.user1_id, c.user2_id), (c.user2_id, c.user1_id)) AS v(user_id, partner_id)
+        LEFT JOIN LATERAL (
+            SELECT id, created_at, content, sender_id FROM messages
+            WHERE chat_id = c.id ORDER BY created_at DESC, id DESC LIMIT 1
+        ) lm ON true
+    ''')
+]
+
+
+class Recorder:
+    '''Счётчики запросов текущего вызова; при capture ещё и тексты запросов для EXPLAIN'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, capture: bool = False) -> None:
+        self.queries = 0
+        self.rows = 0
+        self.capture = capture
+        self.statements: List[str] = []
+
+    def record(self, cursor, query: Any, params: Any) -> None:
+        with self.lock:
+            self.queries += 1
+            self.rows += max(cursor.rowcount, 0)
+            if self.capture:
+                statement = cursor.mogrify(query, params) if params is not None else query
+                self.statements.append(statement.decode() if isinstance(statement, bytes) else str(statement))
+
+
+RECORDER = Recorder()
+_counted_cursors: Dict[type, type] = {}
+
+
+def counted_cursor(base: type) -> type:
+    '''Подкласс курсора (в том числе RealDictCursor), который отмечает каждый execute в RECORDER'''
+    if base not in _counted_cursors:
+        def execute(self, query, vars=None):
+            result = base.execute(self, query, vars)
+            RECORDER.record(self, query, vars)
+            return result
+        _counted_cursors[base] = type(f'Counted{base.__name__}', (base,), {'execute': execute})
+    return _counted_cursors[base]
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        kwargs['cursor_factory'] = counted_cursor(
+            kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        )
+        return super().cursor(*args, **kwargs)
+
+
+@contextmanager
+def counting_connections() -> Iterator[None]:
+    '''Все psycopg2.connect() внутри блока (то есть get_db() функций) отдают считающие подключения'''
+    connect = psycopg2.connect
+
+    def counting_connect(*args, **kwargs):
+        kwargs.setdefault('connection_factory', CountingConnection)
+        return connect(*args, **kwargs)
+
+    psycopg2.connect = counting_connect
+    try:
+        yield
+    finally:
+        psycopg2.connect = connect
+
+
+def percentile(samples: List[float], q: float) -> float:
+    '''Перцентиль q (0..100) по отсортированной выборке'''
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def rows_scanned(plan: Dict[str, Any]) -> int:
+    '''Строки, прочитанные из таблиц и индексов узлами плана, включая отброшенные фильтром'''
+    loops = plan.get('Actual Loops', 1)
+    scanned = 0
+    if 'Relation Name' in plan:
+        scanned = (plan.get('Actual Rows', 0) + plan.get('Rows Removed by Filter', 0)
+                   + plan.get('Rows Removed by Index Recheck', 0)) * loops
+    return scanned + sum(rows_scanned(child) for child in plan.get('Plans', []))
+
+
+def explain_rows_scanned(dsn: str, statements: List[str]) -> int:
+    '''EXPLAIN ANALYZE каждого запроса вызова в отдельной транзакции с откатом'''
+    total = 0
+    conn = psycopg2.connect(dsn)
+    try:
+        for statement in statements:
+            if not statement.lstrip().upper().startswith(EXPLAINABLE):
+                continue
+            with conn.cursor() as cur:
+                try:
+                    cur.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + statement)
+                    total += rows_scanned(cur.fetchone()[0][0]['Plan'])
+                except psycopg2.Error:
+                    pass
+            conn.rollback()
+    finally:
+        conn.close()
+    return total
+
+
+def load_fixtures(only: Optional[List[str]]) -> List[Dict[str, Any]]:
+    '''Запросы из backend/*/tests.json в виде событий платформы'''
+    fixtures = []
+    for name in sorted(os.listdir(BACKEND_DIR)):
+        path = os.path.join(BACKEND_DIR, name, 'tests.json')
+        if (only and name not in only) or not os.path.exists(path):
+            continue
+        with open(path, encoding='utf-8') as f:
+            tests = json.load(f).get('tests', [])
+        for test in tests:
+            url = urlsplit(test.get('path', '/'))
+            body = test.get('body')
+            fixtures.append({
+                'function': name,
+                'name': test['name'],
+                'expected_status': test.get('expectedStatus'),
+                'event': {
+                    'httpMethod': test.get('method', 'GET'),
+                    'queryStringParameters': dict(parse_qsl(url.query)),
+                    'headers': test.get('headers') or {},
+                    'body': json.dumps(body) if body is not None else '{}',
+                    'isBase64Encoded': False
+                }
+            })
+    return fixtures
+
+
+def seed(dsn: str, sizes: Dict[str, int]) -> None:
+    '''Засеять базу синтетическими данными; повторный запуск на непустой базе ничего не делает'''
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT EXISTS (SELECT 1 FROM users)')
+            if cur.fetchone()[0]:
+                print('seed: users already present, skipping')
+                return
+            cur.execute('SELECT setseed(0.42)')
+            for table, sql in SEED_SQL:
+                started = time.perf_counter()
+                cur.execute(sql, sizes)
+                print(f'seed: {table:<15} {cur.rowcount:>10,} rows {time.perf_counter() - started:6.1f}s', flush=True)
+            cur.execute('VACUUM ANALYZE')
+    finally:
+        conn.close()
+
+
+def bench_fixture(module: Any, fixture: Dict[str, Any], dsn: str, iterations: int, warmup: int) -> Dict[str, Any]:
+    '''Прогнать один запрос: прогрев, замеры задержки и счётчиков, затем один вызов с EXPLAIN'''
+    for _ in range(warmup):
+        module.handler(fixture['event'], None)
+
+    samples: List[float] = []
+    statuses: Dict[str, int] = {}
+    queries = rows = 0
+    for _ in range(iterations):
+        RECORDER.reset()
+        started = time.perf_counter()
+        result = module.handler(fixture['event'], None)
+        samples.append((time.perf_counter() - started) * 1000)
+        queries += RECORDER.queries
+        rows += RECORDER.rows
+        statuses[str(result['statusCode'])] = statuses.get(str(result['statusCode']), 0) + 1
+
+    RECORDER.reset(capture=True)
+    module.handler(fixture['event'], None)
+    statements = RECORDER.statements
+    RECORDER.reset()
+
+    return {
+        'function': fixture['function'],
+        'name': fixture['name'],
+        'method': fixture['event']['httpMethod'],
+        'params': fixture['event']['queryStringParameters'],
+        'expected_status': fixture['expected_status'],
+        'statuses': statuses,
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+        'mean_ms': round(statistics.mean(samples), 3),
+        'queries_per_request': round(queries / iterations, 2),
+        'rows_returned_per_request': round(rows / iterations, 1),
+        'rows_scanned_per_request': explain_rows_scanned(dsn, statements)
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]]) -> None:
+    '''Таблица результатов; с baseline — изменение p95 относительно прошлого прогона'''
+    previous = {(r['function'], r['name']): r for r in (baseline or {}).get('endpoints', [])}
+    print(f"{'endpoint':<72} {'status':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'q/req':>6} {'rows':>8} {'scanned':>9}")
+    for r in results:
+        status = max(r['statuses'], key=r['statuses'].get)
+        mark = '' if r['expected_status'] is None or int(status) == r['expected_status'] else '!'
+        line = (f"{(r['function'] + ': ' + r['name'])[:72]:<72} {mark + status:>6} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+                f"{r['p99_ms']:>8.2f} {r['queries_per_request']:>6.1f} {r['rows_returned_per_request']:>8.1f} "
+                f"{r['rows_scanned_per_request']:>9,}")
+        before = previous.get((r['function'], r['name']))
+        if before and before['p95_ms']:
+            line += f"  p95 {(r['p95_ms'] / before['p95_ms'] - 1) * 100:+.0f}%"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--likes', type=int, default=2000000)
+    parser.add_argument('--messages', type=int, default=2000000)
+    parser.add_argument('--messages-per-chat', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--only', action='append', help='только эта функция (можно несколько раз)')
+    parser.add_argument('--cache', action='store_true', help='не отключать кэш ответов (по умолчанию меряется путь до базы)')
+    parser.add_argument('--output', default='bench-results.json')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения p95')
+    args = parser.parse_args()
+
+    if not args.cache:
+        os.environ['CACHE_LOCAL_TTL_SECONDS'] = '0'
+        os.environ.pop('CACHE_URL', None)
+    os.environ.update({
+        'S3_ENDPOINT_URL': f'http://127.0.0.1:{S3_PORT}',
+        'AWS_ACCESS_KEY_ID': 'test',
+        'AWS_SECRET_ACCESS_KEY': 'test',
+        'AWS_DEFAULT_REGION': 'us-east-1'
+    })
+    os.environ.setdefault('YANDEX_CLIENT_ID', 'bench')
+    sizes = {'users': args.users, 'likes': args.likes, 'messages': args.messages,
+             'messages_per_chat': args.messages_per_chat}
+
+    server = ThreadedMotoServer(port=S3_PORT, verbose=False)
+    server.start()
+    existing = os.environ.get('BENCH_DATABASE_URL')
+    try:
+        with (nullcontext(existing) if existing else throwaway_postgres()) as dsn:
+            os.environ['DATABASE_URL'] = dsn
+            seed(dsn, sizes)
+            boto3.client('s3', endpoint_url=os.environ['S3_ENDPOINT_URL']).create_bucket(Bucket='files')
+
+            results = []
+            modules: Dict[str, Any] = {}
+            with counting_connections():
+                for fixture in load_fixtures(args.only):
+                    if fixture['function'] not in modules:
+                        modules[fixture['function']] = load_function(fixture['function'])
+                    results.append(bench_fixture(modules[fixture['function']], fixture, dsn, args.iterations, args.warmup))
+                    print(f"{fixture['function']}: {fixture['name']}: p95 {results[-1]['p95_ms']:.2f} ms", flush=True)
+            for module in modules.values():
+                if hasattr(module, 'close_db'):
+                    module.close_db()
+
+            with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+                cur.execute('SHOW server_version')
+                server_version = cur.fetchone()[0]
+                cur.execute('SELECT (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM likes), (SELECT COUNT(*) FROM messages)')
+                users, likes, messages = cur.fetchone()
+            conn.close()
+    finally:
+        server.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    report = {
+        'revision': git_revision(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'postgres': server_version,
+        'dataset': {'users': users, 'likes': likes, 'messages': messages},
+        'iterations': args.iterations,
+        'cache': args.cache,
+        'endpoints': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'saved {args.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+'''
+Бенчмарк холодного старта функций: время импорта index.py (python -X importtime), ответы OPTIONS/405/400
+и первый настоящий запрос (первая фикстура из tests.json) в свежем интерпретаторе
+Каждый прогон — отдельный процесс на копии папки функции без __pycache__, как в только что поднятом контейнере
+Бюджеты и модули, которые не должны загружаться до первого настоящего запроса, лежат в scripts/startup_budgets.json;
+при превышении скрипт завершается с кодом 1
+Запуск: python scripts/bench_startup.py [--runs 5] [--only upload-photo] [--precompiled] [--output startup.json]
+Нужны moto[server] и TEST_DATABASE_URL или initdb/pg_ctl (см. harness.py)
+'''
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import boto3
+from moto.server import ThreadedMotoServer
+
+from bench_handlers import load_fixtures, seed
+from harness import BACKEND_DIR, throwaway_postgres
+
+S3_PORT = 5067
+# Фикстурам нужны существующие пользователи и чаты; объём данных на холодный старт не влияет
+SEED_SIZES = {'users': 1000, 'likes': 5000, 'messages': 5000, 'messages_per_chat': 20}
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_budgets.json')
+
+# Запросы, на которые функция должна ответить, не загружая тяжёлые зависимости
+LIGHT_PROBES = [
+    ('options', {'httpMethod': 'OPTIONS', 'queryStringParameters': {}, 'headers': {}, 'body': ''}),
+    ('method_not_allowed', {'httpMethod': 'PUT', 'queryStringParameters': {}, 'headers': {}, 'body': '{}'}),
+    ('bad_request', {'httpMethod': 'POST', 'queryStringParameters': {}, 'headers': {}, 'body': 'not json'})
+]
+
+# Выполняется в свежем интерпретаторе в папке функции; печатает замеры одной JSON-строкой
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+import index
+result = {'import_ms': (time.perf_counter() - started) * 1000}
+probes, first, lazy = json.loads(sys.argv[1])
+for name, event in probes:
+    started = time.perf_counter()
+    result[name] = {'status': index.handler(event, None)['statusCode'], 'ms': (time.perf_counter() - started) * 1000}
+result['loaded'] = [module for module in lazy if module in sys.modules]
+started = time.perf_counter()
+result['first_request'] = {'status': index.handler(first, None)['statusCode'], 'ms': (time.perf_counter() - started) * 1000}
+print(json.dumps(result))
+'''
+
+
+def heaviest_imports(importtime: str, count: int = 3) -> List[Tuple[str, float]]:
+    '''Самые дорогие прямые импорты index.py по выводу -X importtime (строки идут после вложенных)'''
+    lines = []
+    for line in importtime.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        lines.append((len(name) - len(name.lstrip()), name.strip(), int(cumulative) / 1000))
+    index = next((i for i, line in enumerate(lines) if line[1] == 'index'), None)
+    if index is None:
+        return []
+    children = []
+    for depth, name, ms in reversed(lines[:index]):
+        if depth <= lines[index][0]:
+            break
+        if depth == lines[index][0] + 2:
+            children.append((name, round(ms, 1)))
+    return sorted(children, key=lambda child: -child[1])[:count]
+
+
+def run_once(function_dir: str, first: Dict[str, Any], lazy: List[str], env: Dict[str, str]) -> Dict[str, Any]:
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD, json.dumps([LIGHT_PROBES, first, lazy])],
+        cwd=function_dir, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f'{os.path.basename(function_dir)}: {completed.stderr.strip()[-2000:]}')
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['heaviest_imports'] = heaviest_imports(completed.stderr)
+    return result
+
+
+def bench_function(name: str, first: Dict[str, Any], runs: int, precompiled: bool, lazy: List[str],
+                   env: Dict[str, str]) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        function_dir = os.path.join(tmp, name)
+        shutil.copytree(os.path.join(BACKEND_DIR, name), function_dir, ignore=shutil.ignore_patterns('__pycache__'))
+        if precompiled:
+            subprocess.run([sys.executable, '-m', 'compileall', '-q', function_dir], check=True,
+                           env={key: value for key, value in env.items() if key != 'PYTHONDONTWRITEBYTECODE'})
+        samples = [run_once(function_dir, first, lazy, env) for _ in range(runs)]
+
+    median = lambda values: round(statistics.median(values), 2)
+    return {
+        'function': name,
+        'first_request': first['name'],
+        'import_ms': median([sample['import_ms'] for sample in samples]),
+        'light_ms': median([max(sample[probe]['ms'] for probe, _ in LIGHT_PROBES) for sample in samples]),
+        'light_statuses': [samples[0][probe]['status'] for probe, _ in LIGHT_PROBES],
+        'first_request_ms': median([sample['first_request']['ms'] for sample in samples]),
+        'first_request_status': samples[0]['first_request']['status'],
+        'loaded_before_first_request': sorted({module for sample in samples for module in sample['loaded']}),
+        'heaviest_imports': samples[0]['heaviest_imports']
+    }
+
+
+def check_budget(result: Dict[str, Any], budget: Optional[Dict[str, float]]) -> List[str]:
+    '''Нарушения бюджета функции; функция без бюджета в startup_budgets.json — тоже нарушение'''
+    if budget is None:
+        return [f"{result['function']}: no budget in {os.path.basename(BUDGETS_PATH)}"]
+    problems = [
+        f"{result['function']}: {metric} {result[metric]} ms > budget {limit} ms"
+        for metric, limit in budget.items() if result[metric] > limit
+    ]
+    if result['loaded_before_first_request']:
+        problems.append(f"{result['function']}: {', '.join(result['loaded_before_first_request'])} "
+                        f"loaded before the first real request")
+    if result['light_statuses'] != [200, 405, 400]:
+        problems.append(f"{result['function']}: OPTIONS/PUT/bad JSON answered {result['light_statuses']}")
+    return problems
+
+
+def print_report(results: List[Dict[str, Any]], budgets: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'function':<14}{'import':>10}{'light':>8}{'first':>10}  {'budget (import/light/first)':<30}heaviest imports")
+    for result in results:
+        budget = budgets.get(result['function'], {})
+        limits = '/'.join(str(budget.get(metric, '-')) for metric in ('import_ms', 'light_ms', 'first_request_ms'))
+        heaviest = ', '.join(f'{name} {ms}' for name, ms in result['heaviest_imports'])
+        print(f"{result['function']:<14}{result['import_ms']:>10.1f}{result['light_ms']:>8.2f}"
+              f"{result['first_request_ms']:>10.1f}  {limits:<30}{heaviest}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5, help='свежих процессов на функцию, в отчёте медиана')
+    parser.add_argument('--only', action='append', help='только эта функция (можно несколько раз)')
+    parser.add_argument('--precompiled', action='store_true', help='заранее собрать байткод, как при деплое с .pyc')
+    parser.add_argument('--output', help='записать результаты в JSON')
+    args = parser.parse_args()
+
+    with open(BUDGETS_PATH, encoding='utf-8') as f:
+        config = json.load(f)
+    firsts = {}
+    for fixture in load_fixtures(args.only):
+        firsts.setdefault(fixture['function'], {'name': fixture['name'], **fixture['event']})
+
+    server = ThreadedMotoServer(port=S3_PORT, verbose=False)
+    server.start()
+    try:
+        with throwaway_postgres() as dsn:
+            seed(dsn, SEED_SIZES)
+            env = {
+                **os.environ,
+                'DATABASE_URL': dsn,
+                'S3_ENDPOINT_URL': f'http://127.0.0.1:{S3_PORT}',
+                'AWS_ACCESS_KEY_ID': os.environ.get('AWS_ACCESS_KEY_ID', 'bench'),
+                'AWS_SECRET_ACCESS_KEY': os.environ.get('AWS_SECRET_ACCESS_KEY', 'bench'),
+                'AWS_DEFAULT_REGION': 'us-east-1',
+                'YANDEX_CLIENT_ID': os.environ.get('YANDEX_CLIENT_ID', 'bench'),
+                'REQUEST_LOG': '0',
+                'PYTHONDONTWRITEBYTECODE': '1'
+            }
+            boto3.client('s3', endpoint_url=env['S3_ENDPOINT_URL'], aws_access_key_id='bench',
+                         aws_secret_access_key='bench', region_name='us-east-1').create_bucket(Bucket='files')
+            results = []
+            for name, first in sorted(firsts.items()):
+                results.append(bench_function(name, first, args.runs, args.precompiled, config['lazy_modules'], env))
+                print(f"{name}: import {results[-1]['import_ms']} ms, first request {results[-1]['first_request_ms']} ms",
+                      flush=True)
+    finally:
+        server.stop()
+
+    budgets = config['precompiled' if args.precompiled else 'source']
+    print_report(results, budgets)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'precompiled': args.precompiled, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f'saved {args.output}')
+
+    problems = [problem for result in results for problem in check_budget(result, budgets.get(result['function']))]
+    for problem in problems:
+        print(f'over budget: {problem}')
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+Проверка инкрементальной синхронизации чата (since_id, long-poll wait) на одноразовом Postgres,
+включая сообщение, закоммиченное позже сообщения с большим id, и предел повтора окна
+Запуск: python scripts/check_chat_sync.py  (нужен TEST_DATABASE_URL или initdb/pg_ctl, см. harness.py)
+'''
+import json
+import threading
+import time
+
+import psycopg2
+
+from harness import invoke, load_function, throwaway_postgres
+
+
+def main() -> None:
+    with throwaway_postgres() as dsn:
+        profiles = load_function('profiles')
+        sender = load_function('chat')
+        poller = load_function('chat')
+
+        for email, name in (('alice@example.com', 'Алиса'), ('bob@example.com', 'Борис')):
+            invoke(profiles, 'POST', body={'user': {'email': email, 'name': name}, 'profile': {'birth_date': '1990-05-15'}})
+
+        first = json.loads(invoke(sender, 'POST', body={'sender_id': 1, 'recipient_id': 2, 'content': 'Привет'})['body'])
+        chat_id, last_id = first['chat_id'], first['message_id']
+
+        response = invoke(poller, 'GET', {'chat_id': str(chat_id), 'since_id': str(last_id)})
+        assert json.loads(response['body']) == [], 'since_id должен отдавать только новые сообщения'
+
+        result = {}
+
+        def long_poll() -> None:
+            started = time.monotonic()
+            response = invoke(poller, 'GET', {'chat_id': str(chat_id), 'since_id': str(last_id), 'wait': '5'})
+            result['elapsed'] = time.monotonic() - started
+            result['messages'] = json.loads(response['body'])
+
+        thread = threading.Thread(target=long_poll)
+        thread.start()
+        time.sleep(0.5)
+        invoke(sender, 'POST', body={'sender_id': 2, 'chat_id': chat_id, 'content': 'Как дела?'})
+        thread.join()
+
+        assert [m['content'] for m in result['messages']] == ['Как дела?'], result
+        assert result['elapsed'] < 2, f"long-poll проснулся через {result['elapsed']:.2f}s вместо NOTIFY"
+
+        # Повторно отданные сообщения окна до since_id новыми не считаются: long-poll всё равно ждёт
+        since_id = result['messages'][-1]['id']
+        started = time.monotonic()
+        response = invoke(poller, 'GET', {'chat_id': str(chat_id), 'since_id': str(since_id), 'wait': '1'})
+        assert all(m['id'] < since_id for m in json.loads(response['body'])), response
+        assert time.monotonic() - started >= 1, 'wait должен ждать до таймаута'
+
+        # Сообщение получило id раньше, а закоммичено позже следующего: клиент, уже видевший следующее, его получит
+        late = psycopg2.connect(dsn)
+        with late.cursor() as cur:
+            cur.execute('''
+                INSERT INTO messages (chat_id, sender_id, content) VALUES (%s, 1, 'Поздний коммит') RETURNING id
+            ''', (chat_id,))
+            late_id = cur.fetchone()[0]
+        newer = json.loads(invoke(sender, 'POST', body={'sender_id': 2, 'chat_id': chat_id, 'content': 'Раньше'})['body'])
+        seen = json.loads(invoke(poller, 'GET', {'chat_id': str(chat_id), 'since_id': str(since_id)})['body'])
+        assert [m['id'] for m in seen if m['id'] > since_id] == [newer['message_id']], seen
+        late.commit()
+        late.close()
+        response = invoke(poller, 'GET', {'chat_id': str(chat_id), 'since_id': str(newer['message_id'])})
+        assert late_id in [m['id'] for m in json.loads(response['body'])], 'сообщение с поздним коммитом потерялось'
+
+        # Повтор окна ограничен SYNC_OVERLAP_LIMIT сообщениями, сколько бы их ни было отправлено за минуту
+        for index in range(poller.SYNC_OVERLAP_LIMIT + 10):
+            last = json.loads(invoke(sender, 'POST', body={'sender_id': 1, 'chat_id': chat_id, 'content': str(index)})['body'])
+        response = invoke(poller, 'GET', {'chat_id': str(chat_id), 'since_id': str(last['message_id'])})
+        assert len(json.loads(response['body'])) == poller.SYNC_OVERLAP_LIMIT, 'повтор окна не ограничен'
+
+        for module in (profiles, sender, poller):
+            module.close_db()
+
+    print(f"ok: long-poll доставил сообщение за {result['elapsed'] * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+Проверка встречных лайков с двух подключений: мэтч и уведомления появляются, даже если лайки пришли одновременно
+Запуск: python scripts/check_like_race.py [--rounds 50]  (нужен TEST_DATABASE_URL или initdb/pg_ctl, см. harness.py)
+'''
+import argparse
+import json
+import threading
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from harness import invoke, load_function, throwaway_postgres
+
+
+def like(module, from_user_id: int, to_user_id: int) -> bool:
+    response = invoke(module, 'POST', body={'from_user_id': from_user_id, 'to_user_id': to_user_id})
+    assert response['statusCode'] == 200, response
+    return json.loads(response['body'])['is_match']
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    with throwaway_postgres() as dsn:
+        conn = psycopg2.connect(dsn)
+        with conn.cursor() as cur:
+            cur.execute('''
+                INSERT INTO users (email, name, provider)
+                SELECT 'race' || i || '@example.com', 'User ' || i, 'guest' FROM generate_series(1, %s) AS i
+            ''', (2 + 2 * args.rounds,))
+        conn.commit()
+        first, second = load_function('likes'), load_function('likes')
+
+        # Лайк 1 -> 2 ещё не закоммичен, когда приходит 2 -> 1: второй ждёт блокировку пары и видит первый
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            assert not first.upsert_likes(cur, 1, [(2, False)])[2]['is_match']
+            result = {}
+            thread = threading.Thread(target=lambda: result.update(is_match=like(second, 2, 1)))
+            thread.start()
+            time.sleep(0.3)
+            assert thread.is_alive(), 'встречный лайк не дождался транзакции первого'
+            conn.commit()
+            thread.join()
+        assert result['is_match'], 'встречный лайк не увидел закоммиченный лайк'
+
+        # Лайк самому себе отклоняется, а upsert_likes не считает повторный лайк себе встречным
+        for body in ({'from_user_id': 1, 'to_user_id': 1}, {'from_user_id': 1, 'likes': [{'to_user_id': 1}]}):
+            response = invoke(first, 'POST', body=body)
+            assert response['statusCode'] == 400, response
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            for _ in range(2):
+                assert not first.upsert_likes(cur, 1, [(1, False)])[1]['is_match'], 'лайк себе дал мэтч'
+        conn.rollback()
+
+        # Одновременные встречные лайки: ровно одна сторона узнаёт о мэтче, мэтч и уведомления есть всегда
+        for pair in range(args.rounds):
+            a, b = 3 + 2 * pair, 4 + 2 * pair
+            barrier = threading.Barrier(2)
+            flags = {}
+
+            def swipe(module, from_user_id: int, to_user_id: int) -> None:
+                barrier.wait()
+                flags[from_user_id] = like(module, from_user_id, to_user_id)
+
+            threads = [threading.Thread(target=swipe, args=(first, a, b)), threading.Thread(target=swipe, args=(second, b, a))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert sorted(flags.values()) == [False, True], (a, b, flags)
+
+        with conn.cursor() as cur:
+            cur.execute('SELECT count(*) FROM matches')
+            assert cur.fetchone()[0] == 2 * (args.rounds + 1)
+            cur.execute("SELECT count(*) FROM notifications WHERE type = 'match'")
+            assert cur.fetchone()[0] == 2 * (args.rounds + 1)
+        conn.close()
+        first.close_db()
+        second.close_db()
+
+    print(f'ok: {args.rounds} одновременных пар встречных лайков, все мэтчи на месте')
+
+
+if __name__ == '__main__':
+    main()
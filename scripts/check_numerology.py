@@ -0,0 +1,73 @@
+'''
+Эталонная проверка нумерологии: значения прежних calculate_life_path/calculate_destiny из profiles/index.py
+и совпадение скалярного и пакетного (NumPy) API на случайной выборке
+Запуск: python scripts/check_numerology.py [--rows 200000]  (нужен numpy, см. scripts/requirements.txt)
+'''
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+from harness import load_module
+
+# Значения сняты с реализации до выноса в numerology.py, менять только вместе с алгоритмом
+GOLDEN_LIFE_PATH = {
+    '1990-05-15': 3, '1985-12-31': 3, '2000-01-01': 4, '1999-09-09': 1,
+    '1977-11-29': 1, '1956-04-08': 33, '2004-02-29': 1, '1988-08-08': 6,
+    '1969-07-20': 7, '1991-11-11': 6, '1975-03-04': 11, '': 0
+}
+GOLDEN_DESTINY = {
+    'Алиса': 5, 'Борис': 7, 'Ёжик': 6, 'Мария Иванова': 8, 'John Smith': 8, 'Anna-Maria': 9,
+    'Щукин Ъ': 8, '': 0, '123': 0, 'Élodie': 9, 'Ярослав Владимирович Щербаков': 9, 'z' * 55: 8
+}
+GOLDEN_COMPATIBILITY = {
+    (1, 1): 100, (1, 3): 85, (4, 8): 70, (3, 9): 55, (1, 9): 40, (11, 9): 85, (22, 33): 40, (33, 1): 40
+}
+
+NAME_ALPHABET = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюяАБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯabcdefghijklmnopqrstuvwxyzABCXYZ -\'K'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+    numerology = load_module('profiles', 'numerology')
+
+    for birth_date, expected in GOLDEN_LIFE_PATH.items():
+        assert numerology.calculate_life_path(birth_date) == expected, birth_date
+    for name, expected in GOLDEN_DESTINY.items():
+        assert numerology.calculate_destiny(name) == expected, name
+    for (a, b), expected in GOLDEN_COMPATIBILITY.items():
+        assert numerology.compatibility(a, b) == expected, (a, b)
+
+    assert numerology.life_path_batch(list(GOLDEN_LIFE_PATH)).tolist() == list(GOLDEN_LIFE_PATH.values())
+    assert numerology.destiny_batch(list(GOLDEN_DESTINY)).tolist() == list(GOLDEN_DESTINY.values())
+    pairs = np.array(list(GOLDEN_COMPATIBILITY))
+    assert numerology.compatibility_batch(pairs[:, 0], pairs[:, 1]).tolist() == list(GOLDEN_COMPATIBILITY.values())
+
+    rng = random.Random(42)
+    dates = [date(1940, 1, 1) + timedelta(days=rng.randrange(30000)) for _ in range(args.rows)]
+    names = [''.join(rng.choice(NAME_ALPHABET) for _ in range(rng.randrange(0, 40))) for _ in range(args.rows)]
+
+    started = time.perf_counter()
+    scalar_life_paths = [numerology.calculate_life_path(str(value)) for value in dates]
+    scalar_destinies = [numerology.calculate_destiny(name) for name in names]
+    scalar_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    life_paths = numerology.life_path_batch(dates)
+    destinies = numerology.destiny_batch(names)
+    scores = numerology.compatibility_batch(life_paths, destinies)
+    batch_seconds = time.perf_counter() - started
+
+    assert life_paths.tolist() == scalar_life_paths, 'life_path_batch разошёлся со скалярной версией'
+    assert destinies.tolist() == scalar_destinies, 'destiny_batch разошёлся со скалярной версией'
+    assert scores.tolist() == [numerology.compatibility(a, b) for a, b in zip(scalar_life_paths, scalar_destinies)]
+
+    print(f'ok: {args.rows} rows, scalar {args.rows / scalar_seconds:,.0f} rows/s, batch {args.rows / batch_seconds:,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
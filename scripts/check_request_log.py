@@ -0,0 +1,76 @@
+'''
+Проверка строки лога с замерами вызова (runtime.py): одна JSON-строка на вызов, запросы к базе, S3 и EXPLAIN медленных SELECT
+Запуск: python scripts/check_request_log.py  (нужен moto[server] и TEST_DATABASE_URL или initdb/pg_ctl, см. harness.py)
+'''
+import base64
+import io
+import json
+import os
+from contextlib import redirect_stdout
+from typing import Any, Dict, List
+
+import boto3
+from moto.server import ThreadedMotoServer
+
+from harness import invoke, load_function, throwaway_postgres
+
+PORT = 5057
+JPEG_BYTES = b'\xff\xd8\xff\xe0' + b'\x00' * 2048
+
+
+def logged(module: Any, *args: Any, **kwargs: Any) -> List[Dict[str, Any]]:
+    '''Вызвать handler и вернуть строки лога, которые он напечатал'''
+    out = io.StringIO()
+    with redirect_stdout(out):
+        invoke(module, *args, **kwargs)
+    return [json.loads(line) for line in out.getvalue().splitlines() if line.startswith('{')]
+
+
+def main() -> None:
+    # Каждый запрос считается медленным, каждый медленный SELECT получает план
+    os.environ.update({'REQUEST_LOG': '1', 'SLOW_QUERY_MS': '0', 'SLOW_QUERY_EXPLAIN_RATE': '1'})
+    server = ThreadedMotoServer(port=PORT, verbose=False)
+    server.start()
+    os.environ.update({
+        'S3_ENDPOINT_URL': f'http://127.0.0.1:{PORT}',
+        'AWS_ACCESS_KEY_ID': 'test',
+        'AWS_SECRET_ACCESS_KEY': 'test',
+        'AWS_DEFAULT_REGION': 'us-east-1'
+    })
+    try:
+        with throwaway_postgres():
+            boto3.client('s3', endpoint_url=os.environ['S3_ENDPOINT_URL']).create_bucket(Bucket='files')
+            profiles = load_function('profiles')
+            upload = load_function('upload-photo')
+
+            (line,) = logged(profiles, 'OPTIONS')
+            assert line['status'] == 200 and line['route'] is None and line['queries'] == 0, line
+
+            (line,) = logged(profiles, 'POST', body={'user': {'email': 'log@example.com', 'name': 'Лог'}})
+            assert line['route'] == 'save_profile' and line['status'] == 200, line
+            assert line['queries'] >= 1 and line['query_rows'] >= 1 and line['response_bytes'] > 0, line
+            assert all(slow['sql'].startswith('SELECT') for slow in line['slow_queries'] if 'plan' in slow), 'EXPLAIN ANALYZE для записи'
+
+            (line,) = logged(profiles, 'GET')
+            assert line['route'] == 'profile_list' and line['queries'] >= 1, line
+            plans = [slow['plan'] for slow in line['slow_queries'] if 'plan' in slow]
+            assert plans and 'Plan' in plans[0] and 'Execution Time' in plans[0], line['slow_queries']
+
+            image = base64.b64encode(JPEG_BYTES).decode()
+            (line,) = logged(upload, 'POST', body={'user_id': '1', 'image': image})
+            assert line['route'] == 'upload' and line['status'] == 200, line
+            assert line['s3_calls'] >= 2 and line['s3_ms'] > 0 and line['queries'] == 1, line
+
+            (line,) = logged(upload, 'DELETE')
+            assert line['status'] == 405 and line['queries'] == 0 and line['s3_calls'] == 0, line
+
+            profiles.close_db()
+            upload.close_db()
+    finally:
+        server.stop()
+
+    print('ok: одна строка лога на вызов, замеры базы и S3, план медленного SELECT')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''
+Проверка presign/finalize и дедупликации загрузки фото на локальном S3 (moto server) и одноразовом Postgres
+Запуск: python scripts/check_upload_presign.py  (нужен moto[server] и TEST_DATABASE_URL или initdb/pg_ctl, см. harness.py)
+'''
+import base64
+import io
+import json
+import os
+import urllib.request
+
+import boto3
+from moto.server import ThreadedMotoServer
+from PIL import Image
+
+from harness import invoke, load_function, throwaway_postgres
+
+PORT = 5055
+
+
+def encode_image(image_format: str, **options) -> bytes:
+    out = io.BytesIO()
+    Image.new('RGB', (64, 48), 'red').save(out, image_format, **options)
+    return out.getvalue()
+
+
+def put(upload, content_type: str, data: bytes) -> str:
+    '''Загрузить байты по presigned URL, как клиент, и вернуть ключ во входящей папке'''
+    presigned = json.loads(invoke(upload, 'POST', body={
+        'action': 'presign', 'user_id': '42', 'content_type': content_type
+    })['body'])
+    request = urllib.request.Request(presigned['upload_url'], data=data, method='PUT', headers=presigned['headers'])
+    with urllib.request.urlopen(request) as response:
+        assert response.status == 200
+    return presigned['key']
+
+
+def main() -> None:
+    server = ThreadedMotoServer(port=PORT, verbose=False)
+    server.start()
+    os.environ.update({
+        'S3_ENDPOINT_URL': f'http://127.0.0.1:{PORT}',
+        'AWS_ACCESS_KEY_ID': 'test',
+        'AWS_SECRET_ACCESS_KEY': 'test',
+        'AWS_DEFAULT_REGION': 'us-east-1'
+    })
+    try:
+        with throwaway_postgres():
+            s3 = boto3.client('s3', endpoint_url=os.environ['S3_ENDPOINT_URL'])
+            s3.create_bucket(Bucket='files')
+            upload = load_function('upload-photo')
+            jpeg_bytes = encode_image('JPEG')
+
+            presigned = json.loads(invoke(upload, 'POST', body={
+                'action': 'presign', 'user_id': '42', 'content_type': 'image/jpeg'
+            })['body'])
+            assert presigned['key'].startswith('profiles/42/incoming/'), presigned
+
+            missing = invoke(upload, 'POST', body={'action': 'finalize', 'user_id': '42', 'key': presigned['key']})
+            assert missing['statusCode'] == 404, missing
+
+            request = urllib.request.Request(presigned['upload_url'], data=jpeg_bytes, method='PUT', headers=presigned['headers'])
+            with urllib.request.urlopen(request) as response:
+                assert response.status == 200
+
+            foreign = invoke(upload, 'POST', body={'action': 'finalize', 'user_id': '7', 'key': presigned['key']})
+            assert foreign['statusCode'] == 400, foreign
+
+            done = json.loads(invoke(upload, 'POST', body={'action': 'finalize', 'user_id': '42', 'key': presigned['key']})['body'])
+            assert done['size'] == len(jpeg_bytes) and not done['deduplicated'] and done['variants'], done
+            assert s3.list_objects_v2(Bucket='files', Prefix='profiles/42/incoming/')['KeyCount'] == 0, 'incoming не удалён'
+
+            image = base64.b64encode(jpeg_bytes).decode()
+            again = json.loads(invoke(upload, 'POST', body={'user_id': '42', 'image': image})['body'])
+            assert again['deduplicated'] and again['filename'] == done['filename'], again
+
+            # Тип берётся из байтов: HTML под image/png и PNG-сигнатура с мусором отклоняются и удаляются
+            for content_type, data in (
+                ('image/png', b'<html><script>alert(1)</script></html>'),
+                ('image/png', b'\x89PNG\r\n\x1a\n' + b'junk' * 64)
+            ):
+                rejected = invoke(upload, 'POST', body={'action': 'finalize', 'user_id': '42', 'key': put(upload, content_type, data)})
+                assert rejected['statusCode'] == 400, rejected
+            assert s3.list_objects_v2(Bucket='files', Prefix='profiles/42/incoming/')['KeyCount'] == 0, 'отклонённый файл не удалён'
+
+            # PNG, загруженный под image/jpeg, хранится как PNG
+            png = json.loads(invoke(upload, 'POST', body={
+                'action': 'finalize', 'user_id': '42', 'key': put(upload, 'image/jpeg', encode_image('PNG'))
+            })['body'])
+            assert png['filename'].endswith('.png'), png
+            assert s3.head_object(Bucket='files', Key=png['filename'])['ContentType'] == 'image/png'
+
+            # Публичный оригинал отдаётся без EXIF: ни GPS, ни модели камеры
+            exif = Image.Exif()
+            exif[0x010F] = 'CameraMaker'
+            exif[0x8825] = {1: 'N', 2: (55.0, 45.0, 0.0)}
+            stored = json.loads(invoke(upload, 'POST', body={
+                'user_id': '42', 'image': base64.b64encode(encode_image('JPEG', exif=exif.tobytes())).decode()
+            })['body'])
+            original = s3.get_object(Bucket='files', Key=stored['filename'])['Body'].read()
+            assert b'Exif' not in original and b'CameraMaker' not in original, 'EXIF остался в оригинале'
+
+            upload.close_db()
+    finally:
+        server.stop()
+
+    print('ok: presign -> PUT -> finalize -> dedup, не-изображения отклонены, оригинал без EXIF')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+'''
+Сборщик мусора фото: удаляет из S3 объекты, на которые не ссылается ни один профиль
+Запуск: DATABASE_URL=... AWS_ACCESS_KEY_ID=... AWS_SECRET_ACCESS_KEY=... python scripts/gc_photos.py [--grace-hours 24] [--dry-run]
+'''
+import argparse
+import os
+from typing import List
+
+import boto3
+import psycopg2
+
+BUCKET = 'files'
+BATCH_SIZE = 1000
+VARIANT_NAMES = ('full', 'card', 'avatar')
+VARIANT_EXTS = ('webp', 'jpg')
+
+
+def object_keys(key: str) -> List[str]:
+    '''Оригинал и все возможные уменьшенные копии объекта'''
+    base = key.rsplit('.', 1)[0]
+    return [key] + [f'{base}_{name}.{ext}' for name in VARIANT_NAMES for ext in VARIANT_EXTS]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--grace-hours', type=float, default=24,
+                        help='не трогать объекты моложе: загрузка могла ещё не попасть в профиль')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    s3 = boto3.client(
+        's3',
+        endpoint_url=os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev'),
+        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+    )
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    removed = 0
+    try:
+        while True:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    SELECT s3_key FROM photo_refs
+                    WHERE ref_count <= 0 AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    ORDER BY updated_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                ''', (args.grace_hours * 3600, BATCH_SIZE))
+                keys = [row[0] for row in cur.fetchall()]
+                if not keys:
+                    break
+                if args.dry_run:
+                    print('\n'.join(keys))
+                    removed += len(keys)
+                    break
+
+                objects = [{'Key': k} for key in keys for k in object_keys(key)]
+                for start in range(0, len(objects), BATCH_SIZE):
+                    s3.delete_objects(Bucket=BUCKET, Delete={'Objects': objects[start:start + BATCH_SIZE], 'Quiet': True})
+
+                cur.execute('DELETE FROM photo_refs WHERE s3_key = ANY(%s) AND ref_count <= 0', (keys,))
+            conn.commit()
+            removed += len(keys)
+    finally:
+        conn.close()
+
+    print(f"{'would remove' if args.dry_run else 'removed'} {removed} photos")
+
+
+if __name__ == '__main__':
+    main()
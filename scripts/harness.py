@@ -0,0 +1,119 @@
+'''
+Локальный стенд для функций backend: одноразовый Postgres с миграциями и прямой вызов handler(event, context)
+Postgres берётся из TEST_DATABASE_URL (создаётся временная база) или поднимается через initdb/pg_ctl из PG_BIN или PATH
+'''
+import glob
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import uuid
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import quote
+
+import psycopg2
+
+from loader import BACKEND_DIR, REPO_ROOT, load_module
+
+MIGRATIONS_DIR = os.path.join(REPO_ROOT, 'db_migrations')
+
+# Строка лога на каждый вызов (runtime.py) в проверках и бенчмарках только мешает; включается REQUEST_LOG=1
+os.environ.setdefault('REQUEST_LOG', '0')
+
+
+def load_function(name: str) -> ModuleType:
+    '''Загрузить index.py функции как отдельный модуль; каждый вызов даёт свой экземпляр со своим подключением'''
+    return load_module(name, 'index')
+
+
+def invoke(module: ModuleType, method: str = 'GET', params: Optional[Dict[str, str]] = None,
+           body: Any = None, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    '''Вызвать handler так же, как это делает платформа'''
+    event = {
+        'httpMethod': method,
+        'queryStringParameters': params or {},
+        'headers': headers or {},
+        'body': json.dumps(body) if body is not None else '{}',
+        'isBase64Encoded': False
+    }
+    return module.handler(event, None)
+
+
+def apply_migrations(dsn: str) -> None:
+    '''Применить db_migrations/V*.sql по порядку'''
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, 'V*.sql'))):
+                with open(path, encoding='utf-8') as f:
+                    cur.execute(f.read())
+    finally:
+        conn.close()
+
+
+@contextmanager
+def _temporary_database(admin_dsn: str) -> Iterator[str]:
+    '''Временная база на существующем сервере'''
+    name = f'harness_{uuid.uuid4().hex[:12]}'
+    admin = psycopg2.connect(admin_dsn)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f'CREATE DATABASE {name}')
+        dsn = psycopg2.extensions.make_dsn(admin_dsn, dbname=name)
+        yield dsn
+    finally:
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS {name} WITH (FORCE)')
+        admin.close()
+
+
+def _run(*args: str) -> None:
+    '''Запустить утилиту Postgres, при ошибке показать её stderr'''
+    completed = subprocess.run(args, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f'{os.path.basename(args[0])}: {completed.stderr.strip()}')
+
+
+@contextmanager
+def _temporary_cluster() -> Iterator[str]:
+    '''Временный кластер через initdb/pg_ctl, слушает только unix-сокет во временном каталоге'''
+    pg_bin = os.environ.get('PG_BIN', '')
+    tool = lambda name: os.path.join(pg_bin, name) if pg_bin else shutil.which(name)
+    if not tool('initdb') or not tool('pg_ctl'):
+        raise RuntimeError('Нужен TEST_DATABASE_URL или initdb/pg_ctl в PATH (или PG_BIN)')
+
+    root = tempfile.mkdtemp(prefix='pg_harness_')
+    data_dir = os.path.join(root, 'data')
+    _run(tool('initdb'), '-D', data_dir, '-U', 'postgres', '-A', 'trust')
+    _run(
+        tool('pg_ctl'), '-D', data_dir, '-l', os.path.join(root, 'postgres.log'), '-w',
+        '-o', f"-c listen_addresses='' -k {root}", 'start'
+    )
+    try:
+        yield f'postgresql://postgres@/postgres?host={quote(root, safe="")}'
+    finally:
+        subprocess.run([tool('pg_ctl'), '-D', data_dir, '-m', 'immediate', 'stop'], capture_output=True)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+@contextmanager
+def throwaway_postgres() -> Iterator[str]:
+    '''Одноразовая база с применёнными миграциями; DATABASE_URL на время блока указывает на неё'''
+    admin_dsn = os.environ.get('TEST_DATABASE_URL')
+    source = _temporary_database(admin_dsn) if admin_dsn else _temporary_cluster()
+    previous = os.environ.get('DATABASE_URL')
+    with source as dsn:
+        apply_migrations(dsn)
+        os.environ['DATABASE_URL'] = dsn
+        try:
+            yield dsn
+        finally:
+            if previous is None:
+                os.environ.pop('DATABASE_URL', None)
+            else:
+                os.environ['DATABASE_URL'] = previous
@@ -0,0 +1,32 @@
+'''
+Загрузка модулей функций backend из скриптов: без стенда и без зависимостей кроме stdlib
+Используется и стендом проверок (harness.py), и скриптами обслуживания (refresh_candidates.py, backfill_numerology.py)
+'''
+import importlib.util
+import os
+import sys
+import uuid
+from types import ModuleType
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(REPO_ROOT, 'backend')
+
+
+def load_module(name: str, module_name: str) -> ModuleType:
+    '''Загрузить модуль из папки функции (index или соседний, например numerology) отдельным экземпляром'''
+    function_dir = os.path.join(BACKEND_DIR, name)
+    before = set(sys.modules)
+    sys.path.insert(0, function_dir)
+    try:
+        spec = importlib.util.spec_from_file_location(
+            f'{name.replace("-", "_")}_{module_name}_{uuid.uuid4().hex[:8]}', os.path.join(function_dir, f'{module_name}.py')
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(function_dir)
+        # Соседние модули функций называются одинаково, следующая функция должна импортировать свои
+        for key in set(sys.modules) - before:
+            if (getattr(sys.modules[key], '__file__', None) or '').startswith(function_dir + os.sep):
+                del sys.modules[key]
+    return module
@@ -0,0 +1,272 @@
+'''
+Пересчёт таблицы candidates: top-K профилей для ленты каждого активного пользователя
+Порядок тот же, что у живого запроса ленты: совместимость по жизненному пути, по числу судьбы, новые первыми
+Без --full пересчитываются только пользователи без списка, со своим изменённым профилем, со списком,
+где изменился кандидат, и те, в чей список мог попасть изменённый с прошлого пересчёта профиль
+Запуск: DATABASE_URL=... python scripts/refresh_candidates.py [--k 200] [--workers 4] [--active-days 30] [--full] [--dry-run]
+'''
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from loader import load_module
+
+# Числа, для которых есть строки в compatibility_scores; с другими живой запрос ленты профиль не показывает
+SCORED_NUMBERS = tuple(range(1, 10)) + (11, 22, 33)
+# Сколько лишних позиций держать в кэше порядка когорты под уже лайкнутых
+PREFIX_MARGIN = 1000
+# Запас computed_at на транзакции, начатые до снимка и закоммиченные после него
+SNAPSHOT_MARGIN = '1 minute'
+
+UPSERT_SQL = '''
+    INSERT INTO candidates (
+        user_id, candidate_ids, scores, destiny_scores, cutoff_score, cutoff_destiny_score, computed_at
+    )
+    VALUES %s
+    ON CONFLICT (user_id) DO UPDATE SET
+        candidate_ids = EXCLUDED.candidate_ids,
+        scores = EXCLUDED.scores,
+        destiny_scores = EXCLUDED.destiny_scores,
+        cutoff_score = EXCLUDED.cutoff_score,
+        cutoff_destiny_score = EXCLUDED.cutoff_destiny_score,
+        computed_at = EXCLUDED.computed_at
+'''
+
+_state: Dict[str, Any] = {}
+
+
+def array_literal(values: np.ndarray) -> str:
+    '''Литерал массива Postgres, -1 становится NULL; адаптация списков в psycopg2 занимала большую часть записи'''
+    return '{' + ','.join(map(str, values.tolist())).replace('-1', 'NULL') + '}'
+
+
+def load_pool(cur) -> Dict[str, np.ndarray]:
+    '''Все профили: пул видимых кандидатов и числа каждого пользователя'''
+    cur.execute('''
+        SELECT user_id, COALESCE(life_path, 0), COALESCE(destiny, 0), is_visible,
+               EXTRACT(EPOCH FROM created_at), EXTRACT(EPOCH FROM updated_at)
+        FROM profiles
+        WHERE user_id IS NOT NULL
+    ''')
+    rows = cur.fetchall()
+    user_ids, life_paths, destinies, visible, created, updated = (np.array(column) for column in zip(*rows)) \
+        if rows else (np.zeros(0),) * 6
+    scored_life_path = np.isin(life_paths, SCORED_NUMBERS)
+    pool = visible.astype(bool) & scored_life_path
+    return {
+        'user_ids': user_ids.astype(np.int64),
+        'life_paths': life_paths.astype(np.int16),
+        'destinies': destinies.astype(np.int16),
+        'updated': updated.astype(np.float64),
+        'pool_user_ids': user_ids[pool].astype(np.int64),
+        'pool_life_paths': life_paths[pool].astype(np.int16),
+        'pool_destinies': destinies[pool].astype(np.int16),
+        'pool_created': created[pool].astype(np.float64)
+    }
+
+
+def pair_scores(numerology, life_path: int, destiny: int, life_paths: np.ndarray, destinies: np.ndarray
+                ) -> Tuple[np.ndarray, np.ndarray]:
+    '''Совместимость по жизненному пути и по судьбе; -1 там, где живой запрос получил бы NULL из LEFT JOIN'''
+    scores = numerology.compatibility_batch(np.full(len(life_paths), life_path), life_paths)
+    destiny_scores = numerology.compatibility_batch(np.full(len(destinies), destiny), destinies)
+    if destiny not in SCORED_NUMBERS:
+        destiny_scores = np.full(len(destinies), -1, dtype=np.int16)
+    else:
+        destiny_scores = np.where(np.isin(destinies, SCORED_NUMBERS), destiny_scores, -1).astype(np.int16)
+    return scores, destiny_scores
+
+
+def _init_worker(dsn: str, pool: Dict[str, np.ndarray], k: int, computed_at: datetime) -> None:
+    _state.update(dsn=dsn, pool=pool, k=k, computed_at=computed_at, conn=None, orders={},
+                  numerology=load_module('profiles', 'numerology'))
+
+
+def cohort_order(life_path: int, destiny: int, length: Optional[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Порядок пула для пары (life_path, destiny): у всех таких пользователей он одинаков, считается один раз'''
+    key = (life_path, destiny, length)
+    if key not in _state['orders']:
+        pool = _state['pool']
+        scores, destiny_scores = pair_scores(
+            _state['numerology'], life_path, destiny, pool['pool_life_paths'], pool['pool_destinies']
+        )
+        order = np.lexsort((-pool['pool_user_ids'], -pool['pool_created'], -destiny_scores, -scores))
+        if length is not None:
+            order = order[:length]
+        _state['orders'][key] = (pool['pool_user_ids'][order], scores[order], destiny_scores[order])
+    return _state['orders'][key]
+
+
+def top_candidates(user_id: int, life_path: int, destiny: int, liked: set) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''Первые K кандидатов без себя и уже лайкнутых'''
+    k = _state['k']
+    needed = k + len(liked) + 1
+    length = k + PREFIX_MARGIN if needed <= k + PREFIX_MARGIN else None
+    ids, scores, destiny_scores = cohort_order(life_path, destiny, length)
+    excluded = np.fromiter(liked | {user_id}, dtype=np.int64)
+    keep = ~np.isin(ids[:needed], excluded)
+    return ids[:needed][keep][:k], scores[:needed][keep][:k], destiny_scores[:needed][keep][:k]
+
+
+def refresh_chunk(users: List[Tuple[int, int, int]]) -> int:
+    '''Пересчитать и записать списки для пачки пользователей (user_id, life_path, destiny)'''
+    if _state['conn'] is None:
+        _state['conn'] = psycopg2.connect(_state['dsn'])
+    conn = _state['conn']
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT from_user_id, array_agg(to_user_id) FROM likes
+            WHERE from_user_id = ANY(%s)
+            GROUP BY from_user_id
+        ''', ([user_id for user_id, _, _ in users],))
+        likes = {from_user_id: set(to_user_ids) for from_user_id, to_user_ids in cur.fetchall()}
+
+        rows = []
+        for user_id, life_path, destiny in users:
+            if life_path not in SCORED_NUMBERS:
+                ids = scores = destiny_scores = np.zeros(0, dtype=np.int64)
+            else:
+                ids, scores, destiny_scores = top_candidates(user_id, life_path, destiny, likes.get(user_id, set()))
+            full = len(ids) == _state['k']
+            rows.append((
+                user_id,
+                array_literal(ids),
+                array_literal(scores),
+                array_literal(destiny_scores),
+                int(scores[-1]) if full else None,
+                int(destiny_scores[-1]) if full else None,
+                _state['computed_at']
+            ))
+        execute_values(
+            cur, UPSERT_SQL, rows,
+            template='(%s, %s::INTEGER[], %s::SMALLINT[], %s::SMALLINT[], %s, %s, %s)', page_size=len(rows)
+        )
+    conn.commit()
+    return len(rows)
+
+
+def stale_users(cur, numerology, pool: Dict[str, np.ndarray], active: np.ndarray) -> np.ndarray:
+    '''Активные пользователи, чей список мог устареть с прошлого пересчёта'''
+    cur.execute('''
+        SELECT user_id, COALESCE(cutoff_score, -1), COALESCE(cutoff_destiny_score, -1), EXTRACT(EPOCH FROM computed_at)
+        FROM candidates
+        WHERE user_id = ANY(%s)
+    ''', (active.tolist(),))
+    rows = cur.fetchall()
+    if not rows:
+        return active
+    list_user_ids, cutoffs, cutoff_destinies, computed = (np.array(column, dtype=np.float64) for column in zip(*rows))
+    list_user_ids = list_user_ids.astype(np.int64)
+
+    cur.execute('''
+        SELECT user_id, COALESCE(life_path, 0), COALESCE(destiny, 0), is_visible, EXTRACT(EPOCH FROM updated_at)
+        FROM profiles
+        WHERE updated_at > (SELECT MIN(computed_at) FROM candidates WHERE user_id = ANY(%s)) AND user_id IS NOT NULL
+    ''', (active.tolist(),))
+    changed = cur.fetchall()
+
+    # Без списка или со своим изменённым профилем
+    stale = set(np.setdiff1d(active, list_user_ids).tolist())
+    index = {user_id: i for i, user_id in enumerate(pool['user_ids'].tolist())}
+    positions = np.array([index[user_id] for user_id in list_user_ids.tolist()], dtype=np.int64)
+    stale.update(list_user_ids[pool['updated'][positions] > computed].tolist())
+
+    # Список содержит изменённого кандидата: тот мог скрыться или сменить числа
+    cur.execute('SELECT user_id FROM candidates WHERE candidate_ids && %s::INTEGER[]', ([row[0] for row in changed],))
+    stale.update(row[0] for row in cur.fetchall())
+
+    # Изменённые видимые профили по парам чисел с позднейшим изменением; профиль пары попадает в список,
+    # если изменился после пересчёта и его оценки не ниже оценок последнего кандидата
+    latest: Dict[Tuple[int, int], float] = {}
+    for _, life_path, destiny, visible, updated in changed:
+        if visible and life_path in SCORED_NUMBERS:
+            latest[(life_path, destiny)] = max(latest.get((life_path, destiny), 0.0), float(updated))
+    if latest:
+        key_life_paths, key_destinies = (np.array(column) for column in zip(*latest))
+        key_updated = np.array(list(latest.values()))
+        life_paths = pool['life_paths'][positions]
+        destinies = pool['destinies'][positions]
+        for life_path, destiny in set(zip(life_paths.tolist(), destinies.tolist())):
+            cohort = (life_paths == life_path) & (destinies == destiny)
+            scores, destiny_scores = pair_scores(numerology, life_path, destiny, key_life_paths, key_destinies)
+            cutoff, cutoff_destiny = cutoffs[cohort][:, None], cutoff_destinies[cohort][:, None]
+            qualifies = (scores > cutoff) | ((scores == cutoff) & (destiny_scores >= cutoff_destiny))
+            newer = key_updated > computed[cohort][:, None]
+            stale.update(list_user_ids[cohort][(qualifies & newer).any(axis=1)].tolist())
+
+    return np.array(sorted(stale & set(active.tolist())), dtype=np.int64)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--k', type=int, default=200, help='длина списка кандидатов')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--active-days', type=float, default=30, help='списки только для заходивших за эти дни')
+    parser.add_argument('--full', action='store_true', help='пересчитать всех активных, не только изменившихся')
+    parser.add_argument('--dry-run', action='store_true', help='только посчитать, скольких пользователей пересчитать')
+    args = parser.parse_args()
+
+    dsn = os.environ['DATABASE_URL']
+    numerology = load_module('profiles', 'numerology')
+    started = time.perf_counter()
+
+    # Один снимок на всё чтение. Пишущий ставит updated_at = начало своей транзакции, и изменение, закоммиченное
+    # после снимка, несёт метку раньше now(): computed_at отодвигается к началу самой старой открытой транзакции
+    # (чужие видны с pg_read_all_stats) и не меньше чем на SNAPSHOT_MARGIN. Такие изменения попадут в следующий
+    # пересчёт, а уже учтённые из этого окна лишь пересчитаются ещё раз
+    conn = psycopg2.connect(dsn)
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    try:
+        with conn.cursor() as cur:
+            cur.execute('''
+                SELECT LEAST(now() - %s::INTERVAL, MIN(xact_start))::TIMESTAMP
+                FROM pg_stat_activity
+                WHERE backend_type = 'client backend'
+            ''', (SNAPSHOT_MARGIN,))
+            computed_at = cur.fetchone()[0]
+            pool = load_pool(cur)
+            cur.execute('''
+                SELECT p.user_id FROM profiles p
+                JOIN users u ON u.id = p.user_id
+                WHERE u.last_active >= now() - make_interval(days => %s)
+            ''', (args.active_days,))
+            active = np.array([row[0] for row in cur.fetchall()], dtype=np.int64)
+            users = active if args.full else stale_users(cur, numerology, pool, active)
+    finally:
+        conn.close()
+
+    print(f'{len(users)} of {len(active)} active users to refresh, '
+          f"{len(pool['pool_user_ids'])} visible candidates, snapshot {computed_at}", flush=True)
+    if args.dry_run or not len(users):
+        return
+
+    index = {user_id: i for i, user_id in enumerate(pool['user_ids'].tolist())}
+    # Пользователи одной пары чисел идут подряд, чтобы порядок когорты в процессе переиспользовался
+    work = sorted(
+        ((user_id, int(pool['life_paths'][index[user_id]]), int(pool['destinies'][index[user_id]])) for user_id in users.tolist()),
+        key=lambda user: (user[1], user[2], user[0])
+    )
+    chunks = [work[start:start + args.chunk_size] for start in range(0, len(work), args.chunk_size)]
+
+    refreshed = 0
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=_init_worker, initargs=(dsn, pool, args.k, computed_at)
+    ) as executor:
+        for count in executor.map(refresh_chunk, chunks):
+            refreshed += count
+            elapsed = time.perf_counter() - started
+            print(f'refreshed={refreshed}/{len(work)} users/s={refreshed / elapsed:,.0f}', flush=True)
+
+    print(f'refreshed {refreshed} candidate lists in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()